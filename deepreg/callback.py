@@ -60,9 +60,51 @@ class CheckpointManagerCallback(tf.keras.callbacks.Callback):
             self._last_save = self._epoch_count
 
 
+def build_optimizer_variables(model: tf.keras.Model):
+    """
+    Create the optimizer variables of a compiled model without a training step.
+
+    The slot variables, e.g. the moments of Adam, are created for all trainable
+    variables so that they can be restored from a checkpoint.
+    Before tensorflow 2.11, optimizers have no build method, the variables are
+    created as in apply_gradients but without incrementing the iterations,
+    which would shift the learning rate schedules.
+
+    :param model: built and compiled model
+    """
+    optimizer = model.optimizer
+    var_list = model.trainable_variables
+    with model.distribute_strategy.scope():
+        if hasattr(optimizer, "build"):
+            optimizer.build(var_list)
+        else:
+            optimizer._create_all_weights(var_list)
+
+
+def restore_model(model: tf.keras.Model, ckpt_path: str):
+    """
+    Restore the model weights of a checkpoint for inference.
+
+    The optimizer state is not restored, so that neither a training step
+    nor the optimizer variables are needed.
+
+    :param model: built model
+    :param ckpt_path: path of the checkpoint, either from the checkpoint manager,
+        like log_folder/save/ckpt-x, or from tf.keras.callbacks.ModelCheckpoint,
+        ending with .ckpt
+    """
+    if ckpt_path.endswith(".ckpt"):
+        # for ckpt from tf.keras.callbacks.ModelCheckpoint
+        # skip warnings because of optimizers
+        # https://stackoverflow.com/questions/58289342/tf2-0-translation-model-error-when-restoring-the-saved-model-unresolved-object
+        model.load_weights(ckpt_path).expect_partial()  # pragma: no cover
+    else:
+        # for ckpts from ckpt manager callback
+        tf.train.Checkpoint(model=model).restore(ckpt_path).expect_partial()
+
+
 def build_checkpoint_callback(
     model: tf.keras.Model,
-    dataset: tf.data.Dataset,
     log_dir: str,
     save_period: int,
     ckpt_path: str,
@@ -70,19 +112,14 @@ def build_checkpoint_callback(
     """
     Function to prepare callbacks for training.
 
-    :param model: model to train
-    :param dataset: dataset for training
+    :param model: model to train, built and compiled
     :param log_dir: directory of logs
     :param save_period: save the checkpoint every X epochs
     :param ckpt_path: path to restore ckpt
     :return: a list of callbacks
     """
-    # fit the model for 1 step to initialise optimiser arguments as trackable Variables
-    model.fit(
-        x=dataset,
-        steps_per_epoch=1,
-        epochs=1,
-    )
+    # initialise optimiser arguments as trackable Variables to restore them
+    build_optimizer_variables(model=model)
     checkpoint_manager_callback = CheckpointManagerCallback(
         model, log_dir + "/save", period=save_period
     )
@@ -84,8 +84,8 @@ def config_sanity_check(config: dict) -> dict:
     if data_config["type"] not in ["paired", "unpaired", "grouped"]:
         raise ValueError(f"data type must be paired / unpaired / grouped, got {type}.")
 
-    if data_config["format"] not in ["nifti", "h5"]:
-        raise ValueError(f"data format must be nifti / h5, got {format}.")
+    if data_config["format"] not in ["nifti", "h5", "shard"]:
+        raise ValueError(f"data format must be nifti / h5 / shard, got {format}.")
 
     assert "dir" in data_config
     for mode in ["train", "valid", "test"]:
@@ -0,0 +1,236 @@
+# coding=utf-8
+
+"""
+Module to convert a data set into shard files. A CLI tool is provided.
+"""
+
+import argparse
+import logging
+import os
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from deepreg.dataset.loader.interface import FileLoader
+from deepreg.dataset.loader.shard_loader import (
+    SHARD_FILE_FORMAT,
+    SHARD_FILE_SUFFIX,
+    write_shard,
+)
+from deepreg.registry import FILE_LOADER_CLASS, REGISTRY
+
+# (name, is_label) of the data sets for each data type
+DATA_NAMES = dict(
+    paired=[
+        ("moving_images", False),
+        ("fixed_images", False),
+        ("moving_labels", True),
+        ("fixed_labels", True),
+    ],
+    unpaired=[("images", False), ("labels", True)],
+    grouped=[("images", False), ("labels", True)],
+)
+
+
+def iter_data(loader: FileLoader) -> Iterator[Tuple[Tuple[str, ...], np.ndarray]]:
+    """
+    Iterate over all arrays of a file loader.
+
+    :param loader: file loader.
+    :return: iterator of (data_id, array), data_id being the id of the array
+        without the directory path.
+    """
+    data_ids = loader.get_data_ids()
+    if loader.grouped:
+        for group_index, group in enumerate(loader.group_struct):  # type: ignore
+            for in_group_data_index, data_index in enumerate(group):
+                arr = loader.get_data(index=(group_index, in_group_data_index))
+                yield tuple(data_ids[data_index][1:]), arr
+    else:
+        for data_index in range(loader.get_num_images()):
+            yield tuple(data_ids[data_index][1:]), loader.get_data(index=data_index)
+
+
+def validate_data(arr: np.ndarray, data_id: Tuple[str, ...], label: bool):
+    """
+    Check the shape and values of one array,
+    such that the data loaders do not need to check the values of each sample.
+
+    :param arr: image or label array.
+    :param data_id: id of the array.
+    :param label: whether the array is a label.
+    """
+    if label:
+        if len(arr.shape) not in [3, 4]:
+            raise ValueError(
+                f"Label {data_id}'s shape should be 3D or 4D. Got {arr.shape}."
+            )
+        if np.min(arr) < 0 or np.max(arr) > 1:
+            raise ValueError(
+                f"Label {data_id}'s values are not between [0, 1]. "
+                f"Its minimum value is {np.min(arr)} "
+                f"and its maximum value is {np.max(arr)}."
+            )
+    elif len(arr.shape) != 3:
+        raise ValueError(f"Image {data_id}'s shape should be 3D. Got {arr.shape}.")
+
+
+def convert_data_set(
+    loader: FileLoader, out_dir: str, label: bool, max_shard_size: int
+) -> int:
+    """
+    Write all arrays of one file loader into shard files.
+
+    The arrays are first written in temporary shard files,
+    which are renamed once the number of shards is known.
+
+    :param loader: file loader.
+    :param out_dir: directory to save the shards.
+    :param label: whether the arrays are labels.
+    :param max_shard_size: maximum number of bytes of arrays per shard.
+    :return: number of arrays converted.
+    """
+    num_arrays = 0
+    tmp_paths: List[str] = []
+    shard_data: List[Tuple[Tuple[str, ...], np.ndarray]] = []
+    shard_size = 0
+
+    def flush():
+        tmp_path = os.path.join(
+            out_dir, f".{loader.name}-{len(tmp_paths):05d}.{SHARD_FILE_SUFFIX}"
+        )
+        write_shard(
+            file_path=tmp_path,
+            data=shard_data,
+            grouped=loader.grouped,
+            label=label,
+            validated=True,
+        )
+        tmp_paths.append(tmp_path)
+
+    for data_id, arr in iter_data(loader):
+        validate_data(arr=arr, data_id=data_id, label=label)
+        if label and np.array_equal(arr, arr.astype(bool)):
+            # binary masks are stored with one byte per voxel
+            arr = arr.astype(np.uint8)
+        if shard_data and shard_size + arr.nbytes > max_shard_size:
+            flush()
+            shard_data, shard_size = [], 0
+        shard_data.append((data_id, arr))
+        shard_size += arr.nbytes
+        num_arrays += 1
+    if shard_data:
+        flush()
+
+    for index, tmp_path in enumerate(tmp_paths):
+        file_name = SHARD_FILE_FORMAT.format(
+            name=loader.name, index=index, num_shards=len(tmp_paths)
+        )
+        os.replace(tmp_path, os.path.join(out_dir, file_name))
+    logging.info(
+        f"Converted {num_arrays} arrays of {loader.name} "
+        f"into {len(tmp_paths)} shard(s)."
+    )
+    return num_arrays
+
+
+def convert(
+    data_dir: str,
+    out_dir: str,
+    data_format: str,
+    data_type: str,
+    max_shard_size: int = 1024,
+):
+    """
+    Convert a data set of paired, unpaired or grouped images into shard files.
+
+    :param data_dir: directory storing the data, having the layout
+        expected by the data loader of data_type.
+    :param out_dir: directory to save the shards.
+    :param data_format: format of the data, nifti or h5.
+    :param data_type: paired, unpaired or grouped.
+    :param max_shard_size: maximum size of a shard in megabytes.
+    """
+    if data_type not in DATA_NAMES:
+        raise ValueError(
+            f"data type must be paired / unpaired / grouped, got {data_type}."
+        )
+    file_loader = REGISTRY.get(category=FILE_LOADER_CLASS, key=data_format)
+    grouped = data_type == "grouped"
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name, label in DATA_NAMES[data_type]:
+        try:
+            loader = file_loader(dir_paths=[data_dir], name=name, grouped=grouped)
+        except AssertionError:
+            if not label:
+                raise
+            logging.warning(f"No {name} found in {data_dir}, data are unlabeled.")
+            continue
+        convert_data_set(
+            loader=loader,
+            out_dir=out_dir,
+            label=label,
+            max_shard_size=max_shard_size * 1024 * 1024,
+        )
+        loader.close()
+
+
+def main(args=None):
+    """
+    Entry point for convert script.
+
+    :param args:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--data_dir",
+        "-d",
+        help="Directory of the data to convert, e.g. data/paired/train",
+        type=str,
+        required=True,
+    )
+
+    parser.add_argument(
+        "--out_dir", "-o", help="Output directory of shards", type=str, required=True
+    )
+
+    parser.add_argument(
+        "--format",
+        "-f",
+        help="Format of the data",
+        type=str,
+        choices=["nifti", "h5"],
+        required=True,
+    )
+
+    parser.add_argument(
+        "--type",
+        "-t",
+        help="Type of the data",
+        type=str,
+        choices=list(DATA_NAMES.keys()),
+        required=True,
+    )
+
+    parser.add_argument(
+        "--max_shard_size",
+        help="Maximum size of a shard in megabytes",
+        type=int,
+        default=1024,
+    )
+
+    # init arguments
+    args = parser.parse_args(args)
+    convert(
+        data_dir=args.data_dir,
+        out_dir=args.out_dir,
+        data_format=args.format,
+        data_type=args.type,
+        max_shard_size=args.max_shard_size,
+    )
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -3,4 +3,5 @@ from deepreg.dataset.loader.grouped_loader import GroupedDataLoader
 from deepreg.dataset.loader.h5_loader import H5FileLoader
 from deepreg.dataset.loader.nifti_loader import NiftiFileLoader
 from deepreg.dataset.loader.paired_loader import PairedDataLoader
+from deepreg.dataset.loader.shard_loader import ShardFileLoader
 from deepreg.dataset.loader.unpaired_loader import UnpairedDataLoader
@@ -0,0 +1,107 @@
+"""
+On-disk cache of preprocessed volumes.
+
+Decoding a compressed Nifti file and resizing the volume dominate the
+cost of the data pipeline, and the same files are read again in every epoch.
+VolumeCache stores the normalized and resized float32 arrays as .npy files
+which are memory-mapped when read back.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+
+CACHE_FILE_SUFFIX = ".npy"
+
+
+class VolumeCache:
+    """
+    Store preprocessed volumes in a directory as memory-mapped .npy files.
+
+    A volume is identified by the file it has been read from, the key of the data
+    inside the file, the target shape and whether it has been normalized.
+    The modification time and size of the source file are part of the cache key,
+    so that modified files are automatically invalidated.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Init.
+
+        :param cache_dir: directory where the cached arrays are saved,
+            it is created if it does not exist.
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(
+        file_path: str, data_key: str, shape: Tuple[int, ...], normalize: bool
+    ) -> str:
+        """
+        Build the key identifying a preprocessed volume.
+
+        :param file_path: path of the file storing the raw volume.
+        :param data_key: key of the volume inside the file, empty string if the
+            file stores one single volume.
+        :param shape: shape of the volume after resizing, (dim1, dim2, dim3).
+        :param normalize: whether the volume has been normalized.
+        :return: hexadecimal digest of the key.
+        """
+        stat = os.stat(file_path)
+        key = (
+            os.path.abspath(file_path),
+            data_key,
+            stat.st_mtime_ns,
+            stat.st_size,
+            tuple(int(x) for x in shape),
+            bool(normalize),
+        )
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        """
+        :param key: key returned by get_key.
+        :return: path of the cache file.
+        """
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """
+        Load a cached array without reading it into memory.
+
+        :param key: key returned by get_key.
+        :return: the memory-mapped array, None if the key is not cached.
+        """
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode="r")
+        except ValueError:
+            # truncated file, e.g. written by an interrupted process
+            return None
+
+    def save(self, key: str, arr: np.ndarray) -> np.ndarray:
+        """
+        Save an array to the cache.
+
+        The array is first written to a temporary file and then renamed,
+        so that concurrent readers never see a partially written file.
+
+        :param key: key returned by get_key.
+        :param arr: array to cache.
+        :return: the cached array, memory-mapped.
+        """
+        path = self.get_path(key)
+        fd, tmp_path = tempfile.mkstemp(suffix=CACHE_FILE_SUFFIX, dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(arr, dtype=np.float32))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return np.load(path, mmap_mode="r")
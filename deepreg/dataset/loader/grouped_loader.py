@@ -37,6 +37,9 @@ class GroupedDataLoader(AbstractUnpairedDataLoader, GeneratorDataLoader):
         sample_image_in_group: bool,
         seed: Optional[int],
         image_shape: Union[Tuple[int, ...], List[int]],
+        cache_dir: Optional[str] = None,
+        num_workers: int = 1,
+        deterministic: bool = True,
     ):
         """
         :param file_loader: a subclass of FileLoader
@@ -65,12 +68,20 @@ class GroupedDataLoader(AbstractUnpairedDataLoader, GeneratorDataLoader):
             if seed=None, then the randomness is not fixed
         :param image_shape: list or tuple of length 3,
             corresponding to (dim1, dim2, dim3) of the 3D image
+        :param cache_dir: directory to cache the preprocessed volumes,
+            if None, the cache is not used.
+        :param num_workers: number of samples loaded in parallel.
+        :param deterministic: whether the samples loaded in parallel
+            are yielded in a deterministic order.
         """
         super().__init__(
             image_shape=image_shape,
             labeled=labeled,
             sample_label=sample_label,
             seed=seed,
+            cache_dir=cache_dir,
+            num_workers=num_workers,
+            deterministic=deterministic,
         )
         assert isinstance(
             data_dir_paths, list
@@ -109,6 +109,22 @@ class H5FileLoader(FileLoader):
             (group_index, in_group_data_index)
         :returns arr: the data array at the specified index
         """
+        dir_path, data_key = self.get_data_key(index=index)
+        arr = np.asarray(self.h5_files[dir_path][data_key], dtype=np.float32)
+        if len(arr.shape) == 4 and arr.shape[3] == 1:
+            # for labels, if there's only one label, remove the last dimension
+            # currently have not encountered
+            arr = arr[:, :, :, 0]  # pragma: no cover
+        return arr
+
+    def get_data_key(self, index: Union[int, Tuple[int, ...]]) -> Tuple[str, str]:
+        """
+        Get the h5 file and the key storing the data at the specified index.
+
+        :param index: the data index, same as for get_data.
+        :return: (dir_path, data_key) such that
+            data = h5_files[dir_path][data_key]
+        """
         assert self.data_path_splits is not None
         if isinstance(index, int):  # paired or unpaired
             assert not self.grouped
@@ -127,12 +143,17 @@ class H5FileLoader(FileLoader):
                 f"index for H5FileLoader.get_data must be int, "
                 f"or tuple of length two, got {index}"
             )
-        arr = np.asarray(self.h5_files[dir_path][data_key], dtype=np.float32)
-        if len(arr.shape) == 4 and arr.shape[3] == 1:
-            # for labels, if there's only one label, remove the last dimension
-            # currently have not encountered
-            arr = arr[:, :, :, 0]  # pragma: no cover
-        return arr
+        return dir_path, data_key
+
+    def get_data_source(self, index: Union[int, Tuple[int, ...]]) -> Tuple[str, str]:
+        """
+        Get the h5 file path and the key storing the data at the specified index.
+
+        :param index: the data index, same as for get_data.
+        :return: (file_path, data_key)
+        """
+        dir_path, data_key = self.get_data_key(index=index)
+        return self.h5_files[dir_path].filename, data_key
 
     def get_data_ids(self) -> List:
         """
@@ -2,14 +2,20 @@
 Interface between the data loaders and file loaders.
 """
 import logging
+import os
 from abc import ABC
 from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import tensorflow as tf
 
-from deepreg.dataset.loader.util import normalize_array
-from deepreg.dataset.preprocess import resize_inputs
+from deepreg.dataset.loader.cache import VolumeCache
+from deepreg.dataset.loader.util import normalize_array, resize_affine, resize_array
+from deepreg.dataset.preprocess import (
+    RandomCompositeTransform3D,
+    resize_inputs,
+    split_seed,
+)
 from deepreg.dataset.util import get_label_indices
 from deepreg.registry import REGISTRY
 
@@ -89,6 +95,7 @@ class DataLoader:
         repeat: bool,
         shuffle_buffer_num_batch: int,
         data_augmentation: Optional[Union[List, Dict]] = None,
+        fuse_data_augmentation: bool = False,
     ) -> tf.data.Dataset:
         """
         :param training: bool, indicating if it's training or not
@@ -98,6 +105,8 @@ class DataLoader:
             the shuffle_buffer_size = batch_size * shuffle_buffer_num_batch
         :param repeat: bool, indicating if we need to repeat the dataset
         :param data_augmentation: augmentation config, can be a list of dict or dict.
+        :param fuse_data_augmentation: if True, the augmentations are composed
+            into one sampling grid so that images and labels are resampled once.
         :returns dataset:
         """
 
@@ -128,8 +137,8 @@ class DataLoader:
         if training and data_augmentation is not None:
             if isinstance(data_augmentation, dict):
                 data_augmentation = [data_augmentation]
-            for config in data_augmentation:
-                da_fn = REGISTRY.build_data_augmentation(
+            da_fns = [
+                REGISTRY.build_data_augmentation(
                     config=config,
                     default_args={
                         "moving_image_size": self.moving_image_shape,
@@ -137,12 +146,43 @@ class DataLoader:
                         "batch_size": batch_size,
                     },
                 )
-                dataset = dataset.map(
-                    da_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE
-                )
+                for config in data_augmentation
+            ]
+            if fuse_data_augmentation and len(da_fns) > 1:
+                da_fns = [RandomCompositeTransform3D(transforms=da_fns)]
+
+            def augment(inputs: Dict[str, tf.Tensor], seed: tf.Tensor):
+                seeds = split_seed(seed=seed, num=len(da_fns))
+                for i, da_fn in enumerate(da_fns):
+                    inputs = da_fn(inputs, seed=seeds[i])
+                return inputs
+
+            # one seed per batch for stateless random ops,
+            # so that augmentation is reproducible if self.seed is given
+            seeds = tf.data.experimental.RandomDataset(seed=self.seed).batch(2)
+            dataset = tf.data.Dataset.zip((dataset, seeds)).map(
+                augment, num_parallel_calls=tf.data.experimental.AUTOTUNE
+            )
 
         return dataset
 
+    def get_affines(
+        self, image_indices: List[int], resize: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the affines of the moving and fixed images of a sample.
+
+        The affines map the voxels of the images resized to
+        moving_image_shape and fixed_image_shape to world coordinates.
+
+        :param image_indices: indices identifying the images of the sample,
+            i.e. the sample indices without the label index.
+        :param resize: if false, the affines map the voxels of the original images.
+        :return: (moving_affine, fixed_affine), each of shape (4, 4),
+            identity if not available.
+        """
+        return np.eye(4), np.eye(4)
+
     def close(self):
         pass
 
@@ -242,82 +282,357 @@ class GeneratorDataLoader(DataLoader, ABC):
     Load samples by implementing get_dataset from DataLoader.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        num_workers: int = 1,
+        deterministic: bool = True,
+        **kwargs,
+    ):
         """
         Init.
 
+        :param cache_dir: directory to cache the preprocessed volumes,
+            if None, volumes are read and preprocessed in every epoch.
+        :param num_workers: number of samples loaded in parallel,
+            if 1, samples are loaded sequentially by a single generator.
+        :param deterministic: whether the parallel loading preserves
+            a deterministic order of the samples, only used if num_workers > 1.
         :param kwargs: additional arguments.
         """
         super().__init__(**kwargs)
+        assert (
+            isinstance(num_workers, int) and num_workers >= 1
+        ), f"num_workers must be int >= 1, got {num_workers}"
         self.loader_moving_image = None
         self.loader_fixed_image = None
         self.loader_moving_label = None
         self.loader_fixed_label = None
+        self.cache = None if cache_dir is None else VolumeCache(cache_dir=cache_dir)
+        self.num_workers = num_workers
+        self.deterministic = deterministic
+
+    @property
+    def validated(self) -> bool:
+        """
+        Return true if all file loaders have validated their data,
+        in which case the values of the samples are not checked again.
+
+        :return: whether the data have been validated
+        """
+        loaders = [
+            self.loader_moving_image,
+            self.loader_fixed_image,
+            self.loader_moving_label,
+            self.loader_fixed_label,
+        ]
+        return all(
+            getattr(loader, "validated", False)
+            for loader in loaders
+            if loader is not None
+        )
+
+    def get_output_types_and_shapes(self) -> Tuple[dict, dict]:
+        """
+        Return the types and shapes of the samples yielded by the generators.
+
+        If the cache is used, the volumes are already resized
+        so that the shapes are known statically.
+
+        :return: (output_types, output_shapes)
+        """
+        if self.cache is not None:
+            moving_shape = tf.TensorShape(self.moving_image_shape)
+            fixed_shape = tf.TensorShape(self.fixed_image_shape)
+        else:
+            moving_shape = tf.TensorShape([None, None, None])
+            fixed_shape = tf.TensorShape([None, None, None])
+        output_types = dict(
+            moving_image=tf.float32, fixed_image=tf.float32, indices=tf.float32
+        )
+        output_shapes = dict(
+            moving_image=moving_shape,
+            fixed_image=fixed_shape,
+            indices=self.num_indices,
+        )
+        if self.labeled:
+            output_types.update(moving_label=tf.float32, fixed_label=tf.float32)
+            output_shapes.update(moving_label=moving_shape, fixed_label=fixed_shape)
+        return output_types, output_shapes
 
     def get_dataset(self):
         """
         Return a dataset from the generator.
+
+        If num_workers > 1, a generator only yields the sample indices
+        and the volumes are loaded outside of the generator
+        by num_workers parallel calls of a numpy function.
+        Each call returns the samples of one pair stacked together,
+        so that a deterministic map preserves the sequential order.
         """
-        if self.labeled:
+        output_types, output_shapes = self.get_output_types_and_shapes()
+        if self.num_workers == 1:
             return tf.data.Dataset.from_generator(
                 generator=self.data_generator,
-                output_types=dict(
-                    moving_image=tf.float32,
-                    fixed_image=tf.float32,
-                    moving_label=tf.float32,
-                    fixed_label=tf.float32,
-                    indices=tf.float32,
-                ),
-                output_shapes=dict(
-                    moving_image=tf.TensorShape([None, None, None]),
-                    fixed_image=tf.TensorShape([None, None, None]),
-                    moving_label=tf.TensorShape([None, None, None]),
-                    fixed_label=tf.TensorShape([None, None, None]),
-                    indices=self.num_indices,
-                ),
+                output_types=output_types,
+                output_shapes=output_shapes,
             )
-        else:
-            return tf.data.Dataset.from_generator(
-                generator=self.data_generator,
-                output_types=dict(
-                    moving_image=tf.float32, fixed_image=tf.float32, indices=tf.float32
-                ),
-                output_shapes=dict(
-                    moving_image=tf.TensorShape([None, None, None]),
-                    fixed_image=tf.TensorShape([None, None, None]),
-                    indices=self.num_indices,
-                ),
+
+        index_dataset = tf.data.Dataset.from_generator(
+            generator=self.data_index_generator,
+            output_types=(tf.int64, tf.int64),
+            output_shapes=(tf.TensorShape([None]), tf.TensorShape([None])),
+        )
+        keys = list(output_types.keys())
+
+        def load_pair(index: np.ndarray, image_indices: np.ndarray) -> List[np.ndarray]:
+            samples = self.load_stacked_samples(
+                index=index, image_indices=image_indices
             )
+            return [
+                np.asarray(samples[key], dtype=output_types[key].as_numpy_dtype)
+                for key in keys
+            ]
 
-    def data_generator(self):
+        def load(index: tf.Tensor, image_indices: tf.Tensor) -> Dict[str, tf.Tensor]:
+            arrays = tf.numpy_function(
+                func=load_pair,
+                inp=[index, image_indices],
+                Tout=[output_types[key] for key in keys],
+            )
+            outputs = dict()
+            for key, arr in zip(keys, arrays):
+                arr.set_shape(tf.TensorShape([None]).concatenate(output_shapes[key]))
+                outputs[key] = arr
+            return outputs
+
+        dataset = index_dataset.map(
+            load,
+            num_parallel_calls=self.num_workers,
+            deterministic=self.deterministic,
+        ).unbatch()
+        # the default thread pool has one thread per core,
+        # it is enlarged so that num_workers calls can wait for the files together
+        options = tf.data.Options()
+        threading_options = (
+            options.threading
+            if hasattr(options, "threading")
+            else options.experimental_threading  # tensorflow < 2.6
+        )
+        threading_options.private_threadpool_size = max(
+            self.num_workers, os.cpu_count() or 1
+        )
+        return dataset.with_options(options)
+
+    def get_affines(
+        self, image_indices: List[int], resize: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the affines of the moving and fixed images of a sample.
+
+        The image indices are the moving and fixed indices concatenated,
+        as in data_index_generator, the affine stored in the file is updated
+        for the resize to moving_image_shape or fixed_image_shape.
+
+        :param image_indices: indices identifying the images of the sample,
+            i.e. the sample indices without the label index.
+        :param resize: if false, the affine stored in the file is not updated,
+            used when predicting on the original images.
+        :return: (moving_affine, fixed_affine), each of shape (4, 4),
+            identity if the file format has no affine.
+        """
+        image_indices = [int(x) for x in image_indices]
+        if len(image_indices) == 1:  # paired
+            image_indices = image_indices * 2
+        num_indices = len(image_indices) // 2
+        affines = []
+        for loader, index, image_shape in [
+            (
+                self.loader_moving_image,
+                image_indices[:num_indices],
+                self.moving_image_shape,
+            ),
+            (
+                self.loader_fixed_image,
+                image_indices[num_indices:],
+                self.fixed_image_shape,
+            ),
+        ]:
+            geometry = loader.get_affine(  # type: ignore
+                index=tuple(index) if loader.grouped else index[0]  # type: ignore
+            )
+            if geometry is None:
+                affines.append(np.eye(4))
+                continue
+            affine, shape = geometry
+            if not resize:
+                affines.append(affine)
+                continue
+            affines.append(
+                resize_affine(affine=affine, shape=shape, new_shape=image_shape)
+            )
+        return affines[0], affines[1]
+
+    def data_index_generator(self):
         """
-        Yield samples of data to feed model.
+        Yield the sample indices as arrays, used for loading samples in parallel.
+
+        The moving and fixed indices are concatenated, a grouped index
+        (group_index, in_group_data_index) being flattened.
         """
         for (moving_index, fixed_index, image_indices) in self.sample_index_generator():
-            moving_image = self.loader_moving_image.get_data(index=moving_index)
-            moving_image = normalize_array(moving_image)
-            fixed_image = self.loader_fixed_image.get_data(index=fixed_index)
-            fixed_image = normalize_array(fixed_image)
-            moving_label = (
-                self.loader_moving_label.get_data(index=moving_index)
-                if self.labeled
-                else None
+            index = [
+                x
+                for i in [moving_index, fixed_index]
+                for x in (i if isinstance(i, tuple) else (i,))
+            ]
+            yield np.asarray(index, dtype=np.int64), np.asarray(
+                image_indices, dtype=np.int64
             )
-            fixed_label = (
-                self.loader_fixed_label.get_data(index=fixed_index)
-                if self.labeled
-                else None
+
+    def load_stacked_samples(
+        self, index: np.ndarray, image_indices: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """
+        Load the samples of one pair of moving and fixed indices stacked together.
+
+        A pair gives several samples if sample_label is "all",
+        they are stacked so that the pair gives exactly one element.
+
+        :param index: concatenated moving and fixed indices,
+            yielded by data_index_generator.
+        :param image_indices: indices identifying the images.
+        :return: dict of arrays of shape (num_samples, ...).
+        """
+        index = [int(x) for x in index]
+        moving_index, fixed_index = index[: len(index) // 2], index[len(index) // 2 :]
+        if self.loader_moving_image.grouped:
+            moving_index, fixed_index = tuple(moving_index), tuple(fixed_index)
+        else:
+            moving_index, fixed_index = moving_index[0], fixed_index[0]
+        samples = list(
+            self.load_samples(
+                moving_index=moving_index,
+                fixed_index=fixed_index,
+                image_indices=[int(x) for x in image_indices],
             )
+        )
+        return {key: np.stack([x[key] for x in samples]) for key in samples[0].keys()}
 
-            for sample in self.sample_image_label(
-                moving_image=moving_image,
-                fixed_image=fixed_image,
-                moving_label=moving_label,
-                fixed_label=fixed_label,
+    def load_data(
+        self,
+        loader: "FileLoader",
+        index: Union[int, Tuple[int, ...]],
+        image_shape: Optional[Tuple[int, ...]],
+        normalize: bool,
+    ) -> np.ndarray:
+        """
+        Load one volume, using the cache if enabled.
+
+        Without cache, the volume is returned as it is stored in the file,
+        besides the normalization, it is resized later in the dataset.
+        With cache, the volume is resized to image_shape before being cached.
+
+        :param loader: file loader storing the volume.
+        :param index: index of the volume for the file loader.
+        :param image_shape: (dim1, dim2, dim3), shape to resize the volume to,
+            only used with cache.
+        :param normalize: true to normalize the volume, used for images.
+        :return: the volume, with an extra dimension for multiple labels.
+        """
+        if self.cache is None:
+            arr = loader.get_data(index=index)
+            return normalize_array(arr) if normalize else arr
+
+        file_path, data_key = loader.get_data_source(index=index)
+        key = self.cache.get_key(
+            file_path=file_path,
+            data_key=data_key,
+            shape=image_shape,
+            normalize=normalize,
+        )
+        arr = self.cache.load(key=key)
+        if arr is not None:
+            return arr
+
+        arr = loader.get_data(index=index)
+        if normalize:
+            arr = normalize_array(arr)
+        # resize in numpy, multiple labels being resized as channels,
+        # so that no TensorFlow op runs in the generator
+        arr = resize_array(arr=arr, shape=image_shape)  # type: ignore
+        return self.cache.save(key=key, arr=arr)
+
+    def data_generator(self):
+        """
+        Yield samples of data to feed model.
+        """
+        for (moving_index, fixed_index, image_indices) in self.sample_index_generator():
+            for sample in self.load_samples(
+                moving_index=moving_index,
+                fixed_index=fixed_index,
                 image_indices=image_indices,
             ):
                 yield sample
 
+    def load_samples(
+        self,
+        moving_index: Union[int, Tuple[int, ...]],
+        fixed_index: Union[int, Tuple[int, ...]],
+        image_indices: list,
+    ):
+        """
+        Load the images and labels of one pair and yield the samples.
+
+        :param moving_index: index of the moving image/label for the file loaders.
+        :param fixed_index: index of the fixed image/label for the file loaders.
+        :param image_indices: indices identifying the images.
+        """
+        use_cache = self.cache is not None
+        moving_image_shape = self.moving_image_shape if use_cache else None
+        fixed_image_shape = self.fixed_image_shape if use_cache else None
+        moving_image = self.load_data(
+            loader=self.loader_moving_image,
+            index=moving_index,
+            image_shape=moving_image_shape,
+            normalize=True,
+        )
+        fixed_image = self.load_data(
+            loader=self.loader_fixed_image,
+            index=fixed_index,
+            image_shape=fixed_image_shape,
+            normalize=True,
+        )
+        moving_label = (
+            self.load_data(
+                loader=self.loader_moving_label,
+                index=moving_index,
+                image_shape=moving_image_shape,
+                normalize=False,
+            )
+            if self.labeled
+            else None
+        )
+        fixed_label = (
+            self.load_data(
+                loader=self.loader_fixed_label,
+                index=fixed_index,
+                image_shape=fixed_image_shape,
+                normalize=False,
+            )
+            if self.labeled
+            else None
+        )
+
+        for sample in self.sample_image_label(
+            moving_image=moving_image,
+            fixed_image=fixed_image,
+            moving_label=moving_label,
+            fixed_label=fixed_label,
+            image_indices=image_indices,
+        ):
+            yield sample
+
     def sample_index_generator(self):
         """
         Method is defined by the implemented data loaders to yield the sample indexes.
@@ -332,6 +647,7 @@ class GeneratorDataLoader(DataLoader, ABC):
         moving_label: Optional[np.ndarray],
         fixed_label: Optional[np.ndarray],
         image_indices: list,
+        check_values: bool = True,
     ):
         """
         Check file names match according to naming convention.
@@ -343,6 +659,8 @@ class GeneratorDataLoader(DataLoader, ABC):
         :param fixed_label: np.ndarray of shape (f_dim1, f_dim2, f_dim3)
             or (f_dim1, f_dim2, f_dim3, num_labels)
         :param image_indices: list
+        :param check_values: whether to check the values are between [0, 1],
+            which requires reading the whole arrays.
         """
         # images should never be None, and labels should all be non-None or None
         if moving_image is None or fixed_image is None:
@@ -356,7 +674,7 @@ class GeneratorDataLoader(DataLoader, ABC):
             [moving_image, fixed_image, moving_label, fixed_label],
             ["moving_image", "fixed_image", "moving_label", "fixed_label"],
         ):
-            if arr is None:
+            if arr is None or not check_values:
                 continue
             if np.min(arr) < 0 or np.max(arr) > 1:
                 raise ValueError(
@@ -442,7 +760,12 @@ class GeneratorDataLoader(DataLoader, ABC):
         :param image_indices:
         """
         self.validate_images_and_labels(
-            moving_image, fixed_image, moving_label, fixed_label, image_indices
+            moving_image,
+            fixed_image,
+            moving_label,
+            fixed_label,
+            image_indices,
+            check_values=not self.validated,
         )
         # unlabeled
         if moving_label is None or fixed_label is None:
@@ -501,6 +824,9 @@ class FileLoader:
         self.grouped = grouped
         # if grouped, group_struct[group_index] = list of data_index
         self.group_struct = None
+        # true if the data have been validated when the files were written
+        # such that the loaded samples do not need to be validated again
+        self.validated = False
 
     def set_data_structure(self):
         """
@@ -532,6 +858,28 @@ class FileLoader:
         """
         raise NotImplementedError
 
+    def get_data_source(self, index: Union[int, Tuple[int, ...]]) -> Tuple[str, str]:
+        """
+        Get the file storing one data array, used to identify cached data.
+
+        :param index: the data index, same as for get_data.
+        :return: (file_path, data_key), data_key identifies the data inside
+            the file and is an empty string if the file stores one array.
+        """
+        raise NotImplementedError
+
+    def get_affine(
+        self, index: Union[int, Tuple[int, ...]]
+    ) -> Optional[Tuple[np.ndarray, Tuple[int, ...]]]:
+        """
+        Get the affine mapping voxel to world coordinates of one data array.
+
+        :param index: the data index, same as for get_data.
+        :return: (affine, shape), affine has shape (4, 4) and shape is the spatial
+            shape of the stored data, None if the file format has no affine.
+        """
+        return None
+
     def get_data_ids(self) -> List:
         """
         Return the unique IDs of the data in this data set.
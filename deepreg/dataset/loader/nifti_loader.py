@@ -1,5 +1,5 @@
 import os
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import nibabel as nib
 import numpy as np
@@ -23,6 +23,40 @@ def load_nifti_file(file_path: str) -> np.ndarray:
     return np.asarray(nib.load(file_path).dataobj, dtype=np.float32)
 
 
+def save_nifti_file(
+    arr: np.ndarray,
+    file_path: str,
+    affine: Optional[np.ndarray] = None,
+    compression_level: Optional[int] = None,
+):
+    """
+    Save an array in a Nifti file, compressed if the suffix is .nii.gz.
+
+    The file is written as a stream, without building the compressed bytes in memory.
+
+    :param arr: array to be saved
+    :param file_path: path of a Nifti file with suffix .nii or .nii.gz
+    :param affine: shape = (4, 4), voxel to world coordinates, identity if None
+    :param compression_level: gzip level between 0 and 9 for .nii.gz files,
+        nibabel's default level is used if None
+    """
+    if not (file_path.endswith(".nii") or file_path.endswith(".nii.gz")):
+        raise ValueError(
+            f"Nifti file path must end with .nii or .nii.gz, got {file_path}."
+        )
+    # output with Nifti1Image can be loaded by
+    # - https://www.slicer.org/
+    # - http://www.itksnap.org/
+    # - http://ric.uthscsa.edu/mango/
+    # However, outputs with Nifti2Image couldn't be loaded
+    img = nib.Nifti1Image(arr, affine=np.eye(4) if affine is None else affine)
+    kwargs = {}
+    if compression_level is not None and file_path.endswith(".gz"):
+        kwargs["compresslevel"] = compression_level
+    with nib.openers.Opener(file_path, "wb", **kwargs) as f:
+        img.to_file_map({"image": nib.FileHolder(filename=file_path, fileobj=f)})
+
+
 @REGISTRY.register_file_loader(name="nifti")
 class NiftiFileLoader(FileLoader):
     """Generalized loader for nifti files."""
@@ -118,6 +152,21 @@ class NiftiFileLoader(FileLoader):
             (group_index, in_group_data_index)
         :returns arr: the data array at the specified index
         """
+        file_path, _ = self.get_data_source(index=index)
+        arr = load_nifti_file(file_path=file_path)
+        if len(arr.shape) == 4 and arr.shape[3] == 1:
+            # for labels, if there's only one label, remove the last dimension
+            # currently have not encountered
+            arr = arr[:, :, :, 0]  # pragma: no cover
+        return arr
+
+    def get_data_source(self, index: Union[int, Tuple[int, ...]]) -> Tuple[str, str]:
+        """
+        Get the path of the file storing the data at the specified index.
+
+        :param index: the data index, same as for get_data.
+        :return: (file_path, ""), as one nifti file stores one array.
+        """
         if isinstance(index, int):  # paired or unpaired
             assert not self.grouped
             assert 0 <= index
@@ -143,13 +192,20 @@ class NiftiFileLoader(FileLoader):
         path_splits, suffix = path_splits[:-1], path_splits[-1]
         path_splits = path_splits[:1] + (self.name,) + path_splits[1:]
         file_path = os.path.join(*path_splits) + "." + suffix
+        return file_path, ""
 
-        arr = load_nifti_file(file_path=file_path)
-        if len(arr.shape) == 4 and arr.shape[3] == 1:
-            # for labels, if there's only one label, remove the last dimension
-            # currently have not encountered
-            arr = arr[:, :, :, 0]  # pragma: no cover
-        return arr
+    def get_affine(
+        self, index: Union[int, Tuple[int, ...]]
+    ) -> Optional[Tuple[np.ndarray, Tuple[int, ...]]]:
+        """
+        Get the affine and the shape of the data, read from the Nifti header.
+
+        :param index: the data index, same as for get_data.
+        :return: (affine, shape), affine has shape (4, 4).
+        """
+        file_path, _ = self.get_data_source(index=index)
+        img = nib.load(file_path)
+        return img.affine, img.shape[:3]
 
     def get_data_ids(self) -> List:
         """
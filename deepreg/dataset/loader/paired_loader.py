@@ -4,7 +4,7 @@ Supported formats: h5 and Nifti.
 Image data can be labeled or unlabeled.
 """
 import random
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 from deepreg.dataset.loader.interface import (
     AbstractPairedDataLoader,
@@ -31,6 +31,9 @@ class PairedDataLoader(AbstractPairedDataLoader, GeneratorDataLoader):
         seed,
         moving_image_shape: Union[Tuple[int, ...], List[int]],
         fixed_image_shape: Union[Tuple[int, ...], List[int]],
+        cache_dir: Optional[str] = None,
+        num_workers: int = 1,
+        deterministic: bool = True,
     ):
         """
         :param file_loader:
@@ -43,6 +46,11 @@ class PairedDataLoader(AbstractPairedDataLoader, GeneratorDataLoader):
         :param seed:
         :param moving_image_shape: (width, height, depth)
         :param fixed_image_shape: (width, height, depth)
+        :param cache_dir: directory to cache the preprocessed volumes,
+            if None, the cache is not used.
+        :param num_workers: number of samples loaded in parallel.
+        :param deterministic: whether the samples loaded in parallel
+            are yielded in a deterministic order.
         """
         super().__init__(
             moving_image_shape=moving_image_shape,
@@ -50,6 +58,9 @@ class PairedDataLoader(AbstractPairedDataLoader, GeneratorDataLoader):
             labeled=labeled,
             sample_label=sample_label,
             seed=seed,
+            cache_dir=cache_dir,
+            num_workers=num_workers,
+            deterministic=deterministic,
         )
         assert isinstance(
             data_dir_paths, list
@@ -0,0 +1,308 @@
+"""
+Load sharded binary files and associated information.
+
+A shard is a single file storing multiple arrays contiguously,
+preceded by a header describing the arrays. Shards are generated from
+Nifti or H5 data using the deepreg_convert command line tool.
+
+The file layout is
+
+- 8 bytes, the magic string SHARD_MAGIC,
+- 8 bytes, the header length in bytes, as a little-endian unsigned integer,
+- the header, a utf-8 encoded json string,
+- the arrays, in C order, each one starting at a multiple of SHARD_ALIGNMENT bytes.
+
+The header is a dict with the following keys
+
+- version: int, the version of the format,
+- grouped: bool, whether the data is grouped,
+- validated: bool, whether the values have been validated during conversion,
+- data: a list of dict, one per array, having keys
+
+  - id: list of str, identifier of the array, (data_key,) if not grouped
+    and (group_name, data_key) if grouped,
+  - shape: list of int, shape of the array,
+  - dtype: str, numpy data type of the array,
+  - offset: int, position of the array in bytes from the end of the header,
+  - num_labels: int, number of labels, 0 for images.
+"""
+import glob
+import json
+import os
+import struct
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from deepreg.dataset.loader.interface import FileLoader
+from deepreg.registry import REGISTRY
+
+SHARD_MAGIC = b"DEEPREGS"
+SHARD_VERSION = 1
+SHARD_ALIGNMENT = 64
+SHARD_FILE_SUFFIX = "shard"
+SHARD_FILE_FORMAT = "{name}-{index:05d}-of-{num_shards:05d}." + SHARD_FILE_SUFFIX
+
+
+def get_shard_file_paths(dir_path: str, name: str) -> List[str]:
+    """
+    Return the sorted paths of the shards of one data set.
+
+    :param dir_path: path of the directory storing the shards.
+    :param name: name identifying the data set, e.g. fixed_images.
+    :return: list of shard file paths.
+    """
+    pattern = os.path.join(dir_path, f"{name}-*-of-*.{SHARD_FILE_SUFFIX}")
+    return sorted(glob.glob(pattern))
+
+
+def write_shard(
+    file_path: str,
+    data: List[Tuple[Tuple[str, ...], np.ndarray]],
+    grouped: bool,
+    label: bool,
+    validated: bool,
+):
+    """
+    Write arrays into one shard file.
+
+    :param file_path: path of the shard file.
+    :param data: list of (data_id, array), data_id is a tuple of strings.
+    :param grouped: whether the data is grouped.
+    :param label: whether the arrays are labels.
+    :param validated: whether the array values have been validated.
+    """
+    entries = []
+    offset = 0
+    for data_id, arr in data:
+        arr = np.ascontiguousarray(arr)
+        entries.append(
+            dict(
+                id=list(data_id),
+                shape=list(arr.shape),
+                dtype=arr.dtype.str,
+                offset=offset,
+                num_labels=(1 if arr.ndim == 3 else arr.shape[3]) if label else 0,
+            )
+        )
+        offset += -(-arr.nbytes // SHARD_ALIGNMENT) * SHARD_ALIGNMENT
+    header = dict(
+        version=SHARD_VERSION, grouped=grouped, validated=validated, data=entries
+    )
+    header_bytes = json.dumps(header).encode("utf-8")
+    # pad the header so that the arrays are aligned
+    header_end = len(SHARD_MAGIC) + 8 + len(header_bytes)
+    header_bytes += b" " * (-header_end % SHARD_ALIGNMENT)
+
+    with open(file_path, "wb") as f:
+        f.write(SHARD_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for _, arr in data:
+            arr_bytes = np.ascontiguousarray(arr).tobytes()
+            f.write(arr_bytes)
+            f.write(b"\0" * (-len(arr_bytes) % SHARD_ALIGNMENT))
+
+
+def read_shard_header(file_path: str) -> dict:
+    """
+    Read the header of a shard file.
+
+    :param file_path: path of the shard file.
+    :return: header dict, the offsets of the arrays are converted to be
+        counted from the beginning of the file.
+    """
+    with open(file_path, "rb") as f:
+        magic = f.read(len(SHARD_MAGIC))
+        if magic != SHARD_MAGIC:
+            raise ValueError(f"File {file_path} is not a DeepReg shard file.")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    if header["version"] != SHARD_VERSION:
+        raise ValueError(
+            f"Shard file {file_path} has version {header['version']}, "
+            f"only version {SHARD_VERSION} is supported."
+        )
+    header_end = len(SHARD_MAGIC) + 8 + header_length
+    for entry in header["data"]:
+        entry["offset"] += header_end
+    return header
+
+
+@REGISTRY.register_file_loader(name="shard")
+class ShardFileLoader(FileLoader):
+    """
+    Generalized loader for sharded binary files.
+
+    The shards are memory-mapped so that reading an array only reads
+    its contiguous bytes, without decompression nor parsing.
+    """
+
+    def __init__(self, dir_paths: List[str], name: str, grouped: bool):
+        """
+        Init.
+
+        :param dir_paths: path of directories having shard files.
+        :param name: name is used to identify the shard file names.
+        :param grouped: whether the data is grouped.
+        """
+        super().__init__(dir_paths=dir_paths, name=name, grouped=grouped)
+        self.shards = None
+        self.data_path_splits = None
+        self.data_entries = None
+        self.set_data_structure()
+        self.group_struct = None
+        if self.grouped:
+            self.set_group_structure()
+
+    def set_data_structure(self):
+        """
+        Store the data structure in memory so that
+        we can retrieve data using data_index.
+        This function sets three attributes:
+
+        - shards, a dict such that shards[file_path] = memory-mapped shard file
+        - data_path_splits, a list of string tuples to identify path of data
+
+          - if grouped, a split is (dir_path, group_name, data_key)
+          - if not grouped, a split is (dir_path, data_key)
+
+        - data_entries, a dict such that data_entries[split] = (file_path, entry)
+          where entry describes the array in the shard header
+        """
+        shards = {}
+        data_entries = {}
+        validated = True
+        for dir_path in self.dir_paths:
+            file_paths = get_shard_file_paths(dir_path=dir_path, name=self.name)
+            assert (
+                len(file_paths) > 0
+            ), f"shard files {self.name}-*-of-*.{SHARD_FILE_SUFFIX} do not exist in {dir_path}"
+            for file_path in file_paths:
+                header = read_shard_header(file_path=file_path)
+                if header["grouped"] != self.grouped:
+                    raise ValueError(
+                        f"Shard file {file_path} has grouped={header['grouped']}, "
+                        f"but the loader has grouped={self.grouped}."
+                    )
+                validated = validated and header["validated"]
+                shards[file_path] = np.memmap(file_path, dtype=np.uint8, mode="r")
+                for entry in header["data"]:
+                    split = (dir_path,) + tuple(entry["id"])
+                    data_entries[split] = (file_path, entry)
+        if len(data_entries) == 0:
+            raise ValueError(
+                f"No data collected from {self.dir_paths} in ShardFileLoader, "
+                f"please verify the path is correct."
+            )
+        self.shards = shards
+        self.data_entries = data_entries
+        self.data_path_splits = sorted(data_entries.keys())
+        self.validated = validated
+
+    def set_group_structure(self):
+        """
+        Similar to H5FileLoader
+        as the first two tokens of a split forms a group_id.
+        Store the group structure in group_struct so that
+        group_struct[group_index] = list of data_index.
+        Retrieve data using (group_index, in_group_data_index).
+        data_index = group_struct[group_index][in_group_data_index].
+        """
+        # group_struct_dict[group_id] = list of data_index
+        group_struct_dict = {}
+        for data_index, split in enumerate(self.data_path_splits):
+            group_id = split[:2]
+            if group_id not in group_struct_dict.keys():
+                group_struct_dict[group_id] = []
+            group_struct_dict[group_id].append(data_index)
+        # group_struct[group_index] = list of data_index
+        group_struct = []
+        for k in sorted(group_struct_dict.keys()):
+            group_struct.append(group_struct_dict[k])
+        self.group_struct = group_struct
+
+    def get_data_entry(self, index: Union[int, Tuple[int, ...]]) -> Tuple[str, dict]:
+        """
+        Get the shard file and header entry of the data at the specified index.
+
+        :param index: the data index, same as for get_data.
+        :return: (file_path, entry)
+        """
+        assert self.data_path_splits is not None
+        if isinstance(index, int):  # paired or unpaired
+            assert not self.grouped
+            assert 0 <= index
+            data_index = index
+        elif isinstance(index, tuple):  # grouped
+            assert self.grouped
+            group_index, in_group_data_index = index
+            assert 0 <= group_index
+            assert 0 <= in_group_data_index
+            data_index = self.group_struct[group_index][in_group_data_index]  # type: ignore
+        else:
+            raise ValueError(
+                f"index for ShardFileLoader.get_data must be int, "
+                f"or tuple of length two, got {index}"
+            )
+        return self.data_entries[self.data_path_splits[data_index]]  # type: ignore
+
+    def get_data(self, index: Union[int, Tuple[int, ...]]) -> np.ndarray:
+        """
+        Get one data array by specifying an index
+
+        :param index: the data index which is required
+
+          - for paired or unpaired, the index is one single int, data_index
+          - for grouped, the index is a tuple of two ints,
+            (group_index, in_group_data_index)
+        :returns arr: the data array at the specified index
+        """
+        file_path, entry = self.get_data_entry(index=index)
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        size = int(np.prod(shape)) * dtype.itemsize
+        start = entry["offset"]
+        arr = self.shards[file_path][start : start + size].view(dtype).reshape(shape)
+        # a view is returned if the array is stored as float32
+        arr = np.asarray(arr, dtype=np.float32)
+        if len(arr.shape) == 4 and arr.shape[3] == 1:
+            # for labels, if there's only one label, remove the last dimension
+            arr = arr[:, :, :, 0]
+        return arr
+
+    def get_data_source(self, index: Union[int, Tuple[int, ...]]) -> Tuple[str, str]:
+        """
+        Get the shard file path and the array id at the specified index.
+
+        :param index: the data index, same as for get_data.
+        :return: (file_path, data_key)
+        """
+        file_path, entry = self.get_data_entry(index=index)
+        return file_path, "/".join(entry["id"])
+
+    def get_data_ids(self) -> List:
+        """
+        Get the unique IDs of data in this data set to
+        verify consistency between
+        images and label, moving and fixed.
+
+        :return: data_path_splits as the data can be identified
+            using dir_path and data id
+        """
+        return self.data_path_splits  # type: ignore
+
+    def get_num_images(self) -> int:
+        """
+        :return: int, number of images in this data set
+        """
+        return len(self.data_path_splits)  # type: ignore
+
+    def close(self):
+        """
+        Release the memory-mapped shard files.
+
+        The files are closed once the arrays returned by get_data
+        are not referenced anymore.
+        """
+        self.shards = {}
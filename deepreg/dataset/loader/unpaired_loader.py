@@ -4,7 +4,7 @@ Supported formats: h5 and Nifti.
 Image data can be labeled or unlabeled.
 """
 import random
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 from deepreg.dataset.loader.interface import (
     AbstractUnpairedDataLoader,
@@ -31,6 +31,9 @@ class UnpairedDataLoader(AbstractUnpairedDataLoader, GeneratorDataLoader):
         sample_label: str,
         seed: int,
         image_shape: Union[Tuple[int, ...], List[int]],
+        cache_dir: Optional[str] = None,
+        num_workers: int = 1,
+        deterministic: bool = True,
     ):
         """
         Load data which are unpaired, labeled or unlabeled.
@@ -42,12 +45,20 @@ class UnpairedDataLoader(AbstractUnpairedDataLoader, GeneratorDataLoader):
         :param sample_label:
         :param seed:
         :param image_shape: (width, height, depth)
+        :param cache_dir: directory to cache the preprocessed volumes,
+            if None, the cache is not used.
+        :param num_workers: number of samples loaded in parallel.
+        :param deterministic: whether the samples loaded in parallel
+            are yielded in a deterministic order.
         """
         super().__init__(
             image_shape=image_shape,
             labeled=labeled,
             sample_label=sample_label,
             seed=seed,
+            cache_dir=cache_dir,
+            num_workers=num_workers,
+            deterministic=deterministic,
         )
         assert isinstance(
             data_dir_paths, list
@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import List, Tuple, Union
 
 import numpy as np
 
@@ -27,6 +27,58 @@ def normalize_array(arr: np.ndarray, v_min=None, v_max=None) -> np.ndarray:
     return arr
 
 
+def resize_affine(
+    affine: np.ndarray, shape: Tuple[int, ...], new_shape: Tuple[int, ...]
+) -> np.ndarray:
+    """
+    Update the affine of a volume after resizing it with Resize3d.
+
+    The resize aligns the voxel centers, the voxel i of the resized volume is at
+    the position (i + 0.5) * scale - 0.5 of the original volume,
+    with scale = shape / new_shape for each axis.
+
+    :param affine: shape = (4, 4), voxel to world coordinates of the original volume.
+    :param shape: (dim1, dim2, dim3), shape of the original volume.
+    :param new_shape: (dim1, dim2, dim3), shape of the resized volume.
+    :return: shape = (4, 4), voxel to world coordinates of the resized volume.
+    """
+    scale = np.asarray(shape[:3], dtype=np.float64) / np.asarray(new_shape[:3])
+    voxel_affine = np.eye(4)
+    voxel_affine[:3, :3] = np.diag(scale)
+    voxel_affine[:3, 3] = (scale - 1) / 2
+    return np.asarray(affine, dtype=np.float64) @ voxel_affine
+
+
+def resize_array(arr: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    Resize the first dimensions of an array with linear interpolation in numpy.
+
+    The interpolation is the same as Resize3d with the bilinear method,
+    the voxel i of the resized array being at the position (i + 0.5) * scale - 0.5
+    of the original array, clipped to the borders, with scale = size / new_size.
+
+    :param arr: shape = (dim1, dim2, dim3) or (dim1, dim2, dim3, channels)
+    :param shape: (new_dim1, new_dim2, new_dim3)
+    :return: shape = (new_dim1, new_dim2, new_dim3) or
+        (new_dim1, new_dim2, new_dim3, channels), in float32
+    """
+    arr = np.asarray(arr, dtype=np.float32)
+    for axis, new_size in enumerate(shape):
+        size = arr.shape[axis]
+        if size == new_size:
+            continue
+        pos = (np.arange(new_size) + 0.5) * (size / new_size) - 0.5
+        pos = np.clip(pos, 0, size - 1)
+        lower = np.floor(pos).astype(np.int64)
+        upper = np.minimum(lower + 1, size - 1)
+        weight = (pos - lower).astype(np.float32)
+        weight = weight.reshape((new_size,) + (1,) * (arr.ndim - axis - 1))
+        arr = np.take(arr, lower, axis=axis) * (1 - weight) + np.take(
+            arr, upper, axis=axis
+        ) * weight
+    return arr
+
+
 def remove_prefix_suffix(
     x: str, prefix: Union[str, List[str]], suffix: Union[str, List[str]]
 ) -> str:
@@ -13,6 +13,15 @@ from deepreg.model.layer import Resize3d
 from deepreg.model.layer_util import get_reference_grid, resample, warp_grid
 from deepreg.registry import REGISTRY
 
+# four corners of a cube, corresponding to the corner C G D A
+# in the docstring of gen_rand_affine_transform, shape = (4, 4)
+AFFINE_CORNERS = np.array(
+    [[-1, -1, -1, 1], [-1, -1, 1, 1], [-1, 1, -1, 1], [1, -1, -1, 1]],
+    dtype=np.float32,
+)
+# the corners are fixed, so the transformations are solved using the inverse
+AFFINE_CORNERS_INV = np.linalg.inv(AFFINE_CORNERS)
+
 
 class RandomTransformation3D(tf.keras.layers.Layer):
     """
@@ -44,10 +53,14 @@ class RandomTransformation3D(tf.keras.layers.Layer):
         self.fixed_grid_ref = get_reference_grid(grid_size=fixed_image_size)
 
     @abstractmethod
-    def gen_transform_params(self) -> Tuple[tf.Tensor, tf.Tensor]:
+    def gen_transform_params(
+        self, seed: Optional[tf.Tensor] = None
+    ) -> Tuple[tf.Tensor, tf.Tensor]:
         """
         Generates transformation parameters for moving and fixed image.
 
+        :param seed: shape = (2,), seed of stateless random ops,
+            if None, stateful random ops are used.
         :return: two tensors
         """
 
@@ -65,7 +78,26 @@ class RandomTransformation3D(tf.keras.layers.Layer):
         :return: shape = (batch, dim1, dim2, dim3)
         """
 
-    def call(self, inputs: Dict[str, tf.Tensor], **kwargs) -> Dict[str, tf.Tensor]:
+    @staticmethod
+    @abstractmethod
+    def transform_grid(grid: tf.Tensor, params: tf.Tensor) -> tf.Tensor:
+        """
+        Transforms the reference grid or a batch of sampling grids.
+
+        Used to compose multiple transformations into a single sampling grid.
+
+        :param grid: shape = (dim1, dim2, dim3, 3) for the reference grid,
+            or (batch, dim1, dim2, dim3, 3)
+        :param params: parameters for transformation
+        :return: shape = (batch, dim1, dim2, dim3, 3)
+        """
+
+    def call(
+        self,
+        inputs: Dict[str, tf.Tensor],
+        seed: Optional[tf.Tensor] = None,
+        **kwargs,
+    ) -> Dict[str, tf.Tensor]:
         """
         Creates random params for the input images and their labels,
         and params them based on the resampled reference grids.
@@ -80,6 +112,8 @@ class RandomTransformation3D(tf.keras.layers.Layer):
                 moving_image, shape = (batch, m_dim1, m_dim2, m_dim3)
                 fixed_image, shape = (batch, f_dim1, f_dim2, f_dim3)
                 indices, shape = (batch, num_indices)
+        :param seed: shape = (2,), seed of stateless random ops,
+            if None, stateful random ops are used.
         :param kwargs: other arguments
         :return: dictionary with the same structure as inputs
         """
@@ -88,7 +122,7 @@ class RandomTransformation3D(tf.keras.layers.Layer):
         fixed_image = inputs["fixed_image"]
         indices = inputs["indices"]
 
-        moving_params, fixed_params = self.gen_transform_params()
+        moving_params, fixed_params = self.gen_transform_params(seed=seed)
 
         moving_image = self.transform(moving_image, self.moving_grid_ref, moving_params)
         fixed_image = self.transform(fixed_image, self.fixed_grid_ref, fixed_params)
@@ -158,15 +192,19 @@ class RandomAffineTransform3D(RandomTransformation3D):
         config["scale"] = self.scale
         return config
 
-    def gen_transform_params(self) -> Tuple[tf.Tensor, tf.Tensor]:
+    def gen_transform_params(
+        self, seed: Optional[tf.Tensor] = None
+    ) -> Tuple[tf.Tensor, tf.Tensor]:
         """
         Function that generates the random 3D transformation parameters
         for a batch of data for moving and fixed image.
 
+        :param seed: shape = (2,), seed of stateless random ops,
+            if None, stateful random ops are used.
         :return: a tuple of tensors, each has shape = (batch, 4, 3)
         """
         theta = gen_rand_affine_transform(
-            batch_size=self.batch_size * 2, scale=self.scale
+            batch_size=self.batch_size * 2, scale=self.scale, seed=seed
         )
         return theta[: self.batch_size], theta[self.batch_size :]
 
@@ -184,6 +222,21 @@ class RandomAffineTransform3D(RandomTransformation3D):
         """
         return resample(vol=image, loc=warp_grid(grid_ref, params))
 
+    @staticmethod
+    def transform_grid(grid: tf.Tensor, params: tf.Tensor) -> tf.Tensor:
+        """
+        Transforms the reference grid or a batch of sampling grids.
+
+        :param grid: shape = (dim1, dim2, dim3, 3) for the reference grid,
+            or (batch, dim1, dim2, dim3, 3)
+        :param params: shape = (batch, 4, 3)
+        :return: shape = (batch, dim1, dim2, dim3, 3)
+        """
+        if len(grid.shape) == 4:
+            return warp_grid(grid, params)
+        grid_padded = tf.concat([grid, tf.ones_like(grid[..., :1])], axis=4)
+        return tf.einsum("bijkq,bqp->bijkp", grid_padded, params)
+
 
 @REGISTRY.register_data_augmentation(name="ddf")
 class RandomDDFTransform3D(RandomTransformation3D):
@@ -238,24 +291,34 @@ class RandomDDFTransform3D(RandomTransformation3D):
         config["low_res_size"] = self.low_res_size
         return config
 
-    def gen_transform_params(self) -> Tuple[tf.Tensor, tf.Tensor]:
+    def gen_transform_params(
+        self, seed: Optional[tf.Tensor] = None
+    ) -> Tuple[tf.Tensor, tf.Tensor]:
         """
         Generates two random ddf fields for moving and fixed images.
 
+        :param seed: shape = (2,), seed of stateless random ops,
+            if None, stateful random ops are used.
         :return: tuple, one has shape = (batch, m_dim1, m_dim2, m_dim3, 3)
             another one has shape = (batch, f_dim1, f_dim2, f_dim3, 3)
         """
+        moving_seed, fixed_seed = None, None
+        if seed is not None:
+            seeds = split_seed(seed=seed, num=2)
+            moving_seed, fixed_seed = seeds[0], seeds[1]
         moving = gen_rand_ddf(
             image_size=self.moving_image_size,
             batch_size=self.batch_size,
             field_strength=self.field_strength,
             low_res_size=self.low_res_size,
+            seed=moving_seed,
         )
         fixed = gen_rand_ddf(
             image_size=self.fixed_image_size,
             batch_size=self.batch_size,
             field_strength=self.field_strength,
             low_res_size=self.low_res_size,
+            seed=fixed_seed,
         )
         return moving, fixed
 
@@ -273,6 +336,154 @@ class RandomDDFTransform3D(RandomTransformation3D):
         """
         return resample(vol=image, loc=grid_ref[None, ...] + params)
 
+    @staticmethod
+    def transform_grid(grid: tf.Tensor, params: tf.Tensor) -> tf.Tensor:
+        """
+        Transforms the reference grid or a batch of sampling grids.
+
+        The DDF is interpolated at the locations of a batch of grids,
+        which are not necessarily on the reference grid.
+
+        :param grid: shape = (dim1, dim2, dim3, 3) for the reference grid,
+            or (batch, dim1, dim2, dim3, 3)
+        :param params: DDF, shape = (batch, dim1, dim2, dim3, 3)
+        :return: shape = (batch, dim1, dim2, dim3, 3)
+        """
+        if len(grid.shape) == 4:
+            return grid[None, ...] + params
+        return grid + resample(vol=params, loc=grid, zero_boundary=False)
+
+
+class RandomCompositeTransform3D(RandomTransformation3D):
+    """
+    Compose random transformations and resample moving/fixed images once.
+
+    Applying the transformations one after another resamples the images
+    once per transformation, which accumulates the interpolation blur.
+    Here the sampling grids are transformed instead and the images
+    are resampled a single time with the composed grid.
+    """
+
+    def __init__(
+        self,
+        transforms: List[RandomTransformation3D],
+        name: str = "RandomCompositeTransform3D",
+        **kwargs,
+    ):
+        """
+        Init.
+
+        :param transforms: transformations to apply, in order,
+            they must have the same image sizes and batch size.
+        :param name: name of the layer
+        :param kwargs: extra arguments
+        """
+        assert len(transforms) > 0, "transforms must not be empty"
+        first = transforms[0]
+        for transform in transforms[1:]:
+            assert tuple(transform.moving_image_size) == tuple(first.moving_image_size)
+            assert tuple(transform.fixed_image_size) == tuple(first.fixed_image_size)
+            assert transform.batch_size == first.batch_size
+        super().__init__(
+            moving_image_size=first.moving_image_size,
+            fixed_image_size=first.fixed_image_size,
+            batch_size=first.batch_size,
+            name=name,
+            **kwargs,
+        )
+        self.transforms = transforms
+
+    def get_config(self) -> dict:
+        """Return the config dictionary for recreating this class."""
+        config = super().get_config()
+        config["transforms"] = [x.get_config() for x in self.transforms]
+        return config
+
+    def gen_transform_params(
+        self, seed: Optional[tf.Tensor] = None
+    ) -> Tuple[List[tf.Tensor], List[tf.Tensor]]:
+        """
+        Generates the parameters of all transformations.
+
+        :param seed: shape = (2,), seed of stateless random ops,
+            if None, stateful random ops are used.
+        :return: two lists, of moving and fixed params, one per transformation
+        """
+        num_transforms = len(self.transforms)
+        seeds = [None] * num_transforms
+        if seed is not None:
+            seeds = split_seed(seed=seed, num=num_transforms)
+        moving_params, fixed_params = [], []
+        for i, transform in enumerate(self.transforms):
+            moving, fixed = transform.gen_transform_params(seed=seeds[i])
+            moving_params.append(moving)
+            fixed_params.append(fixed)
+        return moving_params, fixed_params
+
+    def transform_grid(self, grid: tf.Tensor, params: List[tf.Tensor]) -> tf.Tensor:
+        """
+        Transforms the reference grid or a batch of sampling grids
+        by all transformations.
+
+        An image transformed by T1 then by T2 is sampled at T1(T2(x)),
+        so the grid is transformed by the last transformation first.
+
+        :param grid: shape = (dim1, dim2, dim3, 3) for the reference grid,
+            or (batch, dim1, dim2, dim3, 3)
+        :param params: parameters of each transformation
+        :return: shape = (batch, dim1, dim2, dim3, 3)
+        """
+        for transform, transform_params in reversed(list(zip(self.transforms, params))):
+            grid = transform.transform_grid(grid=grid, params=transform_params)
+        return grid
+
+    def transform(
+        self, image: tf.Tensor, grid_ref: tf.Tensor, params: List[tf.Tensor]
+    ) -> tf.Tensor:
+        """
+        Transforms the reference grid and then resample the image.
+
+        :param image: shape = (batch, dim1, dim2, dim3)
+        :param grid_ref: shape = (dim1, dim2, dim3, 3)
+        :param params: parameters of each transformation
+        :return: shape = (batch, dim1, dim2, dim3)
+        """
+        return resample(
+            vol=image, loc=self.transform_grid(grid=grid_ref, params=params)
+        )
+
+    def call(
+        self,
+        inputs: Dict[str, tf.Tensor],
+        seed: Optional[tf.Tensor] = None,
+        **kwargs,
+    ) -> Dict[str, tf.Tensor]:
+        """
+        Creates random params for the input images and their labels,
+        and resample them once with the composed grids.
+
+        :param inputs: a dict having multiple tensors,
+            same as for RandomTransformation3D.call
+        :param seed: shape = (2,), seed of stateless random ops,
+            if None, stateful random ops are used.
+        :param kwargs: other arguments
+        :return: dictionary with the same structure as inputs
+        """
+        moving_params, fixed_params = self.gen_transform_params(seed=seed)
+        outputs = dict(indices=inputs["indices"])
+        for prefix, grid_ref, params in [
+            ("moving", self.moving_grid_ref, moving_params),
+            ("fixed", self.fixed_grid_ref, fixed_params),
+        ]:
+            grid = self.transform_grid(grid=grid_ref, params=params)
+            keys = [k for k in [f"{prefix}_image", f"{prefix}_label"] if k in inputs]
+            # image and label are stacked as channels to be resampled together
+            # shape = (batch, dim1, dim2, dim3, num_keys)
+            vol = resample(vol=tf.stack([inputs[k] for k in keys], axis=4), loc=grid)
+            for i, k in enumerate(keys):
+                outputs[k] = vol[..., i]
+        return outputs
+
 
 def resize_inputs(
     inputs: Dict[str, tf.Tensor],
@@ -333,8 +544,76 @@ def resize_inputs(
     )
 
 
+def get_stateless_seed(seed: Union[int, tf.Tensor]) -> tf.Tensor:
+    """
+    Convert a seed into the format required by stateless random ops.
+
+    :param seed: an int or a tensor of shape (2,)
+    :return: shape = (2,), dtype = int64
+    """
+    if isinstance(seed, int):
+        return tf.constant([seed, 0], dtype=tf.int64)
+    return tf.cast(seed, dtype=tf.int64)
+
+
+def split_seed(seed: Union[int, tf.Tensor], num: int) -> tf.Tensor:
+    """
+    Derive multiple independent seeds of stateless random ops from one seed.
+
+    :param seed: an int or a tensor of shape (2,)
+    :param num: number of seeds to derive
+    :return: shape = (num, 2)
+    """
+    return tf.random.stateless_uniform(
+        shape=(num, 2),
+        seed=get_stateless_seed(seed),
+        minval=0,
+        maxval=tf.int32.max,
+        dtype=tf.int32,
+    )
+
+
+def gen_rand_uniform(
+    shape: Tuple[int, ...],
+    minval: float,
+    maxval: float,
+    seed: Optional[Union[int, tf.Tensor]] = None,
+) -> tf.Tensor:
+    """
+    Sample from a uniform distribution, statelessly if a seed is given.
+
+    :param shape: shape of the output
+    :param minval: lower bound of the distribution
+    :param maxval: upper bound of the distribution
+    :param seed: an int or a tensor of shape (2,),
+        if None, a stateful random op is used.
+    :return: tensor of the given shape, dtype = float32
+    """
+    if seed is None:
+        return tf.random.uniform(shape=shape, minval=minval, maxval=maxval)
+    return tf.random.stateless_uniform(
+        shape=shape, seed=get_stateless_seed(seed), minval=minval, maxval=maxval
+    )
+
+
+def gen_rand_normal(
+    shape: Tuple[int, ...], seed: Optional[Union[int, tf.Tensor]] = None
+) -> tf.Tensor:
+    """
+    Sample from a standard normal distribution, statelessly if a seed is given.
+
+    :param shape: shape of the output
+    :param seed: an int or a tensor of shape (2,),
+        if None, a stateful random op is used.
+    :return: tensor of the given shape, dtype = float32
+    """
+    if seed is None:
+        return tf.random.normal(shape=shape)
+    return tf.random.stateless_normal(shape=shape, seed=get_stateless_seed(seed))
+
+
 def gen_rand_affine_transform(
-    batch_size: int, scale: float, seed: Optional[int] = None
+    batch_size: int, scale: float, seed: Optional[Union[int, tf.Tensor]] = None
 ) -> tf.Tensor:
     """
     Function that generates a random 3D transformation parameters for a batch of data.
@@ -380,19 +659,12 @@ def gen_rand_affine_transform(
     - T is the transformation matrix, of shape (4, 3)
 
     Given original and transformed coordinates,
-    we can calculate the transformation matrix using
-
-        x = np.linalg.lstsq(a, b)
-
-    such that
+    we can calculate the transformation matrix by solving
 
-        a x = b
+        old * T = new
 
-    In our case,
-
-    - a = old
-    - b = new
-    - x = T
+    As old is the same invertible matrix for all samples,
+    T = inv(old) * new is computed for the whole batch in one matrix product.
 
     To generate random transformation,
     we choose to add random perturbation to corner coordinates as follows:
@@ -437,27 +709,24 @@ def gen_rand_affine_transform(
 
     :param batch_size: int
     :param scale: a float number between 0 and 1
-    :param seed: control the randomness
+    :param seed: control the randomness, an int or a tensor of shape (2,)
+        for stateless random ops, if None, a stateful random op is used.
     :return: shape = (batch, 4, 3)
     """
 
     assert 0 <= scale <= 1
-    np.random.seed(seed)
-    noise = np.random.uniform(1 - scale, 1, [batch_size, 4, 3])  # shape = (batch, 4, 3)
+    noise = gen_rand_uniform(
+        shape=(batch_size, 4, 3), minval=1 - scale, maxval=1, seed=seed
+    )  # shape = (batch, 4, 3)
 
     # old represents four corners of a cube
     # corresponding to the corner C G D A as shown above
-    old = np.tile(
-        [[[-1, -1, -1, 1], [-1, -1, 1, 1], [-1, 1, -1, 1], [1, -1, -1, 1]]],
-        [batch_size, 1, 1],
-    )  # shape = (batch, 4, 4)
-    new = old[:, :, :3] * noise  # shape = (batch, 4, 3)
-
-    theta = np.array(
-        [np.linalg.lstsq(old[k], new[k], rcond=-1)[0] for k in range(batch_size)]
+    new = AFFINE_CORNERS[None, :, :3] * noise  # shape = (batch, 4, 3)
+    theta = tf.einsum(
+        "ij,bjk->bik", tf.constant(AFFINE_CORNERS_INV), new
     )  # shape = (batch, 4, 3)
 
-    return tf.cast(theta, dtype=tf.float32)
+    return theta
 
 
 def gen_rand_ddf(
@@ -475,14 +744,20 @@ def gen_rand_ddf(
     :param field_strength: maximum field strength, computed as a U[0,field_strength]
     :param low_res_size: low_resolution deformation field that will be upsampled to
         the original size in order to get smooth and more realistic fields.
-    :param seed: control the randomness
-    :return:
+    :param seed: control the randomness, an int or a tensor of shape (2,)
+        for stateless random ops, if None, stateful random ops are used.
+    :return: shape = (batch, dim1, dim2, dim3, 3)
     """
 
-    np.random.seed(seed)
-    low_res_strength = np.random.uniform(0, field_strength, (batch_size, 1, 1, 1, 3))
-    low_res_field = low_res_strength * np.random.randn(
-        batch_size, low_res_size[0], low_res_size[1], low_res_size[2], 3
+    strength_seed, field_seed = None, None
+    if seed is not None:
+        seeds = split_seed(seed=seed, num=2)
+        strength_seed, field_seed = seeds[0], seeds[1]
+    low_res_strength = gen_rand_uniform(
+        shape=(batch_size, 1, 1, 1, 3), minval=0, maxval=1, seed=strength_seed
+    ) * tf.constant(field_strength, dtype=tf.float32)
+    low_res_field = low_res_strength * gen_rand_normal(
+        shape=(batch_size, *low_res_size, 3), seed=field_seed
     )
     high_res_field = Resize3d(shape=image_size)(low_res_field)
     return high_res_field
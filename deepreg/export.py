@@ -0,0 +1,290 @@
+# coding=utf-8
+
+"""
+Module to export a trained model for inference. A CLI tool is provided.
+
+The exported SavedModel only contains the model weights and one function
+with a fixed input signature, it does not contain the optimizer state and
+can be loaded by tf.saved_model.load without importing deepreg.
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Dict, List, Union
+
+import tensorflow as tf
+
+from deepreg.callback import restore_model
+from deepreg.model.network import ConditionalModel, build_model_from_config, load_config
+
+# name of the file describing the inputs and outputs of the exported function
+SIGNATURE_FILENAME = "signature.json"
+# name of the optional frozen graph
+FROZEN_GRAPH_FILENAME = "frozen_graph.pb"
+
+
+def build_inference_function(
+    model: tf.keras.Model, with_warping: bool = True, with_label: bool = False
+) -> tf.types.experimental.ConcreteFunction:
+    """
+    Build the inference function of a model with a fixed input signature.
+
+    The inputs are moving_image and fixed_image, moving_label and fixed_label
+    if with_label, of shape = (batch, dim1, dim2, dim3).
+    The indices are not inputs, and missing labels are zeros.
+    The outputs are ddf, with dvf and theta if predicted by the model,
+    and pred_fixed_image, pred_fixed_label if with_label, if with_warping.
+    Conditional models only output pred_fixed_label and require the labels.
+
+    :param model: built model with weights restored
+    :param with_warping: if true, the warped moving image and label are outputs
+    :param with_label: if true, the moving and fixed labels are inputs
+    :return: concrete function taking the inputs as keyword arguments
+        and returning a dict of tensors
+    """
+    if isinstance(model, ConditionalModel) and not with_label:
+        raise ValueError("Conditional models require the labels as inputs.")
+    batch_size = model.batch_size
+    # the metrics of the losses are not updated during inference
+    network = model.get_inference_model()
+    specs = [
+        tf.TensorSpec(
+            shape=(batch_size,) + tuple(model.moving_image_size),
+            dtype=tf.float32,
+            name="moving_image",
+        ),
+        tf.TensorSpec(
+            shape=(batch_size,) + tuple(model.fixed_image_size),
+            dtype=tf.float32,
+            name="fixed_image",
+        ),
+    ]
+    if with_label:
+        specs += [
+            tf.TensorSpec(
+                shape=spec.shape,
+                dtype=tf.float32,
+                name=spec.name.replace("image", "label"),
+            )
+            for spec in specs
+        ]
+
+    def call(*args) -> Dict[str, tf.Tensor]:
+        inputs = {spec.name: arg for spec, arg in zip(specs, args)}
+        if model.labeled and not with_label:
+            inputs["moving_label"] = tf.zeros_like(inputs["moving_image"])
+            inputs["fixed_label"] = tf.zeros_like(inputs["fixed_image"])
+        inputs["indices"] = tf.zeros((batch_size, model.index_size))
+        if not model.labeled:
+            inputs = {key: value for key, value in inputs.items() if "label" not in key}
+        outputs = network(inputs, training=False)
+        names = ["ddf", "dvf", "theta"]
+        if with_warping:
+            names.append("pred_fixed_image")
+        if with_label and (with_warping or "ddf" not in outputs):
+            names.append("pred_fixed_label")
+        # the other outputs are pruned from the graph
+        return {name: outputs[name] for name in names if name in outputs}
+
+    # the signature of the function must name each input
+    if with_label:
+
+        def inference(moving_image, fixed_image, moving_label, fixed_label):
+            return call(moving_image, fixed_image, moving_label, fixed_label)
+
+    else:
+
+        def inference(moving_image, fixed_image):  # type: ignore
+            return call(moving_image, fixed_image)
+
+    return tf.function(inference, input_signature=specs).get_concrete_function()
+
+
+def export_saved_model(
+    model: tf.keras.Model,
+    out_dir: str,
+    with_warping: bool = True,
+    with_label: bool = False,
+    frozen_graph: bool = False,
+) -> Dict:
+    """
+    Save the inference function of a model as a SavedModel.
+
+    Only the variables captured by the function are tracked, so that neither
+    the optimizer nor the Keras and deepreg objects are saved.
+    The signature serving_default takes the inputs as keyword arguments.
+
+    :param model: built model with weights restored
+    :param out_dir: directory of the SavedModel
+    :param with_warping: if true, the warped moving image and label are outputs
+    :param with_label: if true, the moving and fixed labels are inputs
+    :param frozen_graph: if true, the graph with the variables converted into
+        constants is also saved in frozen_graph.pb under out_dir
+    :return: signature, names and shapes of inputs and outputs,
+        also saved in signature.json under out_dir
+    """
+    function = build_inference_function(
+        model=model, with_warping=with_warping, with_label=with_label
+    )
+    module = tf.Module()
+    module.variables_to_save = list(function.variables)
+    module.inference = function
+    tf.saved_model.save(module, out_dir, signatures={"serving_default": function})
+
+    signature = dict(
+        inputs={
+            spec.name: spec.shape.as_list()
+            for spec in function.structured_input_signature[0]
+        },
+        outputs={
+            name: spec.shape.as_list()
+            for name, spec in function.structured_outputs.items()
+        },
+    )
+    if frozen_graph:
+        # private module, the only way to convert the variables in TF 2
+        from tensorflow.python.framework.convert_to_constants import (  # pylint: disable=import-outside-toplevel
+            convert_variables_to_constants_v2,
+        )
+
+        frozen = convert_variables_to_constants_v2(function)
+        graph_def = frozen.graph.as_graph_def()
+        tf.io.write_graph(graph_def, out_dir, FROZEN_GRAPH_FILENAME, as_text=False)
+        # the outputs are flattened in the order of the sorted names
+        signature["frozen_graph"] = dict(
+            inputs=[x.name for x in frozen.inputs],
+            outputs=dict(
+                zip(
+                    sorted(function.structured_outputs.keys()),
+                    [x.name for x in frozen.outputs],
+                )
+            ),
+        )
+    with open(os.path.join(out_dir, SIGNATURE_FILENAME), "w") as file:
+        json.dump(signature, file, indent=2)
+    return signature
+
+
+def export(
+    gpu: str,
+    ckpt_path: str,
+    out_dir: str,
+    config_path: Union[str, List[str]] = "",
+    batch_size: int = 1,
+    with_warping: bool = True,
+    with_label: bool = False,
+    frozen_graph: bool = False,
+):
+    """
+    Export a checkpoint as an inference-only SavedModel.
+
+    :param gpu: which env gpu to use.
+    :param ckpt_path: where model is stored, should be like log_folder/save/ckpt-x
+    :param out_dir: directory of the SavedModel
+    :param config_path: to overwrite the default config
+    :param batch_size: batch size of the inputs of the exported function
+    :param with_warping: if true, the warped moving image and label are outputs
+    :param with_label: if true, the moving and fixed labels are inputs
+    :param frozen_graph: if true, a frozen graph is also saved
+    """
+    os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+    ckpt_path = os.path.expanduser(ckpt_path)
+    config = load_config(config_path=config_path, ckpt_path=ckpt_path)
+    model = build_model_from_config(config=config, batch_size=batch_size)
+    restore_model(model=model, ckpt_path=ckpt_path)
+    signature = export_saved_model(
+        model=model,
+        out_dir=out_dir,
+        with_warping=with_warping,
+        with_label=with_label,
+        frozen_graph=frozen_graph,
+    )
+    logging.info(f"Exported {ckpt_path} to {out_dir} with signature {signature}.")
+
+
+def main(args=None):
+    """
+    Entry point for export script.
+
+    :param args:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--gpu",
+        "-g",
+        help='GPU index for exporting, -g "" for using CPU, -g "0" for using GPU 0.',
+        type=str,
+        default="",
+    )
+
+    parser.add_argument(
+        "--ckpt_path",
+        "-k",
+        help="Path of checkpointed model to export",
+        type=str,
+        required=True,
+    )
+
+    parser.add_argument(
+        "--out_dir",
+        "-o",
+        help="Directory of the exported SavedModel.",
+        type=str,
+        required=True,
+    )
+
+    parser.add_argument(
+        "--config_path",
+        "-c",
+        help="Path of config, must end with .yaml. Can pass multiple paths.",
+        type=str,
+        nargs="*",
+        default="",
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        "-b",
+        help="Batch size of the inputs of the exported model.",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--no_warping",
+        dest="with_warping",
+        help="Only output the predicted DDF, without the warped moving image.",
+        action="store_false",
+    )
+
+    parser.add_argument(
+        "--with_label",
+        help="Take the moving and fixed labels as inputs and output the warped label.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--frozen_graph",
+        help="Also save a frozen graph with the weights converted into constants.",
+        action="store_true",
+    )
+
+    args = parser.parse_args(args)
+
+    export(
+        gpu=args.gpu,
+        ckpt_path=args.ckpt_path,
+        out_dir=args.out_dir,
+        config_path=args.config_path,
+        batch_size=args.batch_size,
+        with_warping=args.with_warping,
+        with_label=args.with_label,
+        frozen_graph=args.frozen_graph,
+    )
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -15,3 +15,10 @@ from deepreg.loss.label import (
     JaccardIndex,
     JaccardLoss,
 )
+from deepreg.loss.metric import (
+    DDFLogJacobianStd,
+    DDFNegativeJacobian,
+    ImageSSD,
+    LabelBinaryDice,
+    LabelTRE,
+)
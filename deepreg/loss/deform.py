@@ -1,6 +1,7 @@
 """Provide regularization functions and classes for ddf."""
-from typing import Callable
+from typing import Callable, Optional, Tuple
 
+import numpy as np
 import tensorflow as tf
 
 from deepreg.registry import REGISTRY
@@ -58,6 +59,153 @@ def gradient_dxyz(fxyz: tf.Tensor, fn: Callable) -> tf.Tensor:
     return tf.stack([fn(fxyz[..., i]) for i in [0, 1, 2]], axis=4)
 
 
+def central_difference_kernel(order: int) -> tf.Tensor:
+    """
+    Build the stencils of central finite differences as a conv3d kernel.
+
+    The 1-D central difference is [-1/2, 0, 1/2], as in gradient_dx.
+    A stencil composing several differences is the outer product over the axes
+    of the 1-D differences convolved together, so that
+
+        - order 1 returns the stencils of d/dx, d/dy, d/dz, of size 3,
+        - order 2 returns the stencils of d/dxx, d/dyy, d/dzz, d/dxy, d/dyz, d/dxz,
+          of size 5, identical to calling gradient_dxyz twice.
+
+    :param order: 1 or 2, order of the derivatives.
+    :return: shape = (size, size, size, 1, num_stencils)
+    """
+    diff = np.array([-0.5, 0, 0.5])
+    identity = np.array([0, 1, 0])
+    if order == 1:
+        derivatives = [(0,), (1,), (2,)]
+    elif order == 2:
+        derivatives = [(0, 0), (1, 1), (2, 2), (0, 1), (1, 2), (0, 2)]
+    else:
+        raise ValueError(f"order must be 1 or 2 for central differences, got {order}")
+    stencils = []
+    for axes in derivatives:
+        vectors = []
+        for axis in [0, 1, 2]:
+            vector = np.ones(1)
+            for derivative_axis in axes:
+                vector = np.convolve(
+                    vector, diff if derivative_axis == axis else identity
+                )
+            vectors.append(vector)
+        stencils.append(np.einsum("i,j,k->ijk", *vectors))
+    return tf.constant(np.stack(stencils, axis=3)[:, :, :, None, :], dtype=tf.float32)
+
+
+def central_difference(ddf: tf.Tensor, kernel: tf.Tensor) -> tf.Tensor:
+    """
+    Apply a bank of finite difference stencils to all ddf components at once.
+
+    The components are moved to the batch axis so that all derivatives are
+    calculated with one conv3d, producing one channel per stencil.
+
+    :param ddf: shape = (batch, m_dim1, m_dim2, m_dim3, 3)
+    :param kernel: shape = (size, size, size, 1, num_stencils)
+    :return: shape = (batch * 3, m_dim1-size+1, m_dim2-size+1, m_dim3-size+1,
+        num_stencils)
+    """
+    shape = tf.shape(ddf)
+    size = kernel.shape[0]
+    if any(dim is not None and dim < size for dim in ddf.shape[1:4]):
+        # conv3d does not accept volumes smaller than the stencils,
+        # there is no valid position, same as slicing
+        return tf.zeros(
+            [shape[0] * 3]
+            + [tf.maximum(shape[i] - size + 1, 0) for i in [1, 2, 3]]
+            + [kernel.shape[4]],
+            dtype=ddf.dtype,
+        )
+    # (batch * 3, m_dim1, m_dim2, m_dim3, 1)
+    ddf = tf.reshape(
+        tf.transpose(ddf, perm=[0, 4, 1, 2, 3]),
+        [-1, shape[1], shape[2], shape[3], 1],
+    )
+    return tf.nn.conv3d(
+        ddf,
+        filters=tf.cast(kernel, dtype=ddf.dtype),
+        strides=[1, 1, 1, 1, 1],
+        padding="VALID",
+    )
+
+
+def bspline_gram_filters(derivative: int) -> np.ndarray:
+    """
+    Build the filters integrating a squared cubic B-spline derivative on a cell.
+
+    On a unit cell, a cubic B-spline is sum_p c_p * b_p(u) for p = 0, ..., 3 and
+    u in [0, 1], so the integral of its squared derivative is c^T G c with
+
+        G_pq = integral of b_p^(d)(u) * b_q^(d)(u) over [0, 1].
+
+    With G = L L^T, the integral equals ||L^T c|| ** 2, therefore the columns of L
+    are filters of size 4 to correlate with the coefficients.
+    The integrands are polynomials of degree at most 6,
+    so the 4-point Gauss-Legendre quadrature is exact.
+
+    :param derivative: order of the derivative, 0, 1 or 2.
+    :return: shape = (4, rank), one filter per column.
+    """
+    # cubic B-spline pieces on a unit cell, highest degree first
+    pieces = [
+        np.array([-1, 3, -3, 1]) / 6,
+        np.array([3, -6, 0, 4]) / 6,
+        np.array([-3, 3, 3, 1]) / 6,
+        np.array([1, 0, 0, 0]) / 6,
+    ]
+    nodes, weights = np.polynomial.legendre.leggauss(4)
+    # map [-1, 1] to [0, 1]
+    nodes, weights = (nodes + 1) / 2, weights / 2
+    # (4, num_nodes)
+    values = np.stack(
+        [np.polyval(np.polyder(piece, m=derivative), nodes) for piece in pieces]
+    )
+    gram = (values * weights) @ values.T
+    eigen_values, eigen_vectors = np.linalg.eigh(gram)
+    # the gram matrices of derivatives are singular
+    rank = eigen_values > 1e-10 * eigen_values.max()
+    return eigen_vectors[:, rank] * np.sqrt(eigen_values[rank])
+
+
+def bspline_bending_kernel(cp_spacing: Tuple[int, ...]) -> tf.Tensor:
+    """
+    Build the filters calculating the bending energy of a cubic B-spline field.
+
+    The bending energy on a cell is the sum of the squared second order derivatives
+    dxx, dyy, dzz and 2 * dxy, 2 * dyz, 2 * dxz, each being separable over the axes.
+    Each derivative is scaled by the control point spacing,
+    e.g. dxx by 1 / cp_spacing[0] ** 2, so that the energy is per voxel.
+    The sum of squares of the filter responses over the channels is the energy
+    of the cell whose coefficients are under the filter.
+
+    :param cp_spacing: spacing between control points in voxels for each axis.
+    :return: shape = (4, 4, 4, 1, num_filters)
+    """
+    filters = {d: bspline_gram_filters(derivative=d) for d in [0, 1, 2]}
+    kernels = []
+    for derivatives, weight in [
+        ((2, 0, 0), 1),
+        ((0, 2, 0), 1),
+        ((0, 0, 2), 1),
+        ((1, 1, 0), 2),
+        ((0, 1, 1), 2),
+        ((1, 0, 1), 2),
+    ]:
+        scale = np.sqrt(weight) / np.prod(
+            [h ** d for h, d in zip(cp_spacing, derivatives)]
+        )
+        # (4, 4, 4, rank_x, rank_y, rank_z)
+        kernel = np.einsum(
+            "ia,jb,kc->ijkabc",
+            *[filters[d] for d in derivatives],
+        )
+        kernels.append(scale * kernel.reshape((4, 4, 4, -1)))
+    return tf.constant(np.concatenate(kernels, axis=3)[:, :, :, None, :], tf.float32)
+
+
 @REGISTRY.register_loss(name="gradient")
 class GradientNorm(tf.keras.layers.Layer):
     """
@@ -75,6 +223,8 @@ class GradientNorm(tf.keras.layers.Layer):
         """
         super().__init__(name=name)
         self.l1 = l1
+        # (3, 3, 3, 1, 3)
+        self.kernel = central_difference_kernel(order=1)
 
     def call(self, inputs: tf.Tensor, **kwargs) -> tf.Tensor:
         """
@@ -86,15 +236,13 @@ class GradientNorm(tf.keras.layers.Layer):
         """
         assert len(inputs.shape) == 5
         ddf = inputs
-        # first order gradient
-        # (batch, m_dim1-2, m_dim2-2, m_dim3-2, 3)
-        dfdx = gradient_dxyz(ddf, gradient_dx)
-        dfdy = gradient_dxyz(ddf, gradient_dy)
-        dfdz = gradient_dxyz(ddf, gradient_dz)
+        # first order gradient dx, dy, dz as channels
+        # (batch * 3, m_dim1-2, m_dim2-2, m_dim3-2, 3)
+        dfdxyz = central_difference(ddf, kernel=self.kernel)
         if self.l1:
-            norms = tf.abs(dfdx) + tf.abs(dfdy) + tf.abs(dfdz)
+            norms = tf.reduce_sum(tf.abs(dfdxyz), axis=4)
         else:
-            norms = dfdx ** 2 + dfdy ** 2 + dfdz ** 2
+            norms = tf.reduce_sum(dfdxyz ** 2, axis=4)
         return tf.reduce_mean(norms)
 
     def get_config(self) -> dict:
@@ -109,43 +257,91 @@ class BendingEnergy(tf.keras.layers.Layer):
     """
     Calculate the bending energy of ddf using central finite difference.
 
+    If the ddf is interpolated from the control points of cubic B-splines,
+    the bending energy can instead be calculated in closed form from the control
+    points, which has much fewer values than the ddf.
+
     y_true and y_pred have to be at least 5d tensor, including batch axis.
     """
 
-    def __init__(self, name: str = "BendingEnergy"):
+    def __init__(self, on_control_points: bool = False, name: str = "BendingEnergy"):
         """
         Init.
 
+        :param on_control_points: if True, calculate the bending energy in closed form
+            from the B-spline control points of the ddf,
+            which requires control_points and cp_spacing when calling the loss.
         :param name: name of the loss
         """
         super().__init__(name=name)
-
-    def call(self, inputs: tf.Tensor, **kwargs) -> tf.Tensor:
+        self.on_control_points = on_control_points
+        # (5, 5, 5, 1, 6)
+        self.kernel = central_difference_kernel(order=2)
+        # the mixed derivatives are counted twice
+        self.stencil_weights = tf.constant([1, 1, 1, 2, 2, 2], dtype=tf.float32)
+
+    def call(
+        self,
+        inputs: tf.Tensor,
+        control_points: Optional[tf.Tensor] = None,
+        cp_spacing: Optional[Tuple[int, ...]] = None,
+        **kwargs,
+    ) -> tf.Tensor:
         """
         Return a scalar loss.
 
         :param inputs: shape = (batch, m_dim1, m_dim2, m_dim3, 3)
+        :param control_points: B-spline control points of the ddf,
+            shape = (batch, cp_dim1, cp_dim2, cp_dim3, 3), used if on_control_points.
+        :param cp_spacing: spacing between control points in voxels for each axis,
+            used if on_control_points.
         :param kwargs: additional arguments.
         :return: shape = ()
         """
+        if self.on_control_points:
+            if control_points is None or cp_spacing is None:
+                raise ValueError(
+                    "BendingEnergy on_control_points requires the control points, "
+                    "the backbone must define control_points."
+                )
+            return self.call_on_control_points(
+                control_points=control_points, cp_spacing=cp_spacing
+            )
         assert len(inputs.shape) == 5
         ddf = inputs
-        # first order gradient
-        # (batch, m_dim1-2, m_dim2-2, m_dim3-2, 3)
-        dfdx = gradient_dxyz(ddf, gradient_dx)
-        dfdy = gradient_dxyz(ddf, gradient_dy)
-        dfdz = gradient_dxyz(ddf, gradient_dz)
-
-        # second order gradient
-        # (batch, m_dim1-4, m_dim2-4, m_dim3-4, 3)
-        dfdxx = gradient_dxyz(dfdx, gradient_dx)
-        dfdyy = gradient_dxyz(dfdy, gradient_dy)
-        dfdzz = gradient_dxyz(dfdz, gradient_dz)
-        dfdxy = gradient_dxyz(dfdx, gradient_dy)
-        dfdyz = gradient_dxyz(dfdy, gradient_dz)
-        dfdxz = gradient_dxyz(dfdx, gradient_dz)
+        # second order gradient dxx, dyy, dzz, dxy, dyz, dxz as channels
+        # (batch * 3, m_dim1-4, m_dim2-4, m_dim3-4, 6)
+        dfdxyz = central_difference(ddf, kernel=self.kernel)
 
         # (dx + dy + dz) ** 2 = dxx + dyy + dzz + 2*(dxy + dyz + dzx)
-        energy = dfdxx ** 2 + dfdyy ** 2 + dfdzz ** 2
-        energy += 2 * dfdxy ** 2 + 2 * dfdxz ** 2 + 2 * dfdyz ** 2
+        energy = tf.reduce_sum(
+            dfdxyz ** 2 * tf.cast(self.stencil_weights, dtype=dfdxyz.dtype), axis=4
+        )
         return tf.reduce_mean(energy)
+
+    def call_on_control_points(
+        self, control_points: tf.Tensor, cp_spacing: Tuple[int, ...]
+    ) -> tf.Tensor:
+        """
+        Return the bending energy of a cubic B-spline ddf in closed form.
+
+        The energy is integrated exactly on each cell, where the four control points
+        along each axis define the field, and averaged over the cells and
+        the ddf components, as the finite difference version is averaged over voxels.
+
+        :param control_points: shape = (batch, cp_dim1, cp_dim2, cp_dim3, 3)
+        :param cp_spacing: spacing between control points in voxels for each axis.
+        :return: shape = ()
+        """
+        assert len(control_points.shape) == 5
+        # (4, 4, 4, 1, num_filters)
+        kernel = bspline_bending_kernel(cp_spacing=cp_spacing)
+        # (batch * 3, cp_dim1-3, cp_dim2-3, cp_dim3-3, num_filters)
+        responses = central_difference(control_points, kernel=kernel)
+        return tf.reduce_mean(tf.reduce_sum(responses ** 2, axis=4))
+
+    def get_config(self) -> dict:
+        """Return the config dictionary for recreating this class."""
+        config = super().get_config()
+        config["on_control_points"] = self.on_control_points
+        return config
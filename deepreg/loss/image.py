@@ -1,7 +1,10 @@
 """Provide different loss or metrics classes for images."""
+from typing import Optional, Tuple
+
+import numpy as np
 import tensorflow as tf
 
-from deepreg.loss.util import NegativeLossMixin
+from deepreg.loss.util import NegativeLossMixin, box_filter, cast_to_full_precision
 from deepreg.loss.util import gaussian_kernel1d_size as gaussian_kernel1d
 from deepreg.loss.util import (
     rectangular_kernel1d,
@@ -54,6 +57,10 @@ class GlobalMutualInformation(tf.keras.losses.Loss):
 
     y_true and y_pred have to be at least 4d tensor, including batch axis.
 
+    The joint histogram can be accumulated over chunks of voxels,
+    and be estimated from a stratified random subsample of voxels,
+    to reduce the memory.
+
     Reference: https://dspace.mit.edu/handle/1721.1/123142,
         Section 3.1, equation 3.1-3.5, Algorithm 1
     """
@@ -62,6 +69,8 @@ class GlobalMutualInformation(tf.keras.losses.Loss):
         self,
         num_bins: int = 23,
         sigma_ratio: float = 0.5,
+        chunk_size: int = 0,
+        sample_fraction: float = 1.0,
         reduction: str = tf.keras.losses.Reduction.SUM,
         name: str = "GlobalMutualInformation",
     ):
@@ -70,13 +79,202 @@ class GlobalMutualInformation(tf.keras.losses.Loss):
 
         :param num_bins: number of bins for intensity, the default value is empirical.
         :param sigma_ratio: a hyper param for gaussian function
+        :param chunk_size: if positive, the histograms are accumulated over chunks
+            of chunk_size voxels, and the Parzen window weights of each chunk
+            are recomputed during back propagation instead of being stored.
+        :param sample_fraction: fraction of voxels used to estimate the histograms,
+            in (0, 1]. The voxels are split into strata of consecutive voxels
+            and one random voxel is sampled per stratum.
         :param reduction: using SUM reduction over batch axis,
             calling the loss like `loss(y_true, y_pred)` will return a scalar tensor.
         :param name: name of the loss
         """
         super().__init__(reduction=reduction, name=name)
+        if chunk_size < 0:
+            raise ValueError(
+                f"chunk_size must be non-negative for GMI, got {chunk_size}"
+            )
+        if not 0 < sample_fraction <= 1:
+            raise ValueError(
+                f"sample_fraction must be in (0, 1] for GMI, got {sample_fraction}"
+            )
         self.num_bins = num_bins
         self.sigma_ratio = sigma_ratio
+        self.chunk_size = chunk_size
+        self.sample_fraction = sample_fraction
+
+    def sample_voxels(
+        self, y_true: tf.Tensor, y_pred: tf.Tensor
+    ) -> Tuple[tf.Tensor, tf.Tensor]:
+        """
+        Sample one random voxel per stratum of consecutive voxels.
+
+        The strata cover all voxels and their sizes differ by at most one.
+        The voxels are drawn by stateless random ops seeded by the values of
+        the inputs, so that the same inputs always give the same samples.
+
+        :param y_true: shape = (batch, nb_voxels, 1)
+        :param y_pred: shape = (batch, nb_voxels, 1)
+        :return: y_true and y_pred of shape (batch, num_samples, 1)
+        """
+        nb_voxels = y_true.shape[1]
+        num_samples = max(int(nb_voxels * self.sample_fraction), 1)
+        bounds = np.linspace(0, nb_voxels, num_samples + 1).astype(np.int32)
+        lower, size = bounds[:-1], bounds[1:] - bounds[:-1]  # (num_samples,)
+
+        # the seed is the bits of the sums of the inputs
+        sums = tf.stack(
+            [
+                tf.reduce_sum(tf.cast(y_true, tf.float32)),
+                tf.reduce_sum(tf.cast(y_pred, tf.float32)),
+            ]
+        )
+        seed = tf.cast(tf.bitcast(tf.stop_gradient(sums), tf.int32), tf.int64)
+        offsets = tf.random.stateless_uniform(shape=(num_samples,), seed=seed)
+        offsets = tf.cast(offsets * size, tf.int32)
+        index = lower + tf.minimum(offsets, size - 1)  # (num_samples,)
+        return tf.gather(y_true, index, axis=1), tf.gather(y_pred, index, axis=1)
+
+    @staticmethod
+    def histograms(
+        y_true: tf.Tensor,
+        y_pred: tf.Tensor,
+        bin_centers: tf.Tensor,
+        preterm: tf.Tensor,
+        mask: Optional[tf.Tensor] = None,
+    ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+        """
+        Sum the Parzen window weights of voxels.
+
+        :param y_true: shape = (batch, nb_voxels, 1)
+        :param y_pred: shape = (batch, nb_voxels, 1)
+        :param bin_centers: shape = (1, 1, num_bins)
+        :param preterm: scalar, 1 / (2 * sigma ** 2)
+        :param mask: optional, shape = (1, nb_voxels, 1), 0 for ignored voxels
+        :return: sums of shape (batch, num_bins), (batch, num_bins)
+            and (batch, num_bins, num_bins)
+        """
+        # each voxel contributes continuously to a range of histogram bin
+        ia = tf.math.exp(
+            -preterm * tf.math.square(y_true - bin_centers)
+        )  # (batch, nb_voxels, num_bins)
+        ia /= tf.reduce_sum(ia, -1, keepdims=True)  # (batch, nb_voxels, num_bins)
+        ib = tf.math.exp(
+            -preterm * tf.math.square(y_pred - bin_centers)
+        )  # (batch, nb_voxels, num_bins)
+        ib /= tf.reduce_sum(ib, -1, keepdims=True)  # (batch, nb_voxels, num_bins)
+        if mask is not None:
+            ia *= mask
+            ib *= mask
+        return (
+            tf.reduce_sum(ia, axis=1),
+            tf.reduce_sum(ib, axis=1),
+            tf.matmul(ia, ib, transpose_a=True),
+        )
+
+    def chunked_histograms(
+        self,
+        y_true: tf.Tensor,
+        y_pred: tf.Tensor,
+        bin_centers: tf.Tensor,
+        preterm: tf.Tensor,
+    ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+        """
+        Sum the Parzen window weights of voxels chunk by chunk.
+
+        The chunks are processed sequentially in a while loop,
+        and the weights of each chunk are recomputed for the gradients,
+        so that only the weights of one chunk are in memory at a time.
+
+        :param y_true: shape = (batch, nb_voxels, 1)
+        :param y_pred: shape = (batch, nb_voxels, 1)
+        :param bin_centers: shape = (1, 1, num_bins)
+        :param preterm: scalar, 1 / (2 * sigma ** 2)
+        :return: same as histograms
+        """
+        batch, nb_voxels = y_true.shape[:2]
+        num_chunks = -(-nb_voxels // self.chunk_size)
+        padded_size = num_chunks * self.chunk_size
+
+        def to_chunks(x: tf.Tensor) -> tf.Tensor:
+            # (batch, nb_voxels, 1) -> (num_chunks, batch, chunk_size, 1)
+            x = tf.pad(x, paddings=[[0, 0], [0, padded_size - nb_voxels], [0, 0]])
+            x = tf.reshape(x, [batch, num_chunks, self.chunk_size, 1])
+            return tf.transpose(x, [1, 0, 2, 3])
+
+        # the padded voxels are masked, shape = (num_chunks, 1, chunk_size, 1)
+        masks = tf.sequence_mask(nb_voxels, padded_size, dtype=y_true.dtype)
+        masks = tf.reshape(masks, [num_chunks, 1, self.chunk_size, 1])
+
+        def chunk_histograms(
+            i: tf.Tensor, true_chunk: tf.Tensor, pred_chunk: tf.Tensor
+        ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+            return self.histograms(
+                y_true=true_chunk,
+                y_pred=pred_chunk,
+                bin_centers=bin_centers,
+                preterm=preterm,
+                mask=masks[i],
+            )
+
+        @tf.custom_gradient
+        def accumulate(true_chunks: tf.Tensor, pred_chunks: tf.Tensor):
+            # the weights are not recorded for the gradients in eager mode
+            true_values = tf.stop_gradient(true_chunks)
+            pred_values = tf.stop_gradient(pred_chunks)
+
+            def body(i, sum_a, sum_b, sum_ab):
+                chunk_a, chunk_b, chunk_ab = chunk_histograms(
+                    i, true_values[i], pred_values[i]
+                )
+                return i + 1, sum_a + chunk_a, sum_b + chunk_b, sum_ab + chunk_ab
+
+            num_bins = bin_centers.shape[-1]
+            _, sum_a, sum_b, sum_ab = tf.while_loop(
+                cond=lambda i, *_: i < num_chunks,
+                body=body,
+                loop_vars=[
+                    tf.constant(0),
+                    tf.zeros((batch, num_bins), dtype=y_true.dtype),
+                    tf.zeros((batch, num_bins), dtype=y_true.dtype),
+                    tf.zeros((batch, num_bins, num_bins), dtype=y_true.dtype),
+                ],
+                parallel_iterations=1,
+            )
+
+            def grad(d_sum_a, d_sum_b, d_sum_ab):
+                def grad_body(i, grads_true, grads_pred):
+                    true_chunk = true_chunks[i]
+                    pred_chunk = pred_chunks[i]
+                    with tf.GradientTape() as tape:
+                        tape.watch([true_chunk, pred_chunk])
+                        chunk_sums = chunk_histograms(i, true_chunk, pred_chunk)
+                    grad_true, grad_pred = tape.gradient(
+                        chunk_sums,
+                        [true_chunk, pred_chunk],
+                        output_gradients=[d_sum_a, d_sum_b, d_sum_ab],
+                    )
+                    return (
+                        i + 1,
+                        grads_true.write(i, grad_true),
+                        grads_pred.write(i, grad_pred),
+                    )
+
+                _, grads_true, grads_pred = tf.while_loop(
+                    cond=lambda i, *_: i < num_chunks,
+                    body=grad_body,
+                    loop_vars=[
+                        tf.constant(0),
+                        tf.TensorArray(dtype=y_true.dtype, size=num_chunks),
+                        tf.TensorArray(dtype=y_pred.dtype, size=num_chunks),
+                    ],
+                    parallel_iterations=1,
+                )
+                return grads_true.stack(), grads_pred.stack()
+
+            return (sum_a, sum_b, sum_ab), grad
+
+        return accumulate(to_chunks(y_true), to_chunks(y_pred))
 
     def call(self, y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
         """
@@ -94,6 +292,10 @@ class GlobalMutualInformation(tf.keras.losses.Loss):
             y_pred = tf.expand_dims(y_pred, axis=4)
         assert len(y_true.shape) == len(y_pred.shape) == 5
 
+        # the histograms are computed in float32 for half precision inputs
+        y_true = cast_to_full_precision(y_true)
+        y_pred = cast_to_full_precision(y_pred)
+
         # intensity is split into bins between 0, 1
         y_true = tf.clip_by_value(y_true, 0, 1)
         y_pred = tf.clip_by_value(y_pred, 0, 1)
@@ -108,25 +310,23 @@ class GlobalMutualInformation(tf.keras.losses.Loss):
         batch, w, h, z, c = y_true.shape
         y_true = tf.reshape(y_true, [batch, w * h * z * c, 1])  # (batch, nb_voxels, 1)
         y_pred = tf.reshape(y_pred, [batch, w * h * z * c, 1])  # (batch, nb_voxels, 1)
-        nb_voxels = y_true.shape[1] * 1.0  # w * h * z, number of voxels
+        if self.sample_fraction < 1:
+            y_true, y_pred = self.sample_voxels(y_true=y_true, y_pred=y_pred)
+        nb_voxels = y_true.shape[1]  # number of (sampled) voxels
 
-        # each voxel contributes continuously to a range of histogram bin
-        ia = tf.math.exp(
-            -preterm * tf.math.square(y_true - bin_centers)
-        )  # (batch, nb_voxels, num_bins)
-        ia /= tf.reduce_sum(ia, -1, keepdims=True)  # (batch, nb_voxels, num_bins)
-        ia = tf.transpose(ia, (0, 2, 1))  # (batch, num_bins, nb_voxels)
-        pa = tf.reduce_mean(ia, axis=-1, keepdims=True)  # (batch, num_bins, 1)
-
-        ib = tf.math.exp(
-            -preterm * tf.math.square(y_pred - bin_centers)
-        )  # (batch, nb_voxels, num_bins)
-        ib /= tf.reduce_sum(ib, -1, keepdims=True)  # (batch, nb_voxels, num_bins)
-        pb = tf.reduce_mean(ib, axis=1, keepdims=True)  # (batch, 1, num_bins)
+        if 0 < self.chunk_size < nb_voxels:
+            sum_a, sum_b, sum_ab = self.chunked_histograms(
+                y_true=y_true, y_pred=y_pred, bin_centers=bin_centers, preterm=preterm
+            )
+        else:
+            sum_a, sum_b, sum_ab = self.histograms(
+                y_true=y_true, y_pred=y_pred, bin_centers=bin_centers, preterm=preterm
+            )
 
+        pa = sum_a[:, :, None] / nb_voxels  # (batch, num_bins, 1)
+        pb = sum_b[:, None, :] / nb_voxels  # (batch, 1, num_bins)
         papb = tf.matmul(pa, pb)  # (batch, num_bins, num_bins)
-        pab = tf.matmul(ia, ib)  # (batch, num_bins, num_bins)
-        pab /= nb_voxels
+        pab = sum_ab / nb_voxels  # (batch, num_bins, num_bins)
 
         # MI: sum(P_ab * log(P_ab/P_ap_b))
         div = (pab + EPS) / (papb + EPS)
@@ -137,6 +337,8 @@ class GlobalMutualInformation(tf.keras.losses.Loss):
         config = super().get_config()
         config["num_bins"] = self.num_bins
         config["sigma_ratio"] = self.sigma_ratio
+        config["chunk_size"] = self.chunk_size
+        config["sample_fraction"] = self.sample_fraction
         return config
 
 
@@ -236,19 +438,29 @@ class LocalNormalizedCrossCorrelation(tf.keras.losses.Loss):
             y_pred = tf.expand_dims(y_pred, axis=4)
         assert len(y_true.shape) == len(y_pred.shape) == 5
 
+        # the variances are computed in float32 for half precision inputs
+        y_true = cast_to_full_precision(y_true)
+        y_pred = cast_to_full_precision(y_pred)
+
         # t = y_true, p = y_pred
         # (batch, dim1, dim2, dim3, ch)
         t2 = y_true * y_true
         p2 = y_pred * y_pred
         tp = y_true * y_pred
 
-        # sum over kernel
-        # (batch, dim1, dim2, dim3, 1)
-        t_sum = separable_filter(y_true, kernel=self.kernel)  # E[t] * E[1]
-        p_sum = separable_filter(y_pred, kernel=self.kernel)  # E[p] * E[1]
-        t2_sum = separable_filter(t2, kernel=self.kernel)  # E[tt] * E[1]
-        p2_sum = separable_filter(p2, kernel=self.kernel)  # E[pp] * E[1]
-        tp_sum = separable_filter(tp, kernel=self.kernel)  # E[tp] * E[1]
+        # sum over kernel, the five statistics are filtered at once
+        # (batch, dim1, dim2, dim3, 5 * ch)
+        stats = tf.concat([y_true, y_pred, t2, p2, tp], axis=4)
+        if self.kernel_type == "rectangular":
+            # cumulative sums, the cost does not depend on the kernel size
+            stats_sum = box_filter(stats, kernel_size=self.kernel_size)
+        else:
+            stats_sum = separable_filter(stats, kernel=self.kernel)
+        # E[t] * E[1], E[p] * E[1], E[tt] * E[1], E[pp] * E[1], E[tp] * E[1]
+        # (batch, dim1, dim2, dim3, ch)
+        t_sum, p_sum, t2_sum, p2_sum, tp_sum = tf.split(
+            stats_sum, num_or_size_splits=5, axis=4
+        )
 
         # average over kernel
         # (batch, dim1, dim2, dim3, 1)
@@ -1,5 +1,6 @@
 """Provide different loss or metrics classes for labels."""
 
+import math
 from typing import List, Optional
 
 import tensorflow as tf
@@ -26,6 +27,8 @@ class MultiScaleLoss(tf.keras.losses.Loss):
         self,
         scales: Optional[List] = None,
         kernel: str = "gaussian",
+        cascade: bool = False,
+        downsample: bool = False,
         reduction: str = tf.keras.losses.Reduction.SUM,
         name: str = "MultiScaleLoss",
     ):
@@ -34,14 +37,27 @@ class MultiScaleLoss(tf.keras.losses.Loss):
 
         :param scales: list of scalars or None, if None, do not apply any scaling.
         :param kernel: gaussian or cauchy.
+        :param cascade: if True, smooth each scale from the previous one,
+            requires the gaussian kernel.
+        :param downsample: if True, subsample the smoothed tensors by 2 once the
+            smoothing covers two voxels, requires cascade.
         :param reduction: using SUM reduction over batch axis,
             calling the loss like `loss(y_true, y_pred)` will return a scalar tensor.
         :param name: str, name of the loss.
         """
         super().__init__(reduction=reduction, name=name)
         assert kernel in ["gaussian", "cauchy"]
+        if cascade and kernel != "gaussian":
+            raise ValueError(
+                "cascade requires the gaussian kernel for MultiScaleLoss, "
+                f"got {kernel}"
+            )
+        if downsample and not cascade:
+            raise ValueError("downsample requires cascade for MultiScaleLoss")
         self.scales = scales
         self.kernel = kernel
+        self.cascade = cascade
+        self.downsample = downsample
 
     def call(self, y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
         """
@@ -53,7 +69,31 @@ class MultiScaleLoss(tf.keras.losses.Loss):
         """
         if self.scales is None:
             return self._call(y_true=y_true, y_pred=y_pred)
+        if self.cascade:
+            losses = self.cascade_losses(y_true=y_true, y_pred=y_pred)
+            return tf.add_n(losses) / len(self.scales)
         kernel_fn = self.kernel_fn_dict[self.kernel]
+
+        # smooth y_true and y_pred at all non-zero scales in one filter call
+        # each scale is a channel, kernels are zero padded to the same size
+        smooth_scales = [s for s in self.scales if s != 0]
+        num_scales = len(smooth_scales)
+        if num_scales > 0:
+            kernels = [kernel_fn(s) for s in smooth_scales]
+            kernel_size = max(k.shape[0] for k in kernels)
+            # kernel sizes are odd, so the kernels are padded symmetrically
+            kernels = [
+                tf.pad(k, paddings=[[(kernel_size - k.shape[0]) // 2] * 2])
+                for k in kernels
+            ]
+            # (batch, dim1, dim2, dim3, 2 * num_scales)
+            smoothed = separable_filter(
+                tf.stack([y_true] * num_scales + [y_pred] * num_scales, axis=4),
+                kernel=tf.stack(kernels + kernels, axis=1),
+            )
+            y_true_smoothed = tf.unstack(smoothed[..., :num_scales], axis=4)
+            y_pred_smoothed = tf.unstack(smoothed[..., num_scales:], axis=4)
+
         losses = []
         for s in self.scales:
             if s == 0:
@@ -67,18 +107,52 @@ class MultiScaleLoss(tf.keras.losses.Loss):
             else:
                 losses.append(
                     self._call(
-                        y_true=separable_filter(
-                            tf.expand_dims(y_true, axis=4), kernel_fn(s)
-                        )[..., 0],
-                        y_pred=separable_filter(
-                            tf.expand_dims(y_pred, axis=4), kernel_fn(s)
-                        )[..., 0],
+                        y_true=y_true_smoothed.pop(0),
+                        y_pred=y_pred_smoothed.pop(0),
                     )
                 )
         loss = tf.add_n(losses)
         loss = loss / len(self.scales)
         return loss
 
+    def cascade_losses(self, y_true: tf.Tensor, y_pred: tf.Tensor) -> List[tf.Tensor]:
+        """
+        Calculate the losses at all scales by smoothing incrementally.
+
+        Gaussian smoothing with sigma_1 then sigma_2 equals gaussian smoothing
+        with sqrt(sigma_1 ** 2 + sigma_2 ** 2), therefore the scales are sorted
+        and each one is smoothed from the previous one with the kernel
+        sqrt(s_k ** 2 - s_{k-1} ** 2).
+        Apart from the zero padding at the boundaries, the result is the same
+        as smoothing each scale from the input.
+
+        With downsample, the smoothed tensors are subsampled by 2 once sigma
+        covers two voxels of the current resolution. The coarser scales are
+        then smoothed and compared at the lower resolution,
+        which approximates the loss at the full resolution.
+
+        :param y_true: shape = (batch, dim1, dim2, dim3)
+        :param y_pred: shape = (batch, dim1, dim2, dim3)
+        :return: list of losses of shape (batch,), one per scale
+        """
+        losses = [
+            self._call(y_true=y_true, y_pred=y_pred) for s in self.scales if s == 0
+        ]
+        # (batch, dim1, dim2, dim3, 2)
+        smoothed = tf.stack([y_true, y_pred], axis=4)
+        sigma = 0  # smoothing so far, in voxels of the input
+        factor = 1  # voxel size of the current resolution
+        for s in sorted(s for s in self.scales if s != 0):
+            if s > sigma:
+                kernel = gaussian_kernel1d(math.sqrt(s ** 2 - sigma ** 2) / factor)
+                smoothed = separable_filter(smoothed, kernel=kernel)
+                sigma = s
+            losses.append(self._call(y_true=smoothed[..., 0], y_pred=smoothed[..., 1]))
+            if self.downsample and sigma >= 2 * factor:
+                smoothed = smoothed[:, ::2, ::2, ::2, :]
+                factor *= 2
+        return losses
+
     def _call(self, y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
         """
         Return loss for a batch.
@@ -94,6 +168,8 @@ class MultiScaleLoss(tf.keras.losses.Loss):
         config = super().get_config()
         config["scales"] = self.scales
         config["kernel"] = self.kernel
+        config["cascade"] = self.cascade
+        config["downsample"] = self.downsample
         return config
 
 
@@ -122,6 +198,8 @@ class DiceScore(MultiScaleLoss):
         background_weight: float = 0.0,
         scales: Optional[List] = None,
         kernel: str = "gaussian",
+        cascade: bool = False,
+        downsample: bool = False,
         reduction: str = tf.keras.losses.Reduction.SUM,
         name: str = "DiceScore",
     ):
@@ -132,11 +210,20 @@ class DiceScore(MultiScaleLoss):
         :param background_weight: weight for background, where y == 0.
         :param scales: list of scalars or None, if None, do not apply any scaling.
         :param kernel: gaussian or cauchy.
+        :param cascade: if True, smooth each scale from the previous one.
+        :param downsample: if True, smooth coarse scales at lower resolutions.
         :param reduction: using SUM reduction over batch axis,
             calling the loss like `loss(y_true, y_pred)` will return a scalar tensor.
         :param name: str, name of the loss.
         """
-        super().__init__(scales=scales, kernel=kernel, reduction=reduction, name=name)
+        super().__init__(
+            scales=scales,
+            kernel=kernel,
+            cascade=cascade,
+            downsample=downsample,
+            reduction=reduction,
+            name=name,
+        )
         assert 0 <= background_weight <= 1
         self.binary = binary
         self.background_weight = background_weight
@@ -196,6 +283,8 @@ class CrossEntropy(MultiScaleLoss):
         background_weight: float = 0.0,
         scales: Optional[List] = None,
         kernel: str = "gaussian",
+        cascade: bool = False,
+        downsample: bool = False,
         reduction: str = tf.keras.losses.Reduction.SUM,
         name: str = "CrossEntropy",
     ):
@@ -206,11 +295,20 @@ class CrossEntropy(MultiScaleLoss):
         :param background_weight: weight for background, where y == 0.
         :param scales: list of scalars or None, if None, do not apply any scaling.
         :param kernel: gaussian or cauchy.
+        :param cascade: if True, smooth each scale from the previous one.
+        :param downsample: if True, smooth coarse scales at lower resolutions.
         :param reduction: using SUM reduction over batch axis,
             calling the loss like `loss(y_true, y_pred)` will return a scalar tensor.
         :param name: str, name of the loss.
         """
-        super().__init__(scales=scales, kernel=kernel, reduction=reduction, name=name)
+        super().__init__(
+            scales=scales,
+            kernel=kernel,
+            cascade=cascade,
+            downsample=downsample,
+            reduction=reduction,
+            name=name,
+        )
         assert 0 <= background_weight <= 1
         self.binary = binary
         self.background_weight = background_weight
@@ -263,6 +361,8 @@ class JaccardIndex(MultiScaleLoss):
         binary: bool = False,
         scales: Optional[List] = None,
         kernel: str = "gaussian",
+        cascade: bool = False,
+        downsample: bool = False,
         reduction: str = tf.keras.losses.Reduction.SUM,
         name: str = "JaccardIndex",
     ):
@@ -272,11 +372,20 @@ class JaccardIndex(MultiScaleLoss):
         :param binary: if True, project y_true, y_pred to 0 or 1.
         :param scales: list of scalars or None, if None, do not apply any scaling.
         :param kernel: gaussian or cauchy.
+        :param cascade: if True, smooth each scale from the previous one.
+        :param downsample: if True, smooth coarse scales at lower resolutions.
         :param reduction: using SUM reduction over batch axis,
             calling the loss like `loss(y_true, y_pred)` will return a scalar tensor.
         :param name: str, name of the loss.
         """
-        super().__init__(scales=scales, kernel=kernel, reduction=reduction, name=name)
+        super().__init__(
+            scales=scales,
+            kernel=kernel,
+            cascade=cascade,
+            downsample=downsample,
+            reduction=reduction,
+            name=name,
+        )
         self.binary = binary
 
     def _call(self, y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
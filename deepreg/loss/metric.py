@@ -0,0 +1,228 @@
+"""
+Provide metric classes evaluating predictions sample by sample.
+
+A metric is registered under the name of its column in metrics.csv and is called
+with the named tensors of a batch, listed in `inputs`, returning one value per sample.
+"""
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import tensorflow as tf
+
+from deepreg.loss.deform import central_difference, central_difference_kernel
+from deepreg.loss.image import SumSquaredDifference
+from deepreg.loss.label import EPS, DiceScore, compute_centroid_distance
+from deepreg.registry import REGISTRY
+
+DEFAULT_METRICS = ["image_ssd", "label_binary_dice", "label_tre"]
+
+
+class Metric:
+    """
+    Base class of metrics.
+
+    The available tensors are
+        - fixed_image, shape = (batch, f_dim1, f_dim2, f_dim3)
+        - pred_fixed_image, shape = (batch, f_dim1, f_dim2, f_dim3)
+        - fixed_label, shape = (batch, f_dim1, f_dim2, f_dim3)
+        - pred_fixed_label, shape = (batch, f_dim1, f_dim2, f_dim3)
+        - ddf, shape = (batch, f_dim1, f_dim2, f_dim3, 3)
+        - fixed_grid_ref, shape = (1, f_dim1, f_dim2, f_dim3, 3)
+    """
+
+    # names of the tensors required by the metric
+    inputs: tuple = ()
+
+    def __call__(self, **kwargs) -> tf.Tensor:
+        """
+        Calculate the metric of each sample.
+
+        :param kwargs: required tensors, keys are given by inputs.
+        :return: shape = (batch,)
+        """
+        raise NotImplementedError
+
+
+@REGISTRY.register_metric(name="image_ssd")
+class ImageSSD(Metric):
+    """Sum of squared difference between fixed and warped moving images."""
+
+    inputs = ("fixed_image", "pred_fixed_image")
+
+    def __init__(self):
+        """Init."""
+        self.loss = SumSquaredDifference()
+
+    def __call__(  # type: ignore
+        self, fixed_image: tf.Tensor, pred_fixed_image: tf.Tensor
+    ) -> tf.Tensor:
+        """
+        Calculate the metric of each sample.
+
+        :param fixed_image: shape = (batch, f_dim1, f_dim2, f_dim3)
+        :param pred_fixed_image: shape = (batch, f_dim1, f_dim2, f_dim3)
+        :return: shape = (batch,)
+        """
+        return self.loss.call(
+            y_true=tf.expand_dims(fixed_image, axis=4),
+            y_pred=tf.expand_dims(pred_fixed_image, axis=4),
+        )
+
+
+@REGISTRY.register_metric(name="label_binary_dice")
+class LabelBinaryDice(Metric):
+    """Dice score between fixed and warped moving labels after thresholding."""
+
+    inputs = ("fixed_label", "pred_fixed_label")
+
+    def __init__(self):
+        """Init."""
+        self.loss = DiceScore(binary=True)
+
+    def __call__(  # type: ignore
+        self, fixed_label: tf.Tensor, pred_fixed_label: tf.Tensor
+    ) -> tf.Tensor:
+        """
+        Calculate the metric of each sample.
+
+        :param fixed_label: shape = (batch, f_dim1, f_dim2, f_dim3)
+        :param pred_fixed_label: shape = (batch, f_dim1, f_dim2, f_dim3)
+        :return: shape = (batch,)
+        """
+        return self.loss.call(y_true=fixed_label, y_pred=pred_fixed_label)
+
+
+@REGISTRY.register_metric(name="label_tre")
+class LabelTRE(Metric):
+    """Target registration error, distance between the label centroids."""
+
+    inputs = ("fixed_label", "pred_fixed_label", "fixed_grid_ref")
+
+    def __call__(  # type: ignore
+        self,
+        fixed_label: tf.Tensor,
+        pred_fixed_label: tf.Tensor,
+        fixed_grid_ref: tf.Tensor,
+    ) -> tf.Tensor:
+        """
+        Calculate the metric of each sample.
+
+        :param fixed_label: shape = (batch, f_dim1, f_dim2, f_dim3)
+        :param pred_fixed_label: shape = (batch, f_dim1, f_dim2, f_dim3)
+        :param fixed_grid_ref: shape = (1, f_dim1, f_dim2, f_dim3, 3)
+        :return: shape = (batch,)
+        """
+        return compute_centroid_distance(
+            y_true=fixed_label, y_pred=pred_fixed_label, grid=fixed_grid_ref[0]
+        )
+
+
+def jacobian_determinant(ddf: tf.Tensor) -> tf.Tensor:
+    """
+    Calculate the Jacobian determinant of the transformation x + ddf(x).
+
+    The Jacobian is I + grad(ddf), using central finite differences,
+    so the borders are excluded.
+
+    :param ddf: shape = (batch, m_dim1, m_dim2, m_dim3, 3)
+    :return: shape = (batch, m_dim1-2, m_dim2-2, m_dim3-2)
+    """
+    # (batch * 3, m_dim1-2, m_dim2-2, m_dim3-2, 3), derivatives of each component
+    grad = central_difference(ddf, kernel=central_difference_kernel(order=1))
+    shape = tf.shape(grad)
+    grad = tf.reshape(grad, [-1, 3, shape[1], shape[2], shape[3], 3])
+    # (batch, m_dim1-2, m_dim2-2, m_dim3-2, 3, 3), jacobian[..., i, j] = du_i/dx_j
+    jacobian = tf.transpose(grad, perm=[0, 2, 3, 4, 1, 5]) + tf.eye(3, dtype=ddf.dtype)
+    return tf.linalg.det(jacobian)
+
+
+@REGISTRY.register_metric(name="ddf_negative_jacobian")
+class DDFNegativeJacobian(Metric):
+    """Fraction of voxels where the transformation folds, i.e. det(J) <= 0."""
+
+    inputs = ("ddf",)
+
+    def __call__(self, ddf: tf.Tensor) -> tf.Tensor:  # type: ignore
+        """
+        Calculate the metric of each sample.
+
+        :param ddf: shape = (batch, f_dim1, f_dim2, f_dim3, 3)
+        :return: shape = (batch,)
+        """
+        det = jacobian_determinant(ddf)
+        return tf.reduce_mean(tf.cast(det <= 0, dtype=ddf.dtype), axis=[1, 2, 3])
+
+
+@REGISTRY.register_metric(name="ddf_log_jacobian_std")
+class DDFLogJacobianStd(Metric):
+    """Standard deviation of the log Jacobian determinant, measuring smoothness."""
+
+    inputs = ("ddf",)
+
+    def __call__(self, ddf: tf.Tensor) -> tf.Tensor:  # type: ignore
+        """
+        Calculate the metric of each sample.
+
+        The determinant is clipped to EPS before taking the log to handle folding.
+
+        :param ddf: shape = (batch, f_dim1, f_dim2, f_dim3, 3)
+        :return: shape = (batch,)
+        """
+        det = jacobian_determinant(ddf)
+        return tf.math.reduce_std(tf.math.log(tf.maximum(det, EPS)), axis=[1, 2, 3])
+
+
+class BatchMetrics:
+    """
+    Calculate a set of metrics for all samples of a batch.
+
+    The metric objects are built once and evaluated together
+    in one compiled function per batch.
+    A metric is None if one of its inputs is not given, e.g. for unlabeled data.
+    """
+
+    def __init__(self, metrics: Optional[List[Union[str, dict]]] = None):
+        """
+        Init.
+
+        :param metrics: names or configs of registered metrics,
+            default to image_ssd, label_binary_dice and label_tre.
+        """
+        if metrics is None:
+            metrics = DEFAULT_METRICS
+        configs = [dict(name=x) if isinstance(x, str) else x for x in metrics]
+        self.metrics = {
+            config["name"]: REGISTRY.build_metric(config=config) for config in configs
+        }
+        self._calculate = tf.function(self.calculate)
+
+    def calculate(self, tensors: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+        """
+        Calculate the metrics whose inputs are all available.
+
+        :param tensors: named tensors of the batch.
+        :return: dict of metric values, each of shape = (batch,)
+        """
+        return {
+            name: metric(**{key: tensors[key] for key in metric.inputs})
+            for name, metric in self.metrics.items()
+            if all(key in tensors for key in metric.inputs)
+        }
+
+    def __call__(self, **kwargs) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Calculate the metrics of a batch.
+
+        :param kwargs: named tensors or arrays, None values are ignored.
+        :return: dict of metric values, each of shape = (batch,) or None.
+        """
+        tensors = {
+            key: tf.convert_to_tensor(value, dtype=tf.float32)
+            for key, value in kwargs.items()
+            if value is not None
+        }
+        values = self._calculate(tensors)
+        return {
+            name: values[name].numpy() if name in values else None
+            for name in self.metrics
+        }
@@ -30,6 +30,20 @@ class NegativeLossMixin(tf.keras.losses.Loss):
 EPS = tf.keras.backend.epsilon()
 
 
+def cast_to_full_precision(tensor: tf.Tensor) -> tf.Tensor:
+    """
+    Cast a float16 or bfloat16 tensor to float32,
+    other tensors are returned unchanged.
+
+    :param tensor: input tensor
+    :return: tensor of at least single precision
+    """
+    tensor = tf.convert_to_tensor(tensor)
+    if tensor.dtype in [tf.float16, tf.bfloat16]:
+        return tf.cast(tensor, dtype=tf.float32)
+    return tensor
+
+
 def rectangular_kernel1d(kernel_size: int) -> tf.Tensor:
     """
     Return a the 1D filter for separable convolution equivalent to a 3-D rectangular
@@ -123,35 +137,80 @@ def cauchy_kernel1d(sigma: int) -> tf.Tensor:
 
 def separable_filter(tensor: tf.Tensor, kernel: tf.Tensor) -> tf.Tensor:
     """
-    Create a 3d separable filter.
-
-    Here `tf.nn.conv3d` accepts the `filters` argument of shape
-    (filter_depth, filter_height, filter_width, in_channels, out_channels),
-    where the first axis of `filters` is the depth not batch,
-    and the input to `tf.nn.conv3d` is of shape
-    (batch, in_depth, in_height, in_width, in_channels).
-
-    :param tensor: shape = (batch, dim1, dim2, dim3, 1)
-    :param kernel: shape = (dim4,)
-    :return: shape = (batch, dim1, dim2, dim3, 1)
+    Create a 3d separable filter, applied to each channel independently.
+
+    The channels are filtered in one depthwise pass per axis.
+    Here `tf.nn.depthwise_conv2d` accepts the `filter` argument of shape
+    (filter_height, filter_width, in_channels, channel_multiplier)
+    and the input of shape (batch, in_height, in_width, in_channels),
+    so the 3d tensor is reshaped without copy such that the filtered axis
+    is the height or width:
+
+        - axis 1: (batch, dim1, dim2 * dim3, ch), filtered along height,
+        - axis 2: (batch * dim1, dim2, dim3, ch), filtered along height,
+        - axis 3: (batch * dim1, dim2, dim3, ch), filtered along width.
+
+    :param tensor: shape = (batch, dim1, dim2, dim3, ch)
+    :param kernel: shape = (dim4,) shared by all channels,
+        or shape = (dim4, ch) with one kernel per channel.
+    :return: shape = (batch, dim1, dim2, dim3, ch)
     """
-    strides = [1, 1, 1, 1, 1]
+    strides = [1, 1, 1, 1]
+    num_channels = tensor.shape[4]
     kernel = tf.cast(kernel, dtype=tensor.dtype)
+    if len(kernel.shape) != 2:
+        kernel = tf.tile(tf.reshape(kernel, [-1, 1]), [1, num_channels])
+    # (dim4, 1, ch, 1)
+    kernel = kernel[:, None, :, None]
+
+    shape = tf.shape(tensor)
+    batch, dim1, dim2, dim3 = shape[0], shape[1], shape[2], shape[3]
 
-    tensor = tf.nn.conv3d(
-        tf.nn.conv3d(
-            tf.nn.conv3d(
-                tensor,
-                filters=tf.reshape(kernel, [-1, 1, 1, 1, 1]),
-                strides=strides,
-                padding="SAME",
-            ),
-            filters=tf.reshape(kernel, [1, -1, 1, 1, 1]),
-            strides=strides,
-            padding="SAME",
-        ),
-        filters=tf.reshape(kernel, [1, 1, -1, 1, 1]),
+    tensor = tf.nn.depthwise_conv2d(
+        tf.reshape(tensor, [batch, dim1, dim2 * dim3, num_channels]),
+        filter=kernel,
         strides=strides,
         padding="SAME",
     )
+    tensor = tf.reshape(tensor, [batch * dim1, dim2, dim3, num_channels])
+    tensor = tf.nn.depthwise_conv2d(
+        tensor, filter=kernel, strides=strides, padding="SAME"
+    )
+    tensor = tf.nn.depthwise_conv2d(
+        tensor,
+        filter=tf.transpose(kernel, [1, 0, 2, 3]),
+        strides=strides,
+        padding="SAME",
+    )
+    return tf.reshape(tensor, [batch, dim1, dim2, dim3, num_channels])
+
+
+def box_filter(tensor: tf.Tensor, kernel_size: int) -> tf.Tensor:
+    """
+    Sum a 3d tensor over a cubic window using cumulative sums.
+
+    This is equivalent to `separable_filter` with a rectangular kernel,
+    including the zero padding, but the cost per voxel does not depend on
+    the kernel size. Along each spatial axis the tensor is zero padded,
+    cumulated, and the window sum is the difference of the cumulated values
+    at distance `kernel_size`. All channels are filtered independently,
+    so multiple statistics can be summed at once by stacking them as channels.
+
+    :param tensor: shape = (batch, dim1, dim2, dim3, ch)
+    :param kernel_size: size of the window along each axis
+    :return: shape = (batch, dim1, dim2, dim3, ch)
+    """
+    # same padding as tf.nn.conv3d, plus one leading zero for the cumulated sum
+    pad_before = (kernel_size - 1) // 2 + 1
+    pad_after = kernel_size - 1 - (kernel_size - 1) // 2
+    for axis in [1, 2, 3]:
+        paddings = [[0, 0]] * 5
+        paddings[axis] = [pad_before, pad_after]
+        cumsum = tf.cumsum(tf.pad(tensor, paddings=paddings), axis=axis)
+        # the padded axis has length dim + kernel_size
+        upper = [slice(None)] * 5
+        upper[axis] = slice(kernel_size, None)
+        lower = [slice(None)] * 5
+        lower[axis] = slice(None, -kernel_size)
+        tensor = cumsum[tuple(upper)] - cumsum[tuple(lower)]
     return tensor
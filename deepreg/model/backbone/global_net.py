@@ -47,6 +47,8 @@ class AffineHead(tfkl.Layer):
             inputs = inputs[0]
         theta = self._dense(self._flatten(inputs))
         theta = tf.reshape(theta, shape=(-1, 4, 3))
+        # the grid is warped in float32 if the layer computes in lower precision
+        theta = tf.cast(theta, dtype=self.reference_grid.dtype)
         # warp the reference grid with affine parameters to output a ddf
         grid_warped = layer_util.warp_grid(self.reference_grid, theta)
         ddf = grid_warped - self.reference_grid
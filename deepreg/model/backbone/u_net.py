@@ -1,6 +1,6 @@
 # coding=utf-8
 
-from typing import List, Optional, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import tensorflow as tf
 import tensorflow.keras.layers as tfkl
@@ -42,6 +42,7 @@ class UNet(Backbone):
         decode_num_channels: Optional[Tuple] = None,
         strides: int = 2,
         padding: str = "same",
+        recompute: bool = False,
         name: str = "Unet",
         **kwargs,
     ):
@@ -67,6 +68,11 @@ class UNet(Backbone):
             by default it is the same as encode_num_channels
         :param strides: strides for down-sampling
         :param padding: padding mode for all conv layers
+        :param recompute: if True, the activations inside each depth level
+            are recomputed during back propagation instead of being stored,
+            only the inputs and outputs of the levels are kept in memory.
+            The moving statistics of batch normalization are then updated
+            twice per training step.
         :param name: name of the backbone.
         :param kwargs: additional arguments.
         """
@@ -94,6 +100,7 @@ class UNet(Backbone):
         self._decode_num_channels = decode_num_channels
         self._strides = strides
         self._padding = padding
+        self._recompute = recompute
 
         # init layers
         # all lists start with d = 0
@@ -526,6 +533,66 @@ class UNet(Backbone):
             out_activation=out_activation,
         )
 
+    def encode_level(
+        self, d: int, encoded: tf.Tensor, training=None
+    ) -> Tuple[tf.Tensor, tf.Tensor]:
+        """
+        Encode the tensor at depth d.
+
+        :param d: depth of the level, 0 <= d < depth.
+        :param encoded: tensor from the level above.
+        :param training: None or bool.
+        :return: (skip, encoded), skip is used for decoding at the same level,
+            encoded is the down-sampled tensor for the level below.
+        """
+        skip = self._encode_convs[d](inputs=encoded, training=training)
+        encoded = self._encode_pools[d](inputs=skip, training=training)
+        return skip, encoded
+
+    def bottom_level(self, d: int, encoded: tf.Tensor, training=None) -> tf.Tensor:
+        """
+        Process the tensor at the bottom level.
+
+        :param d: depth of the level, d = depth.
+        :param encoded: tensor from the level above.
+        :param training: None or bool.
+        :return: decoded tensor.
+        """
+        return self._bottom_block(inputs=encoded, training=training)  # type: ignore
+
+    def decode_level(
+        self, d: int, decoded: tf.Tensor, skip: tf.Tensor, training=None
+    ) -> tf.Tensor:
+        """
+        Decode the tensor at depth d.
+
+        :param d: depth of the level, 0 <= d < depth.
+        :param decoded: tensor from the level below.
+        :param skip: skipped tensor from the encoder at the same level.
+        :param training: None or bool.
+        :return: decoded tensor.
+        """
+        decoded = self._decode_deconvs[d](inputs=decoded, training=training)
+        decoded = self.build_skip_block()([decoded, skip])
+        return self._decode_convs[d](inputs=decoded, training=training)
+
+    def level_fn(self, fn: Callable, d: int, training=None) -> Callable:
+        """
+        Return the function computing one level from its input tensors.
+
+        If recompute is True, the function is wrapped with tf.recompute_grad.
+
+        :param fn: encode_level, bottom_level or decode_level.
+        :param d: depth of the level.
+        :param training: None or bool.
+        :return: function taking the input tensors of the level.
+        """
+
+        def level(*tensors: tf.Tensor):
+            return fn(d, *tensors, training=training)
+
+        return tf.recompute_grad(level) if self._recompute else level
+
     def call(self, inputs: tf.Tensor, training=None, mask=None) -> tf.Tensor:
         """
         Build compute graph based on built layers.
@@ -540,19 +607,16 @@ class UNet(Backbone):
         skips = []
         encoded = inputs
         for d in range(self._depth):
-            skip = self._encode_convs[d](inputs=encoded, training=training)
-            encoded = self._encode_pools[d](inputs=skip, training=training)
+            skip, encoded = self.level_fn(self.encode_level, d, training)(encoded)
             skips.append(skip)
 
         # bottom
-        decoded = self._bottom_block(inputs=encoded, training=training)  # type: ignore
+        decoded = self.level_fn(self.bottom_level, self._depth, training)(encoded)
 
         # decoding / up-sampling
         outs = [decoded]
         for d in range(self._depth - 1, min(self._extract_levels) - 1, -1):
-            decoded = self._decode_deconvs[d](inputs=decoded, training=training)
-            decoded = self.build_skip_block()([decoded, skips[d]])
-            decoded = self._decode_convs[d](inputs=decoded, training=training)
+            decoded = self.level_fn(self.decode_level, d, training)(decoded, skips[d])
             outs = [decoded] + outs
 
         # output
@@ -574,5 +638,6 @@ class UNet(Backbone):
             decode_num_channels=self._decode_num_channels,
             strides=self._strides,
             padding=self._padding,
+            recompute=self._recompute,
         )
         return config
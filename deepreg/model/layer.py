@@ -1,4 +1,5 @@
 """This module defines custom layers."""
+import functools
 import itertools
 from typing import List, Tuple, Union
 
@@ -207,6 +208,9 @@ class Resize3d(tfkl.Layer):
             output, shape=[-1, *self._shape, image_shape[4]]
         )  # (batch, out_dim1, out_dim2, out_dim3, channels)
 
+        # tf.image.resize returns float32 for float16 inputs
+        output = tf.cast(output, dtype=image.dtype)
+
         # squeeze to original dimension
         if not has_batch:
             output = tf.squeeze(output, axis=0)
@@ -232,17 +236,26 @@ class Warping(tfkl.Layer):
     where vol = image, loc_shift = ddf
     """
 
-    def __init__(self, fixed_image_size: tuple, name: str = "warping", **kwargs):
+    def __init__(
+        self,
+        fixed_image_size: tuple,
+        interpolation: str = "linear",
+        name: str = "warping",
+        **kwargs,
+    ):
         """
         Init.
 
         :param fixed_image_size: shape = (f_dim1, f_dim2, f_dim3)
              or (f_dim1, f_dim2, f_dim3, ch) with the last channel for features
+        :param interpolation: linear, nearest or cubic,
+            nearest is recommended for warping labels at inference.
         :param name: name of the layer
         :param kwargs: additional arguments.
         """
         super().__init__(name=name, **kwargs)
         self._fixed_image_size = fixed_image_size
+        self._interpolation = interpolation
         # shape = (1, f_dim1, f_dim2, f_dim3, 3)
         self.grid_ref = layer_util.get_reference_grid(grid_size=fixed_image_size)
         self.grid_ref = self.grid_ref[None, ...]
@@ -257,12 +270,15 @@ class Warping(tfkl.Layer):
         :return: shape = (batch, f_dim1, f_dim2, f_dim3)
         """
         ddf, image = inputs
-        return layer_util.resample(vol=image, loc=self.grid_ref + ddf)
+        return layer_util.resample(
+            vol=image, loc=self.grid_ref + ddf, interpolation=self._interpolation
+        )
 
     def get_config(self) -> dict:
         """Return the config dictionary for recreating this class."""
         config = super().get_config()
         config["fixed_image_size"] = self._fixed_image_size
+        config["interpolation"] = self._interpolation
         return config
 
 
@@ -366,6 +382,8 @@ class IntDVF(tfkl.Layer):
         self,
         fixed_image_size: tuple,
         num_steps: int = 7,
+        sampling_dtype: str = "float32",
+        recompute: bool = False,
         name: str = "int_dvf",
         **kwargs,
     ):
@@ -374,14 +392,58 @@ class IntDVF(tfkl.Layer):
 
         :param fixed_image_size: tuple, (f_dim1, f_dim2, f_dim3)
         :param num_steps: int, number of steps for integration
+        :param sampling_dtype: dtype of the DDF during the integration,
+            float16 or bfloat16 halves the memory of the squaring steps,
+            while the sampling positions are calculated in float32.
+        :param recompute: if True, the steps are checkpointed in segments of
+            about sqrt(num_steps) steps and each step within a segment.
+            The back propagation stores the DDF at the start of each segment,
+            the DDFs of one recomputed segment and the tensors of one step,
+            so that the memory grows with sqrt(num_steps) instead of num_steps.
         :param name: name of the layer
         :param kwargs: additional arguments.
         """
         super().__init__(name=name, **kwargs)
         assert len(fixed_image_size) == 3
+        assert sampling_dtype in [
+            "float32",
+            "float16",
+            "bfloat16",
+        ], f"sampling_dtype must be float32 / float16 / bfloat16, got {sampling_dtype}"
         self._fixed_image_size = fixed_image_size
         self._num_steps = num_steps
-        self._warping = Warping(fixed_image_size=fixed_image_size)
+        self._sampling_dtype = sampling_dtype
+        self._recompute = recompute
+        # shape = (1, f_dim1, f_dim2, f_dim3, 3), shared by all steps
+        self.grid_ref = layer_util.get_reference_grid(grid_size=fixed_image_size)
+        self.grid_ref = self.grid_ref[None, ...]
+
+    def squaring_step(self, ddf: tf.Tensor) -> tf.Tensor:
+        """
+        Compose the DDF with itself, ddf(x) + ddf(x + ddf(x)).
+
+        :param ddf: shape = (batch, f_dim1, f_dim2, f_dim3, 3), in sampling_dtype
+        :return: shape = (batch, f_dim1, f_dim2, f_dim3, 3), in sampling_dtype
+        """
+        loc = self.grid_ref + tf.cast(ddf, dtype=self.grid_ref.dtype)
+        return ddf + layer_util.resample(vol=ddf, loc=loc)
+
+    def squaring_steps(self, ddf: tf.Tensor, num_steps: int) -> tf.Tensor:
+        """
+        Apply multiple squaring steps, each step is checkpointed if recompute.
+
+        :param ddf: shape = (batch, f_dim1, f_dim2, f_dim3, 3)
+        :param num_steps: number of steps
+        :return: shape = (batch, f_dim1, f_dim2, f_dim3, 3)
+        """
+        step = (
+            tf.recompute_grad(self.squaring_step)
+            if self._recompute
+            else self.squaring_step
+        )
+        for _ in range(num_steps):
+            ddf = step(ddf)
+        return ddf
 
     def call(self, inputs: tf.Tensor, **kwargs) -> tf.Tensor:
         """
@@ -389,16 +451,30 @@ class IntDVF(tfkl.Layer):
         :param kwargs: additional arguments.
         :return: ddf, shape = (batch, f_dim1, f_dim2, f_dim3, 3)
         """
-        ddf = inputs / (2 ** self._num_steps)
-        for _ in range(self._num_steps):
-            ddf += self._warping(inputs=[ddf, ddf])
-        return ddf
+        # the DDF is cast once before and after all steps
+        ddf = tf.cast(inputs / (2 ** self._num_steps), dtype=self._sampling_dtype)
+        if not self._recompute:
+            ddf = self.squaring_steps(ddf, num_steps=self._num_steps)
+            return tf.cast(ddf, dtype=inputs.dtype)
+
+        # checkpoint every segment_size steps, the back propagation stores
+        # num_steps / segment_size + segment_size DDFs and the tensors of one step
+        segment_size = int(np.ceil(np.sqrt(self._num_steps)))
+        for start in range(0, self._num_steps, segment_size):
+            segment = functools.partial(
+                self.squaring_steps,
+                num_steps=min(segment_size, self._num_steps - start),
+            )
+            ddf = tf.recompute_grad(segment)(ddf)
+        return tf.cast(ddf, dtype=inputs.dtype)
 
     def get_config(self) -> dict:
         """Return the config dictionary for recreating this class."""
         config = super().get_config()
         config["fixed_image_size"] = self._fixed_image_size
         config["num_steps"] = self._num_steps
+        config["sampling_dtype"] = self._sampling_dtype
+        config["recompute"] = self._recompute
         return config
 
 
@@ -214,6 +214,192 @@ def pyramid_combination(
     return values_floor + values_ceil
 
 
+def flatten_volume(
+    vol: tf.Tensor, dim_vol: int, has_ch: bool, index_rank: int
+) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+    r"""
+    Flatten a batch of volumes so that values are gathered using linear indices.
+
+    The linear index of the voxel (b, v1, ..., vn) is
+    batch_offset[b] + sum over d (vd * strides[d]).
+
+    :param vol: shape = (batch, \*vol_shape) or (batch, \*vol_shape, ch)
+    :param dim_vol: dimension of vol, n
+    :param has_ch: if vol has a feature channel
+    :param index_rank: rank of the linear index tensors, including the batch axis
+    :return:
+        - vol_flat, shape = (batch * prod(vol_shape), ) or (batch * prod(vol_shape), ch)
+        - strides, shape = (n, )
+        - batch_offset, shape = (batch, 1, ..., 1) of rank index_rank
+    """
+    vol_shape = vol.shape[1 : dim_vol + 1]
+    vol_flat = tf.reshape(vol, [-1, vol.shape[-1]] if has_ch else [-1])
+    strides = [int(np.prod(vol_shape[d + 1 :])) for d in range(dim_vol)]
+    strides = tf.constant(strides, dtype=tf.int32)
+    batch_size = tf.shape(vol)[0]
+    batch_offset = tf.reshape(
+        tf.range(batch_size) * int(np.prod(vol_shape)), [-1] + [1] * (index_rank - 1)
+    )
+    return vol_flat, strides, batch_offset
+
+
+def get_bspline_coefficients(vol: tf.Tensor, axis: int) -> tf.Tensor:
+    """
+    Convert samples into cubic B-spline coefficients along one axis.
+
+    Samples s are interpolated by the B-spline of coefficients c if
+    s[i] = (c[i-1] + 4 * c[i] + c[i+1]) / 6, with mirror boundary,
+    i.e. c[-1] = c[1] and c[size] = c[size-2]. The system is solved by
+    multiplying the samples with its inverse matrix, which is faster than
+    the equivalent recursive filters for the volume sizes used in registration.
+
+    :param vol: tensor of samples
+    :param axis: axis to filter
+    :return: coefficients, of the same shape as vol
+    """
+    size = vol.shape[axis]
+    if size == 1:
+        return vol
+    mat = np.zeros((size, size))
+    for i in range(size):
+        mat[i, i] += 4 / 6
+        for j in [i - 1, i + 1]:
+            j = abs(j)  # mirror at 0
+            j = 2 * (size - 1) - j if j > size - 1 else j  # mirror at size-1
+            mat[i, j] += 1 / 6
+    mat = tf.constant(np.linalg.inv(mat), dtype=vol.dtype)
+
+    # the contracted axis is moved to the end by tensordot, move it back
+    rank = len(vol.shape)
+    coeff = tf.tensordot(vol, mat, axes=[[axis], [1]])
+    perm = list(range(axis)) + [rank - 1] + list(range(axis, rank - 1))
+    return tf.transpose(coeff, perm=perm)
+
+
+def resample_nearest(
+    vol: tf.Tensor, loc: tf.Tensor, dim_vol: int, has_ch: bool, zero_boundary: bool
+) -> tf.Tensor:
+    r"""
+    Sample the volume at given locations using the nearest voxel values.
+
+    :param vol: shape = (batch, \*vol_shape) or (batch, \*vol_shape, ch)
+    :param loc: shape = (batch, \*loc_shape, n)
+    :param dim_vol: dimension of vol, n
+    :param has_ch: if vol has a feature channel
+    :param zero_boundary: if true, values whose nearest voxel is outside
+        the volume will be zeros, otherwise boundary values are repeated.
+    :return: shape = (batch, \*loc_shape) or (batch, \*loc_shape, ch)
+    """
+    vol_shape = vol.shape[1 : dim_vol + 1]
+    loc_round = tf.math.floor(loc + 0.5)
+    clip_value_max = tf.cast(vol_shape, dtype=loc.dtype) - 1  # (n,)
+    loc_clipped = tf.clip_by_value(
+        loc_round, clip_value_min=0, clip_value_max=clip_value_max
+    )
+
+    vol_flat, strides, batch_offset = flatten_volume(
+        vol=vol, dim_vol=dim_vol, has_ch=has_ch, index_rank=len(loc.shape) - 1
+    )
+    # shape = (batch, *loc_shape)
+    index = batch_offset + tf.reduce_sum(
+        tf.cast(loc_clipped, tf.int32) * strides, axis=-1
+    )
+    sampled = tf.gather(vol_flat, index)
+    if not zero_boundary:
+        return sampled
+
+    # shape = (batch, *loc_shape)
+    inside = tf.reduce_all(tf.equal(loc_round, loc_clipped), axis=-1)
+    inside = tf.cast(inside, dtype=vol.dtype)
+    if has_ch:
+        inside = inside[..., None]
+    return sampled * inside
+
+
+def resample_cubic(
+    vol: tf.Tensor, loc: tf.Tensor, dim_vol: int, has_ch: bool, zero_boundary: bool
+) -> tf.Tensor:
+    r"""
+    Sample the volume at given locations using cubic B-spline interpolation.
+
+    The volume is first converted into B-spline coefficients with mirror boundary,
+    such that the interpolation passes through the voxel values,
+    then each value is a weighted sum of 4 ** n coefficients.
+
+    :param vol: shape = (batch, \*vol_shape) or (batch, \*vol_shape, ch)
+    :param loc: shape = (batch, \*loc_shape, n)
+    :param dim_vol: dimension of vol, n
+    :param has_ch: if vol has a feature channel
+    :param zero_boundary: if true, values outside the volume will be zeros,
+        otherwise locations are mirrored at the boundary,
+        as scipy map_coordinates with mode mirror.
+    :return: shape = (batch, \*loc_shape) or (batch, \*loc_shape, ch)
+    """
+    vol_shape = vol.shape[1 : dim_vol + 1]
+
+    # prefilter the volume along each axis to get the B-spline coefficients
+    # the coefficients and weights have the same dtype as loc, e.g. float32
+    coeff = tf.cast(vol, dtype=loc.dtype)
+    for d in range(dim_vol):
+        coeff = get_bspline_coefficients(coeff, axis=d + 1)
+
+    clip_value_max = tf.cast(vol_shape, dtype=loc.dtype) - 1  # (n,)
+    if zero_boundary:
+        loc_clipped = loc
+    else:
+        # mirror the locations, the period is 2 * (v_dim - 1)
+        period = tf.maximum(2 * clip_value_max, 1)
+        loc_clipped = tf.math.floormod(tf.abs(loc), period)
+        loc_clipped = clip_value_max - tf.abs(clip_value_max - loc_clipped)
+    loc_clipped = tf.clip_by_value(
+        loc_clipped, clip_value_min=0, clip_value_max=clip_value_max
+    )
+    loc_floor = tf.math.floor(loc_clipped)
+    t = loc_clipped - loc_floor  # shape = (batch, *loc_shape, n)
+
+    # weights of the 4 neighbours floor-1, floor, floor+1, floor+2
+    # each has shape = (batch, *loc_shape, n)
+    weights = [
+        (1 - t) ** 3 / 6,
+        (3 * t ** 3 - 6 * t ** 2 + 4) / 6,
+        (-3 * t ** 3 + 3 * t ** 2 + 3 * t + 1) / 6,
+        t ** 3 / 6,
+    ]
+
+    # linear indices of the 4 neighbours, mirrored at the boundary
+    vol_flat, strides, batch_offset = flatten_volume(
+        vol=coeff, dim_vol=dim_vol, has_ch=has_ch, index_rank=len(loc.shape) - 1
+    )
+    index_max = tf.cast(vol_shape, dtype=tf.int32) - 1  # (n,)
+    indices = []
+    for k in range(4):
+        index = tf.cast(loc_floor, tf.int32) + (k - 1)
+        index = index_max - tf.abs(index_max - tf.abs(index))
+        index = tf.clip_by_value(index, clip_value_min=0, clip_value_max=index_max)
+        indices.append(index * strides)  # shape = (batch, *loc_shape, n)
+
+    # weighted sum over the 4 ** n neighbours
+    sampled = None
+    for ks in itertools.product(range(4), repeat=dim_vol):
+        index = batch_offset + tf.add_n([indices[k][..., d] for d, k in enumerate(ks)])
+        weight = weights[ks[0]][..., 0]
+        for d in range(1, dim_vol):
+            weight = weight * weights[ks[d]][..., d]
+        if has_ch:
+            weight = weight[..., None]
+        value = tf.gather(vol_flat, index) * weight
+        sampled = value if sampled is None else sampled + value
+    sampled = tf.cast(sampled, dtype=vol.dtype)
+
+    if not zero_boundary:
+        return sampled
+    inside = tf.reduce_all(tf.equal(loc, loc_clipped), axis=-1)
+    inside = tf.cast(inside, dtype=vol.dtype)
+    if has_ch:
+        inside = inside[..., None]
+    return sampled * inside
+
+
 def resample(
     vol: tf.Tensor,
     loc: tf.Tensor,
@@ -247,24 +433,23 @@ def resample(
       1. they dont have batch size
       2. they support more dimensions in vol
 
-      TODO try not using stack as neuron claims it's slower
-
     :param vol: shape = (batch, \*vol_shape) or (batch, \*vol_shape, ch)
       with the last channel for features
     :param loc: shape = (batch, \*loc_shape, n)
       such that loc[b, l1, ..., lm, :] = [v1, ..., vn] is of shape (n,),
       which represents a point in vol, with coordinates (v1, ..., vn)
-    :param interpolation: linear only, TODO support nearest
+    :param interpolation: linear, nearest or cubic (B-spline)
     :param zero_boundary: if true, values on or outside boundary will be zeros
     :return: shape = (batch, \*loc_shape) or (batch, \*loc_shape, ch)
     """
 
-    if interpolation != "linear":
-        raise ValueError("resample supports only linear interpolation")
+    if interpolation not in ["linear", "nearest", "cubic"]:
+        raise ValueError(
+            "resample supports only linear, nearest or cubic interpolation, "
+            f"got {interpolation}"
+        )
 
     # init
-    batch_size = vol.shape[0]
-    loc_shape = loc.shape[1:-1]
     dim_vol = loc.shape[-1]  # dimension of vol, n
     if dim_vol == len(vol.shape) - 1:
         # vol.shape = (batch, *vol_shape)
@@ -277,75 +462,80 @@ def resample(
             "vol shape inconsistent with loc "
             "vol.shape = {}, loc.shape = {}".format(vol.shape, loc.shape)
         )
+    if interpolation == "nearest":
+        return resample_nearest(
+            vol=vol,
+            loc=loc,
+            dim_vol=dim_vol,
+            has_ch=has_ch,
+            zero_boundary=zero_boundary,
+        )
+    if interpolation == "cubic":
+        return resample_cubic(
+            vol=vol,
+            loc=loc,
+            dim_vol=dim_vol,
+            has_ch=has_ch,
+            zero_boundary=zero_boundary,
+        )
     vol_shape = vol.shape[1 : dim_vol + 1]
 
-    # get floor/ceil for loc and stack, then clip together
+    # get floor/ceil for loc and clip them
     # loc, loc_floor, loc_ceil are have shape (batch, *loc_shape, n)
     loc_ceil = tf.math.ceil(loc)
     loc_floor = loc_ceil - 1
-    # (batch, *loc_shape, n, 3)
-    clipped = tf.stack([loc, loc_floor, loc_ceil], axis=-1)
-    clip_value_max = tf.cast(vol_shape, dtype=clipped.dtype) - 1  # (n,)
-    clipped_shape = [1] * (len(loc_shape) + 1) + [dim_vol, 1]
-    clip_value_max = tf.reshape(clip_value_max, shape=clipped_shape)
-    clipped = tf.clip_by_value(clipped, clip_value_min=0, clip_value_max=clip_value_max)
-
-    # loc_floor_ceil has n sublists
-    # each one corresponds to the floor and ceil coordinates for d-th dimension
-    # each tensor is of shape (batch, *loc_shape), dtype int32
-
-    # weight_floor has n tensors
-    # each tensor is the weight for the corner of floor coordinates
-    # each tensor's shape is (batch, *loc_shape) if volume has no feature channel
-    #                        (batch, *loc_shape, 1) if volume has feature channel
-    loc_floor_ceil, weight_floor, weight_ceil = [], [], []
-    # using for loop is faster than using list comprehension
-    for dim in range(dim_vol):
-        # shape = (batch, *loc_shape)
-        c_clipped = clipped[..., dim, 0]
-        c_floor = clipped[..., dim, 1]
-        c_ceil = clipped[..., dim, 2]
-        w_floor = c_ceil - c_clipped  # shape = (batch, *loc_shape)
-        w_ceil = c_clipped - c_floor if zero_boundary else 1 - w_floor
-        if has_ch:
-            w_floor = tf.expand_dims(w_floor, -1)  # shape = (batch, *loc_shape, 1)
-            w_ceil = tf.expand_dims(w_ceil, -1)  # shape = (batch, *loc_shape, 1)
-
-        loc_floor_ceil.append([tf.cast(c_floor, tf.int32), tf.cast(c_ceil, tf.int32)])
-        weight_floor.append(w_floor)
-        weight_ceil.append(w_ceil)
-
-    # 2**n corners, each is a list of n binary values
-    corner_indices = get_n_bits_combinations(num_bits=len(vol_shape))
-
-    # batch_coords[b, l1, ..., lm] = b
-    # range(batch_size) on axis 0 and repeated on other axes
-    # add batch coords manually is faster than using batch_dims in tf.gather_nd
-    batch_coords = tf.tile(
-        tf.reshape(tf.range(batch_size), [batch_size] + [1] * len(loc_shape)),
-        [1] + loc_shape,
-    )  # shape = (batch, *loc_shape)
+    clip_value_max = tf.cast(vol_shape, dtype=loc.dtype) - 1  # (n,)
+    loc = tf.clip_by_value(loc, clip_value_min=0, clip_value_max=clip_value_max)
+    loc_floor = tf.clip_by_value(
+        loc_floor, clip_value_min=0, clip_value_max=clip_value_max
+    )
+    loc_ceil = tf.clip_by_value(
+        loc_ceil, clip_value_min=0, clip_value_max=clip_value_max
+    )
 
-    # get vol values on n-dim hypercube corners
-    # corner_values has 2 ** n elements
-    # each of shape (batch, *loc_shape) or (batch, *loc_shape, ch)
-    corner_values = [
-        tf.gather_nd(
-            vol,  # shape = (batch, *vol_shape) or (batch, *vol_shape, ch)
-            tf.stack(
-                [batch_coords]
-                + [loc_floor_ceil[axis][fc_idx] for axis, fc_idx in enumerate(c)],
-                axis=-1,
-            ),  # shape = (batch, *loc_shape, n+1) after stack
+    # weights of floor/ceil points for each dimension
+    # the weights are calculated with the dtype of loc, e.g. float32,
+    # shape = (batch, *loc_shape, n)
+    weight_floor = loc_ceil - loc
+    weight_ceil = loc - loc_floor if zero_boundary else 1 - weight_floor
+
+    # the volume is flattened so that all corners are gathered at once
+    # using linear indices, strides[d] is the stride of d-th dimension
+    # index is the first element of each sample, shape = (batch, 1, ..., 1, 1)
+    vol_flat, strides, index = flatten_volume(
+        vol=vol, dim_vol=dim_vol, has_ch=has_ch, index_rank=len(loc.shape)
+    )
+    index_floor = tf.cast(loc_floor, tf.int32) * strides  # (batch, *loc_shape, n)
+    index_ceil = tf.cast(loc_ceil, tf.int32) * strides  # (batch, *loc_shape, n)
+    weight = tf.ones_like(index, dtype=loc.dtype)
+
+    # accumulate the linear indices and weights of the 2**n corners
+    # after d-th iteration, index and weight have shape (batch, *loc_shape, 2**d)
+    # the order of corners is consistent with get_n_bits_combinations
+    for d in range(dim_vol):
+        index = tf.concat(
+            [index + index_floor[..., d : d + 1], index + index_ceil[..., d : d + 1]],
+            axis=-1,
+        )
+        weight = tf.concat(
+            [
+                weight * weight_floor[..., d : d + 1],
+                weight * weight_ceil[..., d : d + 1],
+            ],
+            axis=-1,
         )
-        for c in corner_indices  # c is list of len n
-    ]  # each tensor has shape (batch, *loc_shape) or (batch, *loc_shape, ch)
 
-    # resample
-    sampled = pyramid_combination(
-        values=corner_values, weight_floor=weight_floor, weight_ceil=weight_ceil
-    )
-    return sampled
+    # get vol values on n-dim hypercube corners
+    # shape = (batch, *loc_shape, 2**n) or (batch, *loc_shape, 2**n, ch)
+    corner_values = tf.gather(vol_flat, index)
+
+    # resample, the weighted sum over corners
+    # is calculated with the dtype of vol, e.g. float16 to save memory
+    weight = tf.cast(weight, dtype=vol.dtype)
+    if has_ch:
+        weight = weight[..., None]  # shape = (batch, *loc_shape, 2**n, 1)
+        return tf.reduce_sum(corner_values * weight, axis=-2)
+    return tf.reduce_sum(corner_values * weight, axis=-1)
 
 
 def warp_grid(grid: tf.Tensor, theta: tf.Tensor) -> tf.Tensor:
@@ -1,15 +1,20 @@
 import logging
 import os
 from abc import abstractmethod
+from contextlib import contextmanager
 from copy import deepcopy
-from typing import Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import tensorflow as tf
 
+import deepreg.config.parser as config_parser
 from deepreg.model import layer
 from deepreg.model.backbone import GlobalNet
 from deepreg.registry import REGISTRY
 
+# number of indices of a sample per dataset type, including the label index
+NUM_INDICES = dict(paired=2, unpaired=3, grouped=5)
+
 
 def dict_without(d: dict, key) -> dict:
     """
@@ -24,6 +29,35 @@ def dict_without(d: dict, key) -> dict:
     return copied
 
 
+@contextmanager
+def dtype_policy_scope(policy: Optional[str]):
+    """
+    Context manager setting the global Keras dtype policy.
+
+    Layers created inside the context use the given policy,
+    e.g. with mixed_float16 they compute in float16
+    while their variables are stored in float32.
+
+    :param policy: name of the policy, if None, the global policy is not changed.
+    """
+    if policy is None:
+        yield
+        return
+    if hasattr(tf.keras.mixed_precision, "set_global_policy"):
+        get_policy = tf.keras.mixed_precision.global_policy
+        set_policy = tf.keras.mixed_precision.set_global_policy
+    else:  # pragma: no cover
+        # tensorflow < 2.4
+        get_policy = tf.keras.mixed_precision.experimental.global_policy
+        set_policy = tf.keras.mixed_precision.experimental.set_policy
+    previous_policy = get_policy()
+    set_policy(policy)
+    try:
+        yield
+    finally:
+        set_policy(previous_policy)
+
+
 class RegistrationModel(tf.keras.Model):
     """Interface for registration model."""
 
@@ -46,7 +80,11 @@ class RegistrationModel(tf.keras.Model):
         :param index_size: number of indices for identify each sample
         :param labeled: if the data is labeled
         :param batch_size: size of mini-batch
-        :param config: config for method, backbone, and loss.
+        :param config: config for method, backbone, and loss,
+            the optional key mixed_precision, float16 or bfloat16,
+            defines the dtype used for computation in the backbone,
+            the optional keys image_interpolation and label_interpolation,
+            linear by default, define how the moving image and label are warped.
         :param num_devices: number of GPU used,
             global_batch_size = batch_size*num_devices
         :param name: name of the model
@@ -61,6 +99,16 @@ class RegistrationModel(tf.keras.Model):
         self.num_devices = num_devices
         self.global_batch_size = num_devices * batch_size
 
+        mixed_precision = config.get("mixed_precision", None)
+        if mixed_precision not in [None, "float16", "bfloat16"]:
+            raise ValueError(
+                "mixed_precision must be float16 or bfloat16 if defined, "
+                f"got {mixed_precision}"
+            )
+        self.backbone_policy = (
+            None if mixed_precision is None else f"mixed_{mixed_precision}"
+        )
+
         self._inputs = None  # save inputs of self._model as dict
         self._outputs = None  # save outputs of self._model as dict
 
@@ -134,6 +182,31 @@ class RegistrationModel(tf.keras.Model):
             indices=indices,
         )
 
+    def build_backbone(
+        self, inputs: tf.Tensor, default_args: dict
+    ) -> Tuple[tf.keras.Model, Any]:
+        """
+        Build the backbone from config and call it on inputs.
+
+        With mixed precision, the backbone computes in float16 or bfloat16,
+        its outputs are cast to float32 so that the warping and losses,
+        which are numerically sensitive, are computed in float32.
+
+        :param inputs: inputs of the backbone.
+        :param default_args: default arguments for building the backbone.
+        :return: tuple, the backbone and its outputs.
+        """
+        with dtype_policy_scope(policy=self.backbone_policy):
+            backbone = REGISTRY.build_backbone(
+                config=self.config["backbone"], default_args=default_args
+            )
+            outputs = backbone(inputs=inputs)
+        if self.backbone_policy is not None:
+            outputs = tf.nest.map_structure(
+                lambda x: tf.cast(x, dtype=tf.float32), outputs
+            )
+        return backbone, outputs
+
     def concat_images(
         self,
         moving_image: tf.Tensor,
@@ -246,6 +319,40 @@ class RegistrationModel(tf.keras.Model):
         """
         return self._model(inputs, training=training, mask=mask)  # pragma: no cover
 
+    def build_warping(self) -> Tuple[layer.Warping, layer.Warping]:
+        """
+        Build the layers warping the moving image and label with the ddf.
+
+        Nearest or cubic interpolation are meant for inference,
+        the same layer is returned twice if the interpolations are equal.
+
+        :return: (image_warping, label_warping)
+        """
+        image_interpolation = self.config.get("image_interpolation", "linear")
+        label_interpolation = self.config.get("label_interpolation", "linear")
+        image_warping = layer.Warping(
+            fixed_image_size=self.fixed_image_size, interpolation=image_interpolation
+        )
+        if label_interpolation == image_interpolation:
+            return image_warping, image_warping
+        label_warping = layer.Warping(
+            fixed_image_size=self.fixed_image_size,
+            interpolation=label_interpolation,
+            name="label_warping",
+        )
+        return image_warping, label_warping
+
+    def get_inference_model(self) -> tf.keras.Model:
+        """
+        Return a model sharing the layers of self._model without losses and metrics.
+
+        The returned model does not update the metrics when called,
+        which is required to export the model for inference.
+
+        :return: model with the same inputs and outputs as self._model
+        """
+        return tf.keras.Model(inputs=self._inputs, outputs=self._outputs)
+
     @abstractmethod
     def postprocess(
         self,
@@ -304,6 +411,12 @@ class DDFModel(RegistrationModel):
         resize = layer.ResizeCPTransform(control_points)
         field = resize(field)
 
+        # the control points can be regularized in closed form
+        if isinstance(control_points, int):
+            control_points = [control_points] * 3
+        self._cp_spacing = tuple(control_points)
+        self._control_points = field
+
         interpolate = layer.BSplines3DTransform(control_points, self.fixed_image_size)
         field = interpolate(field)
 
@@ -318,9 +431,11 @@ class DDFModel(RegistrationModel):
 
         # build ddf
         control_points = self.config["backbone"].pop("control_points", False)
+        self._control_points = None
+        self._cp_spacing = None
         backbone_inputs = self.concat_images(moving_image, fixed_image)
-        backbone = REGISTRY.build_backbone(
-            config=self.config["backbone"],
+        backbone, backbone_outputs = self.build_backbone(
+            inputs=backbone_inputs,
             default_args=dict(
                 image_size=self.fixed_image_size,
                 out_channels=3,
@@ -331,20 +446,20 @@ class DDFModel(RegistrationModel):
 
         if isinstance(backbone, GlobalNet):
             # (f_dim1, f_dim2, f_dim3, 3), (4, 3)
-            ddf, theta = backbone(inputs=backbone_inputs)
+            ddf, theta = backbone_outputs
             self._outputs = dict(ddf=ddf, theta=theta)
         else:
             # (f_dim1, f_dim2, f_dim3, 3)
-            ddf = backbone(inputs=backbone_inputs)
+            ddf = backbone_outputs
             ddf = (
                 self._resize_interpolate(ddf, control_points) if control_points else ddf
             )
             self._outputs = dict(ddf=ddf)
 
         # build outputs
-        warping = layer.Warping(fixed_image_size=self.fixed_image_size)
+        image_warping, label_warping = self.build_warping()
         # (f_dim1, f_dim2, f_dim3, 3)
-        pred_fixed_image = warping(inputs=[ddf, moving_image])
+        pred_fixed_image = image_warping(inputs=[ddf, moving_image])
         self._outputs["pred_fixed_image"] = pred_fixed_image
 
         if not self.labeled:
@@ -352,7 +467,7 @@ class DDFModel(RegistrationModel):
 
         # (f_dim1, f_dim2, f_dim3, 3)
         moving_label = self._inputs["moving_label"]
-        pred_fixed_label = warping(inputs=[ddf, moving_label])
+        pred_fixed_label = label_warping(inputs=[ddf, moving_label])
 
         self._outputs["pred_fixed_label"] = pred_fixed_label
         return tf.keras.Model(inputs=self._inputs, outputs=self._outputs)
@@ -363,8 +478,13 @@ class DDFModel(RegistrationModel):
         ddf = self._outputs["ddf"]
         pred_fixed_image = self._outputs["pred_fixed_image"]
 
-        # ddf
-        self._build_loss(name="regularization", inputs_dict=dict(inputs=ddf))
+        # ddf, with the B-spline control points if defined
+        inputs_dict = dict(inputs=ddf)
+        if self._control_points is not None:
+            inputs_dict.update(
+                control_points=self._control_points, cp_spacing=self._cp_spacing
+            )
+        self._build_loss(name="regularization", inputs_dict=inputs_dict)
 
         # image
         self._build_loss(
@@ -439,11 +559,13 @@ class DVFModel(DDFModel):
         moving_image = self._inputs["moving_image"]
         fixed_image = self._inputs["fixed_image"]
         control_points = self.config["backbone"].pop("control_points", False)
+        self._control_points = None
+        self._cp_spacing = None
 
         # build ddf
         backbone_inputs = self.concat_images(moving_image, fixed_image)
-        backbone = REGISTRY.build_backbone(
-            config=self.config["backbone"],
+        _, dvf = self.build_backbone(
+            inputs=backbone_inputs,
             default_args=dict(
                 image_size=self.fixed_image_size,
                 out_channels=3,
@@ -451,14 +573,16 @@ class DVFModel(DDFModel):
                 out_activation=None,
             ),
         )
-        dvf = backbone(inputs=backbone_inputs)
         dvf = self._resize_interpolate(dvf, control_points) if control_points else dvf
-        ddf = layer.IntDVF(fixed_image_size=self.fixed_image_size)(dvf)
+        ddf = layer.IntDVF(
+            fixed_image_size=self.fixed_image_size,
+            **self.config.get("integration", {}),
+        )(dvf)
 
         # build outputs
-        warping = layer.Warping(fixed_image_size=self.fixed_image_size)
+        image_warping, label_warping = self.build_warping()
         # (f_dim1, f_dim2, f_dim3, 3)
-        pred_fixed_image = warping(inputs=[ddf, moving_image])
+        pred_fixed_image = image_warping(inputs=[ddf, moving_image])
 
         self._outputs = dict(dvf=dvf, ddf=ddf, pred_fixed_image=pred_fixed_image)
 
@@ -467,7 +591,7 @@ class DVFModel(DDFModel):
 
         # (f_dim1, f_dim2, f_dim3, 3)
         moving_label = self._inputs["moving_label"]
-        pred_fixed_label = warping(inputs=[ddf, moving_label])
+        pred_fixed_label = label_warping(inputs=[ddf, moving_label])
 
         self._outputs["pred_fixed_label"] = pred_fixed_label
         return tf.keras.Model(inputs=self._inputs, outputs=self._outputs)
@@ -512,8 +636,9 @@ class ConditionalModel(RegistrationModel):
 
         # build ddf
         backbone_inputs = self.concat_images(moving_image, fixed_image, moving_label)
-        backbone = REGISTRY.build_backbone(
-            config=self.config["backbone"],
+        # (batch, f_dim1, f_dim2, f_dim3)
+        _, pred_fixed_label = self.build_backbone(
+            inputs=backbone_inputs,
             default_args=dict(
                 image_size=self.fixed_image_size,
                 out_channels=1,
@@ -521,8 +646,6 @@ class ConditionalModel(RegistrationModel):
                 out_activation="sigmoid",
             ),
         )
-        # (batch, f_dim1, f_dim2, f_dim3)
-        pred_fixed_label = backbone(inputs=backbone_inputs)
         pred_fixed_label = tf.squeeze(pred_fixed_label, axis=4)
 
         self._outputs = dict(pred_fixed_label=pred_fixed_label)
@@ -563,3 +686,46 @@ class ConditionalModel(RegistrationModel):
         )
 
         return indices, processed
+
+
+def load_config(config_path: Union[str, List[str]], ckpt_path: str) -> Dict:
+    """
+    Load the configuration of the checkpoint.
+
+    :param config_path: path of configuration files, if empty,
+        the config.yaml saved in the log folder of the checkpoint is used.
+    :param ckpt_path: path of the checkpoint, like log_folder/save/ckpt-x
+    :return: configuration dictionary
+    """
+    if config_path == "" or config_path == []:
+        return config_parser.load_configs(
+            "/".join(ckpt_path.split("/")[:-2]) + "/config.yaml"
+        )
+    return config_parser.load_configs(config_path)
+
+
+def build_model_from_config(config: Dict, batch_size: int) -> tf.keras.Model:
+    """
+    Build the registration model without loading any data.
+
+    :param config: configuration with sections dataset and train
+    :param batch_size: batch size of the model inputs
+    :return: the built model
+    """
+    dataset_config = config["dataset"]
+    if "image_shape" in dataset_config:
+        moving_image_size = fixed_image_size = tuple(dataset_config["image_shape"])
+    else:
+        moving_image_size = tuple(dataset_config["moving_image_shape"])
+        fixed_image_size = tuple(dataset_config["fixed_image_shape"])
+    return REGISTRY.build_model(
+        config=dict(
+            name=config["train"]["method"],
+            moving_image_size=moving_image_size,
+            fixed_image_size=fixed_image_size,
+            index_size=NUM_INDICES[dataset_config["type"]],
+            labeled=dataset_config["labeled"],
+            batch_size=batch_size,
+            config=config["train"],
+        )
+    )
@@ -5,15 +5,26 @@ Functions parsing the config optimizer options
 import tensorflow as tf
 
 
-def build_optimizer(optimizer_config: dict) -> tf.optimizers.Optimizer:
+def build_optimizer(
+    optimizer_config: dict, loss_scale: bool = False
+) -> tf.optimizers.Optimizer:
     """
     Parsing the optimiser options and parameters
     from config dictionary.
 
     :param optimizer_config: has key name and other required arguments
+    :param loss_scale: if True, the optimizer is wrapped with dynamic loss scaling,
+        which is required for training with float16 to avoid gradient underflow.
     :return: optimizer instant
     """
 
     optimizer_cls = getattr(tf.keras.optimizers, optimizer_config["name"])
     optimizer = optimizer_cls(**optimizer_config)
-    return optimizer
+    if not loss_scale:
+        return optimizer
+    if hasattr(tf.keras.mixed_precision, "LossScaleOptimizer"):
+        return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    # tensorflow < 2.4
+    return tf.keras.mixed_precision.experimental.LossScaleOptimizer(
+        optimizer, loss_scale="dynamic"
+    )  # pragma: no cover
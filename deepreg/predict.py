@@ -6,10 +6,11 @@ command line interface.
 """
 
 import argparse
+import itertools
 import logging
 import os
 import shutil
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import tensorflow as tf
@@ -17,15 +18,13 @@ import tensorflow as tf
 import deepreg.config.parser as config_parser
 import deepreg.model.layer_util as layer_util
 import deepreg.model.optimizer as opt
-from deepreg.callback import build_checkpoint_callback
+from deepreg.callback import restore_model
+from deepreg.dataset.loader.interface import DataLoader
+from deepreg.dataset.preprocess import resize_inputs
+from deepreg.loss.metric import BatchMetrics
+from deepreg.model.layer import Resize3d
 from deepreg.registry import REGISTRY
-from deepreg.util import (
-    build_dataset,
-    build_log_dir,
-    calculate_metrics,
-    save_array,
-    save_metric_dict,
-)
+from deepreg.util import ArrayWriter, build_dataset, build_log_dir, save_metric_dict
 
 
 def build_pair_output_path(indices: list, save_dir: str) -> Tuple[str, str]:
@@ -53,6 +52,244 @@ def build_pair_output_path(indices: list, save_dir: str) -> Tuple[str, str]:
     return pair_dir, label_dir
 
 
+def get_patch_starts(size: int, patch_size: int, overlap: float) -> List[int]:
+    """
+    Get the start positions of the sliding window along one axis.
+
+    The stride is patch_size * (1 - overlap) and the last patch is aligned
+    with the end of the volume, so that all voxels are covered.
+
+    :param size: size of the volume, not smaller than patch_size
+    :param patch_size: size of the patch
+    :param overlap: fraction of the patch overlapping with the next one, in [0, 1)
+    :return: sorted start positions
+    """
+    if size <= patch_size:
+        return [0]
+    stride = max(int(patch_size * (1 - overlap)), 1)
+    starts = list(range(0, size - patch_size, stride))
+    return starts + [size - patch_size]
+
+
+def get_blending_window(patch_size: Tuple[int, ...], window: str) -> np.ndarray:
+    """
+    Build the weights used to blend the overlapping patches.
+
+    The weights decrease towards the patch borders, where the predictions
+    are less reliable, and are strictly positive so that all voxels are covered.
+
+    :param patch_size: (dim1, dim2, dim3)
+    :param window: gaussian, with sigma = patch_size / 8, or cosine (Hann window)
+    :return: shape = (dim1, dim2, dim3)
+    """
+    weights = []
+    for size in patch_size:
+        coord = np.arange(size, dtype=np.float32) + 0.5
+        if window == "gaussian":
+            sigma = size / 8
+            weight = np.exp(-((coord - size / 2) ** 2) / (2 * sigma ** 2))
+        elif window == "cosine":
+            weight = np.sin(np.pi * coord / size) ** 2
+        else:
+            raise ValueError(
+                f"Unknown blending window {window}, should be gaussian or cosine."
+            )
+        weights.append(np.maximum(weight / np.max(weight), 1e-3))
+    return np.einsum("i,j,k->ijk", *weights)
+
+
+def predict_sliding_window(
+    model: tf.keras.Model,
+    inputs: Dict[str, tf.Tensor],
+    fixed_grid_ref: tf.Tensor,
+    patch_overlap: float = 0.25,
+    blending: str = "gaussian",
+    image_interpolation: str = "linear",
+    label_interpolation: str = "linear",
+) -> Dict[str, tf.Tensor]:
+    """
+    Predict the ddf of a volume pair larger than the model input patch by patch.
+
+    The moving and fixed volumes are tiled into overlapping patches of the model
+    input size, the patches are predicted in batches of the model batch size
+    and the predicted ddf (and dvf) are blended into the full volume.
+    The full resolution moving image and label are then warped once.
+
+    :param model: registration model predicting a ddf,
+        moving and fixed image sizes must be equal.
+    :param inputs: a batch of one sample, the moving and fixed tensors
+        have the same shape = (1, dim1, dim2, dim3)
+    :param fixed_grid_ref: shape = (1, dim1, dim2, dim3, 3)
+    :param patch_overlap: fraction of a patch overlapping with its neighbours,
+        in [0, 1).
+    :param blending: gaussian or cosine, the window weighting the patches.
+    :param image_interpolation: linear, nearest or cubic,
+        interpolation used to warp the moving image.
+    :param label_interpolation: linear, nearest or cubic,
+        interpolation used to warp the moving label.
+    :return: outputs as the ones of model.predict, at full resolution,
+        theta is not returned as it is defined per patch.
+    """
+    patch_size = tuple(model.fixed_image_size)
+    if tuple(model.moving_image_size) != patch_size:
+        raise ValueError(
+            "Sliding window inference requires equal moving and fixed image sizes, "
+            f"got {model.moving_image_size} and {model.fixed_image_size}."
+        )
+    if not 0 <= patch_overlap < 1:
+        raise ValueError(f"patch_overlap must be in [0, 1), got {patch_overlap}.")
+    volume_shape = tuple(inputs["fixed_image"].shape[1:4])
+    if tuple(inputs["moving_image"].shape[1:4]) != volume_shape:
+        raise ValueError(
+            "Sliding window inference requires moving and fixed volumes "
+            f"of the same shape, got {tuple(inputs['moving_image'].shape[1:4])} "
+            f"and {volume_shape}."
+        )
+    if inputs["fixed_image"].shape[0] != 1:
+        raise ValueError("Sliding window inference requires a batch of one sample.")
+
+    # pad the volumes smaller than the patch
+    padded_shape = tuple(max(x, y) for x, y in zip(volume_shape, patch_size))
+    paddings = [(0, 0)] + [(0, x - y) for x, y in zip(padded_shape, volume_shape)]
+    volumes = {
+        k: np.pad(np.asarray(v), paddings) for k, v in inputs.items() if k != "indices"
+    }
+    indices = np.asarray(inputs["indices"])
+
+    window = get_blending_window(patch_size=patch_size, window=blending)
+    weight_sum = np.zeros(padded_shape, dtype=np.float32)
+    field_sums: Dict[str, np.ndarray] = {}
+    starts = list(
+        itertools.product(
+            *[
+                get_patch_starts(size=x, patch_size=y, overlap=patch_overlap)
+                for x, y in zip(padded_shape, patch_size)
+            ]
+        )
+    )
+    # the model has a static batch size
+    batch_size = model.batch_size
+    for batch_start in range(0, len(starts), batch_size):
+        batch_starts = starts[batch_start : batch_start + batch_size]
+        slices = [
+            tuple(slice(s, s + p) for s, p in zip(start, patch_size))
+            for start in batch_starts
+        ]
+        # fill the last batch with empty patches
+        batch_paddings = [(0, batch_size - len(slices))] + [(0, 0)] * 3
+        patches = {
+            k: np.pad(np.stack([v[0][x] for x in slices]), batch_paddings)
+            for k, v in volumes.items()
+        }
+        patches["indices"] = np.repeat(indices, batch_size, axis=0)
+        outputs = model(
+            {k: tf.convert_to_tensor(v, dtype=tf.float32) for k, v in patches.items()},
+            training=False,
+        )
+        if "ddf" not in outputs:
+            raise ValueError(
+                "Sliding window inference requires a model predicting ddf."
+            )
+        for name in ["ddf", "dvf"]:
+            if name not in outputs:
+                continue
+            if name not in field_sums:
+                field_sums[name] = np.zeros(padded_shape + (3,), dtype=np.float32)
+            field = outputs[name].numpy()
+            for i, x in enumerate(slices):
+                field_sums[name][x] += field[i] * window[..., None]
+        for x in slices:
+            weight_sum[x] += window
+
+    # normalise the blended fields and crop the padding
+    crop = tuple(slice(0, x) for x in volume_shape)
+    blended = {
+        k: tf.convert_to_tensor((v / weight_sum[..., None])[crop][None, ...])
+        for k, v in field_sums.items()
+    }
+
+    # warp the full resolution volumes once
+    blended["pred_fixed_image"] = layer_util.resample(
+        vol=inputs["moving_image"],
+        loc=fixed_grid_ref + blended["ddf"],
+        interpolation=image_interpolation,
+    )
+    if "moving_label" in inputs:
+        blended["pred_fixed_label"] = layer_util.resample(
+            vol=inputs["moving_label"],
+            loc=fixed_grid_ref + blended["ddf"],
+            interpolation=label_interpolation,
+        )
+    return blended
+
+
+def predict_native_resolution(
+    model: tf.keras.Model,
+    inputs: Dict[str, tf.Tensor],
+    fixed_grid_ref: tf.Tensor,
+    image_interpolation: str = "linear",
+    label_interpolation: str = "linear",
+) -> Dict[str, tf.Tensor]:
+    """
+    Predict the ddf at the model input size and upsample it to the original shape.
+
+    The volumes are resized to the model input sizes as for training,
+    the predicted ddf (and dvf) are resized to the original fixed shape
+    and the displacements are scaled per axis, accounting for the different
+    resize ratios of the moving and fixed volumes, so that the original
+    moving image and label are warped at their original resolution.
+
+    :param model: registration model predicting a ddf.
+    :param inputs: a batch of samples with volumes of the same original shapes,
+        moving tensors of shape = (batch, m_dim1, m_dim2, m_dim3)
+        and fixed tensors of shape = (batch, f_dim1, f_dim2, f_dim3)
+    :param fixed_grid_ref: shape = (1, f_dim1, f_dim2, f_dim3, 3)
+    :param image_interpolation: linear, nearest or cubic,
+        interpolation used to warp the moving image.
+    :param label_interpolation: linear, nearest or cubic,
+        interpolation used to warp the moving label.
+    :return: outputs as the ones of model.predict, at the original fixed shape,
+        theta is not returned as it is defined at the model input size.
+    """
+    moving_shape = tuple(inputs["moving_image"].shape[1:4])
+    fixed_shape = tuple(inputs["fixed_image"].shape[1:4])
+    resized = resize_inputs(
+        inputs=inputs,
+        moving_image_size=tuple(model.moving_image_size),
+        fixed_image_size=tuple(model.fixed_image_size),
+    )
+    outputs = model(resized, training=False)
+    if "ddf" not in outputs:
+        raise ValueError("Native resolution inference requires a model predicting ddf.")
+
+    # voxel sizes of the resized volumes in original voxels
+    moving_scale = np.asarray(moving_shape) / np.asarray(model.moving_image_size)
+    fixed_scale = np.asarray(fixed_shape) / np.asarray(model.fixed_image_size)
+    # the voxel centers are aligned as in resize, x = (x' + 0.5) * scale - 0.5
+    offset = (moving_scale / fixed_scale - 1) * (fixed_grid_ref + 0.5)
+    resize = Resize3d(shape=fixed_shape)
+    upsampled = {
+        name: resize(outputs[name]) * moving_scale.astype(np.float32)
+        for name in ["ddf", "dvf"]
+        if name in outputs
+    }
+    upsampled["ddf"] = tf.cast(offset, dtype=tf.float32) + upsampled["ddf"]
+
+    # warp the original volumes
+    upsampled["pred_fixed_image"] = layer_util.resample(
+        vol=inputs["moving_image"],
+        loc=fixed_grid_ref + upsampled["ddf"],
+        interpolation=image_interpolation,
+    )
+    if "moving_label" in inputs:
+        upsampled["pred_fixed_label"] = layer_util.resample(
+            vol=inputs["moving_label"],
+            loc=fixed_grid_ref + upsampled["ddf"],
+            interpolation=label_interpolation,
+        )
+    return upsampled
+
+
 def predict_on_dataset(
     dataset: tf.data.Dataset,
     fixed_grid_ref: tf.Tensor,
@@ -61,6 +298,20 @@ def predict_on_dataset(
     save_dir: str,
     save_nifti: bool,
     save_png: bool,
+    png_layout: str = "slices",
+    image_interpolation: str = "linear",
+    label_interpolation: str = "linear",
+    metrics: Optional[List[Union[str, dict]]] = None,
+    num_writers: int = 4,
+    writer_queue_size: Optional[int] = None,
+    writer_processes: bool = False,
+    volume_format: str = "nii.gz",
+    compression_level: Optional[int] = None,
+    data_loader: Optional[DataLoader] = None,
+    sliding_window: bool = False,
+    patch_overlap: float = 0.25,
+    blending: str = "gaussian",
+    native_resolution: bool = False,
 ):
     """
     Function to predict results from a dataset from some model
@@ -72,76 +323,171 @@ def predict_on_dataset(
     :param save_dir: path to store dir
     :param save_nifti: if true, outputs will be saved in nifti format
     :param save_png: if true, outputs will be saved in png format
+    :param png_layout: slices, montage or stack, the layout of png outputs,
+        one file per slice, one tiled png file or one multi-page tiff file per tensor.
+    :param image_interpolation: linear, nearest or cubic,
+        interpolation used to warp moving images with the predicted ddf
+        in sliding window or native resolution inference, otherwise
+        the model warps them with the interpolation it is built with.
+    :param label_interpolation: linear, nearest or cubic,
+        interpolation used to warp moving labels, as image_interpolation.
+    :param metrics: names or configs of registered metrics to calculate,
+        default to image_ssd, label_binary_dice and label_tre.
+    :param num_writers: number of background workers saving the outputs,
+        outputs are saved synchronously if 0.
+    :param writer_queue_size: maximum number of outputs waiting to be saved,
+        default to twice the number of writers.
+    :param writer_processes: if true, outputs are saved by processes instead of threads.
+    :param volume_format: nii.gz, nii or h5, the format of the saved volumes.
+    :param compression_level: level of the gzip compression of the saved volumes,
+        default compression if None.
+    :param data_loader: data loader of the dataset, used to save the outputs
+        with the affines of the images, identity affines are used if None.
+    :param sliding_window: if true, the volumes are not resized but predicted
+        patch by patch of the model input size, the dataset must have batches
+        of one sample and fixed_grid_ref is built per sample.
+    :param patch_overlap: fraction of a patch overlapping with its neighbours
+        for sliding window inference.
+    :param blending: gaussian or cosine, the window blending the patches
+        for sliding window inference.
+    :param native_resolution: if true, the volumes are not resized but the ddf
+        predicted at the model input size is upsampled to the original shape,
+        the dataset must have volumes of the same shape per batch
+        and fixed_grid_ref is built per batch.
     """
+    if sliding_window and native_resolution:
+        raise ValueError(
+            "sliding_window and native_resolution can not be used together."
+        )
+
     # remove the save_dir in case it exists
     if os.path.exists(save_dir):
         shutil.rmtree(save_dir)  # pragma: no cover
 
+    # metric objects are built once and evaluated per batch
+    batch_metrics = BatchMetrics(metrics=metrics)
     sample_index_strs = []
     metric_lists = []
-    for _, inputs in enumerate(dataset):
-        batch_size = inputs[list(inputs.keys())[0]].shape[0]
-        outputs = model.predict(x=inputs, batch_size=batch_size)
-        indices, processed = model.postprocess(inputs=inputs, outputs=outputs)
-
-        # convert to np arrays
-        indices = indices.numpy()
-        processed = {
-            k: (v[0].numpy() if isinstance(v[0], tf.Tensor) else v[0], v[1], v[2])
-            for k, v in processed.items()
-        }
-
-        # save images of inputs and outputs
-        for sample_index in range(batch_size):
-            # save label independent tensors under pair_dir, otherwise under label_dir
+    with ArrayWriter(
+        num_workers=num_writers,
+        max_pending=writer_queue_size,
+        use_processes=writer_processes,
+    ) as writer:
+        for _, inputs in enumerate(dataset):
+            batch_size = inputs[list(inputs.keys())[0]].shape[0]
+            if sliding_window or native_resolution:
+                # volumes are of their original shapes
+                fixed_grid_ref = tf.expand_dims(
+                    layer_util.get_reference_grid(
+                        grid_size=inputs["fixed_image"].shape[1:4]
+                    ),
+                    axis=0,
+                )
+            if native_resolution:
+                outputs = predict_native_resolution(
+                    model=model,
+                    inputs=inputs,
+                    fixed_grid_ref=fixed_grid_ref,
+                    image_interpolation=image_interpolation,
+                    label_interpolation=label_interpolation,
+                )
+            elif sliding_window:
+                outputs = predict_sliding_window(
+                    model=model,
+                    inputs=inputs,
+                    fixed_grid_ref=fixed_grid_ref,
+                    patch_overlap=patch_overlap,
+                    blending=blending,
+                    image_interpolation=image_interpolation,
+                    label_interpolation=label_interpolation,
+                )
+            else:
+                outputs = model.predict(x=inputs, batch_size=batch_size)
+            indices, processed = model.postprocess(inputs=inputs, outputs=outputs)
 
-            # init output path
-            indices_i = indices[sample_index, :].astype(int).tolist()
-            pair_dir, label_dir = build_pair_output_path(
-                indices=indices_i, save_dir=save_dir
+            # calculate metrics of all samples at once
+            batch_metric = batch_metrics(
+                fixed_grid_ref=fixed_grid_ref,
+                **{
+                    name: processed[name][0]
+                    for name in [
+                        "fixed_image",
+                        "pred_fixed_image",
+                        "fixed_label",
+                        "pred_fixed_label",
+                        "ddf",
+                    ]
+                    if name in processed
+                },
             )
 
-            for name, (arr, normalize, on_label) in processed.items():
-                if name == "theta":
-                    np.savetxt(
-                        fname=os.path.join(pair_dir, "affine.txt"),
-                        X=arr[sample_index, :, :],
-                        delimiter=",",
-                    )
-                    continue
-
-                arr_save_dir = label_dir if on_label else pair_dir
-                save_array(
-                    save_dir=arr_save_dir,
-                    arr=arr[sample_index, :, :, :],
-                    name=name,
-                    normalize=normalize,  # label's value is already in [0, 1]
-                    save_nifti=save_nifti,
-                    save_png=save_png,
-                    overwrite=arr_save_dir == label_dir,
+            # convert to np arrays
+            indices = indices.numpy()
+            processed = {
+                k: (v[0].numpy() if isinstance(v[0], tf.Tensor) else v[0], v[1], v[2])
+                for k, v in processed.items()
+            }
+
+            # save images of inputs and outputs
+            for sample_index in range(batch_size):
+                # save label independent tensors under pair_dir, otherwise under label_dir
+
+                # init output path
+                indices_i = indices[sample_index, :].astype(int).tolist()
+                pair_dir, label_dir = build_pair_output_path(
+                    indices=indices_i, save_dir=save_dir
                 )
+                if data_loader is None:
+                    moving_affine, fixed_affine = np.eye(4), np.eye(4)
+                else:
+                    moving_affine, fixed_affine = data_loader.get_affines(
+                        image_indices=indices_i[:-1],
+                        resize=not (sliding_window or native_resolution),
+                    )
 
-            # calculate metric
-            sample_index_str = "_".join([str(x) for x in indices_i])
-            if sample_index_str in sample_index_strs:  # pragma: no cover
-                raise ValueError(
-                    "Sample is repeated, maybe the dataset has been repeated."
-                )
-            sample_index_strs.append(sample_index_str)
-
-            metric = calculate_metrics(
-                fixed_image=processed["fixed_image"][0],
-                fixed_label=processed["fixed_label"][0] if model.labeled else None,
-                pred_fixed_image=processed["pred_fixed_image"][0],
-                pred_fixed_label=processed["pred_fixed_label"][0]
-                if model.labeled
-                else None,
-                fixed_grid_ref=fixed_grid_ref,
-                sample_index=sample_index,
-            )
-            metric["pair_index"] = indices_i[:-1]
-            metric["label_index"] = indices_i[-1]
-            metric_lists.append(metric)
+                for name, (arr, normalize, on_label) in processed.items():
+                    if name == "theta":
+                        np.savetxt(
+                            fname=os.path.join(pair_dir, "affine.txt"),
+                            X=arr[sample_index, :, :],
+                            delimiter=",",
+                        )
+                        continue
+
+                    arr_save_dir = label_dir if on_label else pair_dir
+                    # moving tensors are in the moving image space
+                    affine = (
+                        moving_affine if name.startswith("moving") else fixed_affine
+                    )
+                    writer.save(
+                        save_dir=arr_save_dir,
+                        arr=arr[sample_index, :, :, :],
+                        name=name,
+                        normalize=normalize,  # label's value is already in [0, 1]
+                        save_nifti=save_nifti,
+                        save_png=save_png,
+                        png_layout=png_layout,
+                        overwrite=arr_save_dir == label_dir,
+                        volume_format=volume_format,
+                        compression_level=compression_level,
+                        affine=affine,
+                    )
+
+                # calculate metric
+                sample_index_str = "_".join([str(x) for x in indices_i])
+                if sample_index_str in sample_index_strs:  # pragma: no cover
+                    raise ValueError(
+                        "Sample is repeated, maybe the dataset has been repeated."
+                    )
+                sample_index_strs.append(sample_index_str)
+
+                metric = {
+                    k: None if v is None else v[sample_index]
+                    for k, v in batch_metric.items()
+                }
+                metric["pair_index"] = indices_i[:-1]
+                metric["label_index"] = indices_i[-1]
+                metric_lists.append(metric)
 
     # save metric
     save_metric_dict(save_dir=save_dir, metrics=metric_lists)
@@ -193,7 +539,20 @@ def predict(
     config_path: Union[str, List[str]],
     save_nifti: bool = True,
     save_png: bool = True,
+    png_layout: str = "slices",
     log_dir: str = "logs",
+    image_interpolation: str = "linear",
+    label_interpolation: str = "linear",
+    metrics: Optional[List[str]] = None,
+    num_writers: int = 4,
+    writer_queue_size: Optional[int] = None,
+    writer_processes: bool = False,
+    volume_format: str = "nii.gz",
+    compression_level: Optional[int] = None,
+    sliding_window: bool = False,
+    patch_overlap: float = 0.25,
+    blending: str = "gaussian",
+    native_resolution: bool = False,
 ):
     """
     Function to predict some metrics from the saved model and logging results.
@@ -207,7 +566,31 @@ def predict(
     :param log_dir: path of the log directory
     :param save_nifti: if true, outputs will be saved in nifti format
     :param save_png: if true, outputs will be saved in png format
+    :param png_layout: slices, montage or stack, the layout of png outputs,
+        one file per slice, one tiled png file or one multi-page tiff file per tensor.
     :param config_path: to overwrite the default config
+    :param image_interpolation: linear, nearest or cubic,
+        interpolation used to warp moving images with the predicted ddf.
+    :param label_interpolation: linear, nearest or cubic,
+        interpolation used to warp moving labels with the predicted ddf.
+    :param metrics: names of registered metrics to calculate,
+        default to image_ssd, label_binary_dice and label_tre.
+    :param num_writers: number of background workers saving the outputs,
+        outputs are saved synchronously if 0.
+    :param writer_queue_size: maximum number of outputs waiting to be saved,
+        default to twice the number of writers.
+    :param writer_processes: if true, outputs are saved by processes instead of threads.
+    :param volume_format: nii.gz, nii or h5, the format of the saved volumes.
+    :param compression_level: level of the gzip compression of the saved volumes,
+        default compression if None.
+    :param sliding_window: if true, the volumes are not resized to the image shape
+        of the model, the ddf is predicted on overlapping patches and blended.
+    :param patch_overlap: fraction of a patch overlapping with its neighbours
+        for sliding window inference.
+    :param blending: gaussian or cosine, the window blending the patches
+        for sliding window inference.
+    :param native_resolution: if true, the volumes are not resized to the image shape
+        of the model, the predicted ddf is upsampled to the original shape.
     """
     # TODO support custom sample_label
     logging.warning(
@@ -239,7 +622,10 @@ def predict(
     assert data_loader is not None
 
     # optimizer
-    optimizer = opt.build_optimizer(optimizer_config=config["train"]["optimizer"])
+    optimizer = opt.build_optimizer(
+        optimizer_config=config["train"]["optimizer"],
+        loss_scale=config["train"].get("mixed_precision", None) == "float16",
+    )
 
     # model
     model: tf.keras.Model = REGISTRY.build_model(
@@ -250,33 +636,32 @@ def predict(
             index_size=data_loader.num_indices,
             labeled=config["dataset"]["labeled"],
             batch_size=config["train"]["preprocess"]["batch_size"],
-            config=config["train"],
+            config=dict(
+                config["train"],
+                image_interpolation=image_interpolation,
+                label_interpolation=label_interpolation,
+            ),
         )
     )
 
     # metrics
     model.compile(optimizer=optimizer)
 
-    # load weights
-    if ckpt_path.endswith(".ckpt"):
-        # for ckpt from tf.keras.callbacks.ModelCheckpoint
-        # skip warnings because of optimizers
-        # https://stackoverflow.com/questions/58289342/tf2-0-translation-model-error-when-restoring-the-saved-model-unresolved-object
-        model.load_weights(ckpt_path).expect_partial()  # pragma: no cover
-    else:
-        # for ckpts from ckpt manager callback
-        _, _ = build_checkpoint_callback(
-            model=model,
-            dataset=dataset,
-            log_dir=log_dir,
-            save_period=config["train"]["save_period"],
-            ckpt_path=ckpt_path,
-        )
+    # load weights, the optimizer state is not needed for inference
+    restore_model(model=model, ckpt_path=ckpt_path)
 
     # predict
     fixed_grid_ref = tf.expand_dims(
         layer_util.get_reference_grid(grid_size=data_loader.fixed_image_shape), axis=0
     )  # shape = (1, f_dim1, f_dim2, f_dim3, 3)
+    if sliding_window or native_resolution:
+        if getattr(data_loader, "cache", None) is not None:
+            logging.warning(
+                "The cached volumes are resized, "
+                "disable the cache to predict on the original volumes."
+            )
+        # volumes of different shapes are not batched together
+        dataset = data_loader.get_dataset().batch(1)
     predict_on_dataset(
         dataset=dataset,
         fixed_grid_ref=fixed_grid_ref,
@@ -285,6 +670,20 @@ def predict(
         save_dir=os.path.join(log_dir, "test"),
         save_nifti=save_nifti,
         save_png=save_png,
+        png_layout=png_layout,
+        image_interpolation=image_interpolation,
+        label_interpolation=label_interpolation,
+        metrics=metrics,
+        num_writers=num_writers,
+        writer_queue_size=writer_queue_size,
+        writer_processes=writer_processes,
+        volume_format=volume_format,
+        compression_level=compression_level,
+        data_loader=data_loader,
+        sliding_window=sliding_window,
+        patch_overlap=patch_overlap,
+        blending=blending,
+        native_resolution=native_resolution,
     )
 
     # close the opened files in data loaders
@@ -356,6 +755,32 @@ def main(args=None):
     parser.add_argument("--no_png", dest="png", action="store_false")
     parser.set_defaults(png=False)
 
+    parser.add_argument(
+        "--png_layout",
+        help="Layout of png outputs, one file per slice, "
+        "one tiled png file or one multi-page tiff file per tensor.",
+        type=str,
+        choices=["slices", "montage", "stack"],
+        default="slices",
+    )
+
+    parser.add_argument(
+        "--volume_format",
+        help="Format of the saved volumes, nii.gz, nii or h5 (chunked HDF5).",
+        type=str,
+        choices=["nii.gz", "nii", "h5"],
+        default="nii.gz",
+    )
+
+    parser.add_argument(
+        "--compression_level",
+        help="Gzip compression level between 0 and 9 of the saved volumes, "
+        "default to nibabel's level for nii.gz and the fast lzf codec for h5.",
+        type=int,
+        choices=range(10),
+        default=None,
+    )
+
     parser.add_argument(
         "--config_path",
         "-c",
@@ -365,6 +790,83 @@ def main(args=None):
         default="",
     )
 
+    parser.add_argument(
+        "--image_interpolation",
+        help="Interpolation method to warp moving images.",
+        type=str,
+        choices=["linear", "nearest", "cubic"],
+        default="linear",
+    )
+
+    parser.add_argument(
+        "--label_interpolation",
+        help="Interpolation method to warp moving labels, "
+        "nearest preserves the label values.",
+        type=str,
+        choices=["linear", "nearest", "cubic"],
+        default="linear",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        help="Names of registered metrics to calculate, "
+        "default to image_ssd, label_binary_dice and label_tre.",
+        type=str,
+        nargs="+",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--num_writers",
+        help="Number of background workers saving the outputs, 0 to save synchronously.",
+        type=int,
+        default=4,
+    )
+
+    parser.add_argument(
+        "--writer_queue_size",
+        help="Maximum number of outputs waiting to be saved, "
+        "default to twice the number of writers.",
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--writer_processes",
+        help="Save the outputs with processes instead of threads.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--sliding_window",
+        help="Predict on the original volumes with overlapping patches "
+        "of the model input size instead of resizing the volumes.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--patch_overlap",
+        help="Fraction of a patch overlapping with its neighbours "
+        "for sliding window inference.",
+        type=float,
+        default=0.25,
+    )
+
+    parser.add_argument(
+        "--blending",
+        help="Window blending the overlapping patches for sliding window inference.",
+        type=str,
+        choices=["gaussian", "cosine"],
+        default="gaussian",
+    )
+
+    parser.add_argument(
+        "--native_resolution",
+        help="Predict the DDF at the model input size and upsample it "
+        "to warp the original volumes instead of resizing the outputs.",
+        action="store_true",
+    )
+
     args = parser.parse_args(args)
 
     predict(
@@ -378,6 +880,19 @@ def main(args=None):
         config_path=args.config_path,
         save_nifti=args.nifti,
         save_png=args.png,
+        png_layout=args.png_layout,
+        image_interpolation=args.image_interpolation,
+        label_interpolation=args.label_interpolation,
+        metrics=args.metrics,
+        num_writers=args.num_writers,
+        writer_queue_size=args.writer_queue_size,
+        writer_processes=args.writer_processes,
+        volume_format=args.volume_format,
+        compression_level=args.compression_level,
+        sliding_window=args.sliding_window,
+        patch_overlap=args.patch_overlap,
+        blending=args.blending,
+        native_resolution=args.native_resolution,
     )
 
 
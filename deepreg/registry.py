@@ -7,6 +7,7 @@ MODEL_CLASS = "model_class"
 DATA_AUGMENTATION_CLASS = "da_class"
 DATA_LOADER_CLASS = "data_loader_class"
 FILE_LOADER_CLASS = "file_loader_class"
+METRIC_CLASS = "metric_class"
 KNOWN_CATEGORIES = [
     BACKBONE_CLASS,
     LOSS_CLASS,
@@ -14,6 +15,7 @@ KNOWN_CATEGORIES = [
     DATA_AUGMENTATION_CLASS,
     DATA_LOADER_CLASS,
     FILE_LOADER_CLASS,
+    METRIC_CLASS,
 ]
 
 
@@ -304,5 +306,30 @@ class Registry:
             category=DATA_AUGMENTATION_CLASS, config=config, default_args=default_args
         )
 
+    def register_metric(
+        self, name: str, cls: Callable = None, force: bool = False
+    ) -> Callable:
+        """
+        Register a metric class.
+
+        :param name: metric name, also the column name in the saved metrics
+        :param cls: metric class
+        :param force: whether overwrite if already registered
+        :return: the registered class
+        """
+        return self.register(category=METRIC_CLASS, name=name, cls=cls, force=force)
+
+    def build_metric(self, config: dict, default_args: Optional[dict] = None) -> Any:
+        """
+        Instantiate a registered metric class.
+
+        :param config: config having key `name`.
+        :param default_args: optionally some default arguments.
+        :return: a metric instance
+        """
+        return self.build_from_config(
+            category=METRIC_CLASS, config=config, default_args=default_args
+        )
+
 
 REGISTRY = Registry()
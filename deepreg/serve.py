@@ -0,0 +1,680 @@
+# coding=utf-8
+
+"""
+Module to serve a trained model for online registration. CLI tools are provided
+for the server and for a load test client.
+
+The server loads the checkpoint once, and concurrent requests are batched
+dynamically before being predicted by a function compiled for fixed shapes.
+Arrays are exchanged in the numpy npz format over HTTP, on a local port
+or a Unix socket.
+"""
+
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import tensorflow as tf
+
+from deepreg.callback import restore_model
+from deepreg.dataset.loader.util import normalize_array
+from deepreg.model.network import build_model_from_config, load_config
+
+# inputs of a request, the labels are optional
+IMAGE_KEYS = ["moving_image", "fixed_image"]
+LABEL_KEYS = ["moving_label", "fixed_label"]
+
+
+class RegistrationPredictor:
+    """
+    Predict samples with a function compiled for the model input shapes.
+
+    A list of samples is stacked and padded with zeros to the model batch size,
+    missing labels are replaced by zeros and the label outputs are not returned.
+    The images are normalized to [0, 1] like in the data loaders, the labels
+    are used as they are.
+    """
+
+    def __init__(self, model: tf.keras.Model):
+        """
+        Init.
+
+        :param model: built model with weights restored
+        """
+        self.model = model
+        self.batch_size = model.batch_size
+        self.shapes = dict(
+            moving_image=tuple(model.moving_image_size),
+            fixed_image=tuple(model.fixed_image_size),
+            moving_label=tuple(model.moving_image_size),
+            fixed_label=tuple(model.fixed_image_size),
+            indices=(model.index_size,),
+        )
+        self.input_keys = (
+            IMAGE_KEYS + (LABEL_KEYS if model.labeled else []) + ["indices"]
+        )
+        input_signature = [
+            {
+                key: tf.TensorSpec(
+                    shape=(self.batch_size,) + self.shapes[key], dtype=tf.float32
+                )
+                for key in self.input_keys
+            }
+        ]
+        # the outputs are returned as a plain dict instead of the tracked wrapper
+        self._predict = tf.function(
+            lambda inputs: dict(self.model(inputs, training=False)),
+            input_signature=input_signature,
+        )
+
+    def warm_up(self):
+        """Trace the compiled function by predicting an empty sample."""
+        self([{key: np.zeros(self.shapes[key]) for key in IMAGE_KEYS}])
+
+    def check_sample(self, sample: Dict[str, np.ndarray]):
+        """
+        Check the arrays of a sample.
+
+        :param sample: dict of arrays, moving_image and fixed_image are required,
+            moving_label and fixed_label are optional and given together.
+        """
+        for key in IMAGE_KEYS:
+            if key not in sample:
+                raise ValueError(f"Array {key} is missing.")
+        has_label = [key in sample for key in LABEL_KEYS]
+        if any(has_label) and not all(has_label):
+            raise ValueError("moving_label and fixed_label must be given together.")
+        for key in IMAGE_KEYS + LABEL_KEYS:
+            if key in sample and tuple(sample[key].shape) != self.shapes[key]:
+                raise ValueError(
+                    f"Array {key} must be of shape {self.shapes[key]}, "
+                    f"got {tuple(sample[key].shape)}."
+                )
+
+    def __call__(
+        self, samples: List[Dict[str, np.ndarray]]
+    ) -> List[Dict[str, np.ndarray]]:
+        """
+        Predict a list of samples.
+
+        :param samples: at most batch_size samples, checked by check_sample
+        :return: outputs of each sample
+        """
+        num_samples = len(samples)
+        assert 0 < num_samples <= self.batch_size
+        inputs = {
+            key: np.zeros((self.batch_size,) + self.shapes[key], dtype=np.float32)
+            for key in self.input_keys
+        }
+        for i, sample in enumerate(samples):
+            for key in IMAGE_KEYS:
+                inputs[key][i] = normalize_array(sample[key])
+            for key in LABEL_KEYS:
+                if key in sample and key in inputs:
+                    inputs[key][i] = sample[key]
+        outputs = self._predict(inputs)
+        outputs = {key: value.numpy() for key, value in outputs.items()}
+        return [
+            {
+                key: value[i]
+                for key, value in outputs.items()
+                if key != "pred_fixed_label" or "moving_label" in samples[i]
+            }
+            for i in range(num_samples)
+        ]
+
+
+class DynamicBatcher:
+    """
+    Batch the samples submitted concurrently.
+
+    A worker thread waits for the first sample, then collects the next ones
+    until the batch is full or max_latency seconds have passed, and predicts
+    the batch at once.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[Dict]], List[Dict]],
+        batch_size: int,
+        max_latency: float,
+    ):
+        """
+        Init and start the worker thread.
+
+        :param predict_fn: predict a list of at most batch_size samples
+        :param batch_size: maximum number of samples per batch
+        :param max_latency: maximum time in seconds waiting for a full batch
+        """
+        self.predict_fn = predict_fn
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.num_batches = 0
+        self.num_samples = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, sample: Dict) -> Future:
+        """
+        Submit a sample to predict.
+
+        :param sample: a sample accepted by predict_fn
+        :return: future of the outputs of the sample
+        """
+        future: Future = Future()
+        self._queue.put((sample, future))
+        return future
+
+    def _run(self):
+        """Collect and predict batches until None is received."""
+        stopped = False
+        while not stopped:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+            self._predict(batch)
+
+    def _predict(self, batch: List[Tuple[Dict, Future]]):
+        """
+        Predict a batch and set the results of the futures.
+
+        :param batch: list of (sample, future)
+        """
+        self.num_batches += 1
+        self.num_samples += len(batch)
+        try:
+            outputs = self.predict_fn([sample for sample, _ in batch])
+        except Exception as err:  # pylint: disable=broad-except
+            for _, future in batch:
+                future.set_exception(err)
+            return
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+    def close(self):
+        """Predict the pending samples and stop the worker thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def encode_arrays(arrays: Dict[str, np.ndarray]) -> bytes:
+    """
+    Encode arrays in npz format.
+
+    :param arrays: dict of arrays
+    :return: bytes
+    """
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_arrays(data: bytes) -> Dict[str, np.ndarray]:
+    """
+    Decode arrays in npz format.
+
+    :param data: bytes
+    :return: dict of arrays
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return {key: arrays[key] for key in arrays.files}
+
+
+def build_request_handler(
+    predictor: RegistrationPredictor, batcher: DynamicBatcher
+) -> type:
+    """
+    Build the class handling the HTTP requests.
+
+    - GET /health returns the model input shapes and batching statistics in json.
+    - POST /predict takes the arrays of a sample in npz format
+      and returns the predicted arrays in npz format, e.g. ddf and pred_fixed_image.
+
+    :param predictor: predictor checking the samples
+    :param batcher: batcher predicting the samples
+    :return: subclass of BaseHTTPRequestHandler
+    """
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        # keep the connections alive between requests
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code: int, body: bytes, content_type: str):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, code: int, message: str):
+            self._send(code, message.encode(), "text/plain")
+
+        def do_GET(self):  # noqa: N802
+            if self.path != "/health":
+                self._send_error(404, f"Unknown path {self.path}.")
+                return
+            status = dict(
+                moving_image_shape=predictor.shapes["moving_image"],
+                fixed_image_shape=predictor.shapes["fixed_image"],
+                labeled=predictor.model.labeled,
+                batch_size=predictor.batch_size,
+                num_batches=batcher.num_batches,
+                num_samples=batcher.num_samples,
+            )
+            self._send(200, json.dumps(status).encode(), "application/json")
+
+        def do_POST(self):  # noqa: N802
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path != "/predict":
+                self._send_error(404, f"Unknown path {self.path}.")
+                return
+            try:
+                sample = decode_arrays(body)
+                predictor.check_sample(sample)
+            except ValueError as err:
+                self._send_error(400, str(err))
+                return
+            try:
+                outputs = batcher.submit(sample).result()
+            except Exception as err:  # pylint: disable=broad-except
+                logging.exception("Prediction failed.")
+                self._send_error(500, str(err))
+                return
+            self._send(200, encode_arrays(outputs), "application/octet-stream")
+
+        def address_string(self) -> str:
+            # the client address is empty for Unix sockets
+            return str(self.client_address[0]) if self.client_address else "local"
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            logging.debug("%s - %s", self.address_string(), format % args)
+
+    return RequestHandler
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each connection in a thread."""
+
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    """HTTP server on a Unix socket handling each connection in a thread."""
+
+    daemon_threads = True
+
+
+def build_server(
+    predictor: RegistrationPredictor,
+    batcher: DynamicBatcher,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path: Optional[str] = None,
+) -> socketserver.BaseServer:
+    """
+    Build the server, listening on a Unix socket if socket_path is given.
+
+    :param predictor: predictor checking the samples
+    :param batcher: batcher predicting the samples
+    :param host: host of the HTTP server
+    :param port: port of the HTTP server, a free port is used if 0
+    :param socket_path: path of the Unix socket, host and port are ignored if given
+    :return: server, to be run by serve_forever
+    """
+    handler = build_request_handler(predictor=predictor, batcher=batcher)
+    if socket_path is None:
+        return ThreadingHTTPServer((host, port), handler)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    return ThreadingUnixHTTPServer(socket_path, handler)
+
+
+def serve(
+    gpu: str,
+    ckpt_path: str,
+    config_path: Union[str, List[str]] = "",
+    batch_size: int = 4,
+    max_latency: float = 0.01,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path: Optional[str] = None,
+):
+    """
+    Load the model once and serve predictions until interrupted.
+
+    :param gpu: which env gpu to use.
+    :param ckpt_path: where model is stored, should be like log_folder/save/ckpt-x
+    :param config_path: to overwrite the default config
+    :param batch_size: maximum number of requests predicted together
+    :param max_latency: maximum time in seconds a request waits for a full batch
+    :param host: host of the HTTP server
+    :param port: port of the HTTP server
+    :param socket_path: path of the Unix socket, host and port are ignored if given
+    """
+    os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+    ckpt_path = os.path.expanduser(ckpt_path)
+    config = load_config(config_path=config_path, ckpt_path=ckpt_path)
+    model = build_model_from_config(config=config, batch_size=batch_size)
+    restore_model(model=model, ckpt_path=ckpt_path)
+    predictor = RegistrationPredictor(model=model)
+    predictor.warm_up()
+
+    with DynamicBatcher(
+        predict_fn=predictor, batch_size=batch_size, max_latency=max_latency
+    ) as batcher:
+        server = build_server(
+            predictor=predictor,
+            batcher=batcher,
+            host=host,
+            port=port,
+            socket_path=socket_path,
+        )
+        address = socket_path if socket_path else f"http://{host}:{port}"
+        logging.info(f"Serving {ckpt_path} on {address}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
+        finally:
+            server.server_close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        """
+        Init.
+
+        :param socket_path: path of the Unix socket
+        :param timeout: timeout of the socket in seconds
+        """
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        """Connect to the Unix socket."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RegistrationClient:
+    """Client of the registration server, reusing one connection."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        socket_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Init.
+
+        :param host: host of the HTTP server
+        :param port: port of the HTTP server
+        :param socket_path: path of the Unix socket, host and port are ignored if given
+        :param timeout: timeout of the requests in seconds
+        """
+        if socket_path is None:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        else:
+            self.connection = UnixHTTPConnection(socket_path, timeout=timeout)
+
+    def _request(self, method: str, path: str, body: bytes = None) -> bytes:
+        self.connection.request(method, path, body=body)
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise ValueError(
+                f"Request {method} {path} failed with status {response.status}: "
+                f"{data.decode()}"
+            )
+        return data
+
+    def health(self) -> Dict:
+        """
+        Get the status of the server.
+
+        :return: dict with model input shapes and batching statistics
+        """
+        return json.loads(self._request("GET", "/health"))
+
+    def predict(self, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Predict a sample.
+
+        :param arrays: moving_image and fixed_image, optionally the labels
+        :return: predicted arrays, e.g. ddf and pred_fixed_image
+        """
+        return decode_arrays(self._request("POST", "/predict", encode_arrays(arrays)))
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
+
+
+def load_test(
+    num_requests: int = 100,
+    concurrency: int = 4,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Send random samples concurrently and measure the latency and throughput.
+
+    Each of the concurrent clients sends its requests sequentially,
+    with a shape given by the server.
+
+    :param num_requests: total number of requests
+    :param concurrency: number of concurrent clients
+    :param host: host of the HTTP server
+    :param port: port of the HTTP server
+    :param socket_path: path of the Unix socket, host and port are ignored if given
+    :return: latencies in milliseconds and throughput in requests per second
+    """
+    address = dict(host=host, port=port, socket_path=socket_path)
+    client = RegistrationClient(**address)  # type: ignore
+    status = client.health()
+    client.close()
+    rng = np.random.default_rng(0)
+    sample = {
+        key: rng.random(status[f"{key}_shape"], dtype=np.float32) for key in IMAGE_KEYS
+    }
+
+    latencies: List[float] = []
+    errors: List[Exception] = []
+    lock = threading.Lock()
+
+    def run(num: int):
+        worker_client = RegistrationClient(**address)  # type: ignore
+        try:
+            for _ in range(num):
+                start = time.perf_counter()
+                worker_client.predict(sample)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+        finally:
+            worker_client.close()
+
+    threads = [
+        threading.Thread(
+            target=run,
+            args=(num_requests // concurrency + (i < num_requests % concurrency),),
+        )
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return dict(
+        num_requests=len(latencies),
+        p50_ms=float(np.percentile(latencies_ms, 50)),
+        p99_ms=float(np.percentile(latencies_ms, 99)),
+        mean_ms=float(np.mean(latencies_ms)),
+        throughput=len(latencies) / duration,
+    )
+
+
+def main(args=None):
+    """
+    Entry point for the registration server.
+
+    :param args:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--gpu",
+        "-g",
+        help='GPU index for serving, -g "" for using CPU, -g "0" for using GPU 0.',
+        type=str,
+        required=True,
+    )
+
+    parser.add_argument(
+        "--ckpt_path",
+        "-k",
+        help="Path of checkpointed model to load",
+        type=str,
+        required=True,
+    )
+
+    parser.add_argument(
+        "--config_path",
+        "-c",
+        help="Path of config, must end with .yaml. Can pass multiple paths.",
+        type=str,
+        nargs="*",
+        default="",
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        "-b",
+        help="Maximum number of requests predicted together.",
+        type=int,
+        default=4,
+    )
+
+    parser.add_argument(
+        "--max_latency",
+        help="Maximum time in milliseconds a request waits for a full batch.",
+        type=float,
+        default=10,
+    )
+
+    parser.add_argument("--host", help="Host of the server.", default="127.0.0.1")
+
+    parser.add_argument("--port", help="Port of the server.", type=int, default=8000)
+
+    parser.add_argument(
+        "--socket",
+        help="Path of a Unix socket to listen on instead of host and port.",
+        type=str,
+        default=None,
+    )
+
+    args = parser.parse_args(args)
+
+    serve(
+        gpu=args.gpu,
+        ckpt_path=args.ckpt_path,
+        config_path=args.config_path,
+        batch_size=args.batch_size,
+        max_latency=args.max_latency / 1000,
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+    )
+
+
+def load_test_main(args=None):
+    """
+    Entry point for the load test client of the registration server.
+
+    :param args:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--num_requests", "-n", help="Total number of requests.", type=int, default=100
+    )
+
+    parser.add_argument(
+        "--concurrency", help="Number of concurrent clients.", type=int, default=4
+    )
+
+    parser.add_argument("--host", help="Host of the server.", default="127.0.0.1")
+
+    parser.add_argument("--port", help="Port of the server.", type=int, default=8000)
+
+    parser.add_argument(
+        "--socket",
+        help="Path of the Unix socket of the server instead of host and port.",
+        type=str,
+        default=None,
+    )
+
+    args = parser.parse_args(args)
+
+    stats = load_test(
+        num_requests=args.num_requests,
+        concurrency=args.concurrency,
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+    )
+    print(
+        f"{stats['num_requests']} requests, "
+        f"p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms, "
+        f"mean {stats['mean_ms']:.1f} ms, {stats['throughput']:.1f} requests/s"
+    )
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
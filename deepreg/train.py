@@ -134,7 +134,10 @@ def train(
                 num_devices=num_devices,
             )
         )
-        optimizer = opt.build_optimizer(optimizer_config=config["train"]["optimizer"])
+        optimizer = opt.build_optimizer(
+            optimizer_config=config["train"]["optimizer"],
+            loss_scale=config["train"].get("mixed_precision", None) == "float16",
+        )
 
     # compile
     model.compile(optimizer=optimizer)
@@ -146,7 +149,6 @@ def train(
     )
     ckpt_callback, initial_epoch = build_checkpoint_callback(
         model=model,
-        dataset=dataset_train,
         log_dir=log_dir,
         save_period=config["train"]["save_period"],
         ckpt_path=ckpt_path,
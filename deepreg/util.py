@@ -1,18 +1,22 @@
 import logging
+import multiprocessing
 import os
+from collections import deque
+from concurrent import futures
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, Tuple, Union
 
+import h5py
 import matplotlib.pyplot as plt
-import nibabel as nib
 import numpy as np
 import pandas as pd
 import tensorflow as tf
+from PIL import Image
 
-import deepreg.loss.image as image_loss
-import deepreg.loss.label as label_loss
 from deepreg.dataset.load import get_data_loader
 from deepreg.dataset.loader.interface import DataLoader
+from deepreg.dataset.loader.nifti_loader import save_nifti_file
 from deepreg.dataset.loader.util import normalize_array
 
 
@@ -70,6 +74,131 @@ def build_log_dir(log_dir: str, exp_name: str) -> str:
     return log_dir
 
 
+@lru_cache(maxsize=None)
+def colormap_lut(cmap: str) -> np.ndarray:
+    """
+    Build the lookup table of a matplotlib colormap in bytes.
+
+    The rows follow the indices used by matplotlib, N colors,
+    then the colors for values under the range, over the range and NaN.
+
+    :param cmap: name of the colormap, e.g. gray.
+    :return: shape = (N + 3, 4), uint8
+    """
+    colormap = plt.get_cmap(cmap)
+    return np.concatenate(
+        [
+            colormap(np.arange(colormap.N), bytes=True),
+            colormap(np.array([-1.0, 2.0, np.nan]), bytes=True),
+        ],
+        axis=0,
+    )
+
+
+def colorize_slices(arr: np.ndarray, cmap: str) -> np.ndarray:
+    """
+    Convert all depth slices of a volume into RGBA images at once.
+
+    The values are mapped with vmin=0 and vmax=1, giving the same pixels as
+    plt.imsave(arr[:, :, depth_index], cmap=cmap, vmin=0, vmax=1) for each slice.
+    4D arrays are RGB images and the colormap is not used.
+
+    :param arr: shape = (dim1, dim2, dim3) or (dim1, dim2, dim3, 3),
+        values are expected to be between [0, 1].
+    :param cmap: name of the colormap used for 3D arrays.
+    :return: shape = (dim3, dim1, dim2, 4), uint8
+    """
+    arr = np.moveaxis(arr, 2, 0)
+    if arr.dtype.kind != "f":
+        arr = arr.astype(np.float64)
+    if arr.ndim == 4:
+        if np.nanmax(arr) > 1 or np.nanmin(arr) < 0:
+            raise ValueError(
+                f"RGB values must be between [0, 1] to be colorized, "
+                f"got [{np.nanmin(arr)}, {np.nanmax(arr)}]"
+            )
+        rgba = np.full(arr.shape[:3] + (4,), 255, dtype=np.uint8)
+        rgba[..., :3] = arr * 255
+        rgba[np.any(np.isnan(arr), axis=3)] = 0
+        return rgba
+    lut = colormap_lut(cmap)
+    num_colors = lut.shape[0] - 3
+    arr = arr * num_colors
+    arr[arr == num_colors] = num_colors - 1
+    with np.errstate(invalid="ignore"):
+        indices = np.clip(arr, -1, num_colors).astype(int)
+    indices[arr < 0] = num_colors
+    indices[arr >= num_colors] = num_colors + 1
+    indices[np.isnan(arr)] = num_colors + 2
+    return lut[indices]
+
+
+def compact_rgba(rgba: np.ndarray) -> np.ndarray:
+    """
+    Drop the channels of RGBA images which do not change the displayed colors.
+
+    The alpha channel is dropped if all pixels are opaque,
+    then a single channel is kept if all pixels are gray,
+    so that gray images are encoded four times faster.
+
+    :param rgba: shape = (..., 4), uint8
+    :return: shape = (..., 4), (..., 3) or (...,), uint8
+    """
+    if not np.all(rgba[..., 3] == 255):
+        return rgba
+    rgb = rgba[..., :3]
+    if np.all(rgb[..., :1] == rgb[..., 1:]):
+        return np.ascontiguousarray(rgb[..., 0])
+    return np.ascontiguousarray(rgb)
+
+
+def tile_montage(slices: np.ndarray) -> np.ndarray:
+    """
+    Tile images into a grid, in row-major order.
+
+    The grid is almost square and the empty cells are filled with zeros.
+
+    :param slices: shape = (num_slices, dim1, dim2, ...)
+    :return: shape = (num_rows * dim1, num_cols * dim2, ...)
+    """
+    num_slices, dim1, dim2 = slices.shape[:3]
+    channels = slices.shape[3:]
+    num_cols = int(np.ceil(np.sqrt(num_slices)))
+    num_rows = int(np.ceil(num_slices / num_cols))
+    grid = np.zeros((num_rows * num_cols, dim1, dim2) + channels, dtype=slices.dtype)
+    grid[:num_slices] = slices
+    grid = grid.reshape((num_rows, num_cols, dim1, dim2) + channels)
+    grid = np.swapaxes(grid, 1, 2)
+    return grid.reshape((num_rows * dim1, num_cols * dim2) + channels)
+
+
+def save_h5_file(
+    arr: np.ndarray,
+    file_path: str,
+    affine: Optional[np.ndarray] = None,
+    compression_level: Optional[int] = None,
+):
+    """
+    Save an array in a HDF5 file, chunked per depth slice.
+
+    :param arr: 3D or 4D array to be saved in the dataset "data"
+    :param file_path: path of the file
+    :param affine: shape = (4, 4), stored in the attribute "affine", identity if None
+    :param compression_level: gzip level between 0 and 9, 0 for no compression,
+        the fast lzf compression is used if None
+    """
+    if compression_level is None:
+        kwargs = dict(compression="lzf")
+    elif compression_level > 0:
+        kwargs = dict(compression="gzip", compression_opts=compression_level)
+    else:
+        kwargs = dict()
+    chunks = arr.shape[:2] + (1,) + arr.shape[3:]
+    with h5py.File(file_path, "w") as h5_file:
+        dataset = h5_file.create_dataset("data", data=arr, chunks=chunks, **kwargs)
+        dataset.attrs["affine"] = np.eye(4) if affine is None else affine
+
+
 def save_array(
     save_dir: str,
     arr: Union[np.ndarray, tf.Tensor],
@@ -78,6 +207,10 @@ def save_array(
     save_nifti: bool = True,
     save_png: bool = True,
     overwrite: bool = True,
+    png_layout: str = "slices",
+    volume_format: str = "nii.gz",
+    compression_level: Optional[int] = None,
+    affine: Optional[np.ndarray] = None,
 ):
     """
     :param save_dir: path of the directory to save
@@ -86,9 +219,32 @@ def save_array(
     :param normalize: true if the array's value has to be normalized when saving pngs,
         false means the value is between [0, 1].
     :param save_nifti: if true, array will be saved in nifti
+        or in the format given by volume_format
     :param save_png: if true, array will be saved in png
     :param overwrite: if false, will not save the file in case the file exists
+    :param png_layout: slices, montage or stack, the layout of png outputs
+        - slices, one png file per depth slice under the folder name,
+        - montage, one png file name.png tiling all slices,
+        - stack, one multi-page tiff file name.tiff with one page per slice.
+    :param volume_format: nii.gz, nii or h5, the format of the volume file
+        - nii.gz, compressed Nifti file,
+        - nii, uncompressed Nifti file,
+        - h5, HDF5 file storing the array in the dataset "data", chunked per slice,
+          with the affine stored in the attribute "affine".
+    :param compression_level: level between 0 and 9 of the gzip compression
+        used for nii.gz and h5 files, nibabel's default level for nii.gz
+        and the fast lzf compression for h5 if None.
+    :param affine: shape = (4, 4), voxel to world coordinates of the array,
+        identity if None.
     """
+    if volume_format not in ["nii.gz", "nii", "h5"]:
+        raise ValueError(
+            f"volume_format must be nii.gz, nii or h5, got {volume_format}"
+        )
+    if png_layout not in ["slices", "montage", "stack"]:
+        raise ValueError(
+            f"png_layout must be slices, montage or stack, got {png_layout}"
+        )
     if isinstance(arr, tf.Tensor):
         arr = arr.numpy()
     if len(arr.shape) not in [3, 4]:
@@ -104,80 +260,213 @@ def save_array(
 
     # save in nifti format
     if save_nifti:
-        nifti_file_path = os.path.join(save_dir, name + ".nii.gz")
-        if overwrite or (not os.path.exists(nifti_file_path)):
+        file_path = os.path.join(save_dir, name + "." + volume_format)
+        if overwrite or (not os.path.exists(file_path)):
             # save only if need to overwrite or doesn't exist
             os.makedirs(save_dir, exist_ok=True)
-            # output with Nifti1Image can be loaded by
-            # - https://www.slicer.org/
-            # - http://www.itksnap.org/
-            # - http://ric.uthscsa.edu/mango/
-            # However, outputs with Nifti2Image couldn't be loaded
-            nib.save(
-                img=nib.Nifti1Image(arr, affine=np.eye(4)), filename=nifti_file_path
-            )
+            if volume_format == "h5":
+                save_h5_file(
+                    arr=arr,
+                    file_path=file_path,
+                    affine=affine,
+                    compression_level=compression_level,
+                )
+            else:
+                save_nifti_file(
+                    arr=arr,
+                    file_path=file_path,
+                    affine=affine,
+                    compression_level=compression_level,
+                )
 
     # save in png
     if save_png:
-        png_dir = os.path.join(save_dir, name)
-        dir_existed = os.path.exists(png_dir)
+        if png_layout == "slices":
+            png_dir = os.path.join(save_dir, name)
+            png_file_paths = [
+                os.path.join(png_dir, f"depth{depth_index}_{name}.png")
+                for depth_index in range(arr.shape[2])
+            ]
+        else:
+            png_dir = save_dir
+            suffix = ".png" if png_layout == "montage" else ".tiff"
+            png_file_paths = [os.path.join(png_dir, name + suffix)]
+        to_save = [overwrite or (not os.path.exists(x)) for x in png_file_paths]
+        if not any(to_save):
+            return
         if normalize:
             # normalize arr such that it has only values between 0, 1
             arr = normalize_array(arr=arr)
-        for depth_index in range(arr.shape[2]):
-            png_file_path = os.path.join(png_dir, f"depth{depth_index}_{name}.png")
-            if overwrite or (not os.path.exists(png_file_path)):
-                if not dir_existed:
-                    os.makedirs(png_dir, exist_ok=True)
-                plt.imsave(
-                    fname=png_file_path,
-                    arr=arr[:, :, depth_index, :] if is_4d else arr[:, :, depth_index],
-                    vmin=0,
-                    vmax=1,
-                    cmap="PiYG" if is_4d else "gray",
-                )
+        # colorize all slices at once with the lookup table of the colormap
+        slices = colorize_slices(arr=arr, cmap="PiYG" if is_4d else "gray")
+        slices = compact_rgba(slices)
+        os.makedirs(png_dir, exist_ok=True)
+        if png_layout == "montage":
+            Image.fromarray(tile_montage(slices)).save(png_file_paths[0])
+        elif png_layout == "stack":
+            images = [Image.fromarray(x) for x in slices]
+            images[0].save(png_file_paths[0], save_all=True, append_images=images[1:])
+        else:
+            for png_slice, png_file_path, save in zip(slices, png_file_paths, to_save):
+                if save:
+                    Image.fromarray(png_slice).save(png_file_path)
 
 
-def calculate_metrics(
-    fixed_image: tf.Tensor,
-    fixed_label: Optional[tf.Tensor],
-    pred_fixed_image: Optional[tf.Tensor],
-    pred_fixed_label: Optional[tf.Tensor],
-    fixed_grid_ref: tf.Tensor,
-    sample_index: int,
-) -> dict:
-    """
-    Calculate image/label based metrics.
-    :param fixed_image: shape=(batch, f_dim1, f_dim2, f_dim3)
-    :param fixed_label: shape=(batch, f_dim1, f_dim2, f_dim3) or None
-    :param pred_fixed_image: shape=(batch, f_dim1, f_dim2, f_dim3)
-    :param pred_fixed_label: shape=(batch, f_dim1, f_dim2, f_dim3) or None
-    :param fixed_grid_ref: shape=(1, f_dim1, f_dim2, f_dim3, 3)
-    :param sample_index: int,
-    :return: dictionary of metrics
-    """
-
-    if pred_fixed_image is not None:
-        y_true = fixed_image[sample_index : (sample_index + 1), :, :, :]
-        y_pred = pred_fixed_image[sample_index : (sample_index + 1), :, :, :]
-        y_true = tf.expand_dims(y_true, axis=4)
-        y_pred = tf.expand_dims(y_pred, axis=4)
-        ssd = image_loss.SumSquaredDifference()(y_true=y_true, y_pred=y_pred).numpy()
-    else:
-        ssd = None
-
-    if fixed_label is not None and pred_fixed_label is not None:
-        y_true = fixed_label[sample_index : (sample_index + 1), :, :, :]
-        y_pred = pred_fixed_label[sample_index : (sample_index + 1), :, :, :]
-        dice = label_loss.DiceScore(binary=True)(y_true=y_true, y_pred=y_pred).numpy()
-        tre = label_loss.compute_centroid_distance(
-            y_true=y_true, y_pred=y_pred, grid=fixed_grid_ref[0, :, :, :, :]
-        ).numpy()[0]
-    else:
-        dice = None
-        tre = None
+class ArrayWriter:
+    """
+    Save arrays with save_array in a pool of background workers.
+
+    Saving overlaps with the computation of the next arrays,
+    at most `max_pending` arrays are waiting to be saved so that the memory is bounded.
+    Errors raised by the workers are raised when the writer is closed.
+
+    It can be used as a context manager, which closes the writer on exit.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 4,
+        max_pending: Optional[int] = None,
+        use_processes: bool = False,
+    ):
+        """
+        Init.
+
+        :param num_workers: number of workers, arrays are saved synchronously if 0.
+        :param max_pending: maximum number of submitted arrays not saved yet,
+            default to twice the number of workers.
+        :param use_processes: use processes instead of threads as workers.
+        """
+        if num_workers < 0:
+            raise ValueError(
+                f"num_workers must be non-negative for ArrayWriter, got {num_workers}"
+            )
+        if max_pending is None:
+            max_pending = 2 * num_workers
+        if max_pending < 1 and num_workers > 0:
+            raise ValueError(
+                f"max_pending must be positive for ArrayWriter, got {max_pending}"
+            )
+        self.max_pending = max_pending
+        self._executor: Optional[futures.Executor] = None
+        if num_workers > 0 and use_processes:
+            # spawn avoids forking the TensorFlow runtime
+            self._executor = futures.ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        elif num_workers > 0:
+            self._executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+        self._pending: deque = deque()
+        self._errors: list = []
+        self._saved: set = set()
+
+    def save(
+        self,
+        save_dir: str,
+        arr: Union[np.ndarray, tf.Tensor],
+        name: str,
+        normalize: bool,
+        save_nifti: bool = True,
+        save_png: bool = True,
+        overwrite: bool = True,
+        png_layout: str = "slices",
+        volume_format: str = "nii.gz",
+        compression_level: Optional[int] = None,
+        affine: Optional[np.ndarray] = None,
+    ):
+        """
+        Submit an array to be saved, arguments are the same as save_array.
+
+        An array which is not overwritten is submitted only once per path.
+
+        :param save_dir: path of the directory to save
+        :param arr: 3D or 4D array to be saved
+        :param name: name of the array, e.g. image, label, etc.
+        :param normalize: true if the array's value has to be normalized when saving pngs,
+            false means the value is between [0, 1].
+        :param save_nifti: if true, array will be saved in nifti
+        :param save_png: if true, array will be saved in png
+        :param overwrite: if false, will not save the file in case the file exists
+        :param png_layout: slices, montage or stack, the layout of png outputs
+        :param volume_format: nii.gz, nii or h5, the format of the volume file
+        :param compression_level: level of the gzip compression of the volume file
+        :param affine: shape = (4, 4), voxel to world coordinates of the array
+        """
+        if not overwrite:
+            path = os.path.join(save_dir, name)
+            if path in self._saved:
+                return
+            self._saved.add(path)
+        kwargs = dict(
+            save_dir=save_dir,
+            arr=arr.numpy() if isinstance(arr, tf.Tensor) else arr,
+            name=name,
+            normalize=normalize,
+            save_nifti=save_nifti,
+            save_png=save_png,
+            overwrite=overwrite,
+            png_layout=png_layout,
+            volume_format=volume_format,
+            compression_level=compression_level,
+            affine=affine,
+        )
+        if self._executor is None:
+            save_array(**kwargs)
+            return
+        while len(self._pending) >= self.max_pending:
+            self._wait(self._pending.popleft())
+        self._pending.append(self._executor.submit(save_array, **kwargs))
+
+    def _wait(self, future: futures.Future):
+        """
+        Wait for a submitted array to be saved and record the error if any.
+
+        :param future: future of save_array.
+        """
+        error = future.exception()
+        if error is not None:
+            self._errors.append(error)
+
+    def close(self):
+        """
+        Wait for all arrays to be saved and stop the workers.
+
+        The first error raised by the workers is raised again.
+        """
+        while self._pending:
+            self._wait(self._pending.popleft())
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._errors:
+            errors, self._errors = self._errors, []
+            if len(errors) > 1:
+                logging.error(f"{len(errors)} arrays failed to be saved.")
+            raise errors[0]
+
+    def __enter__(self):
+        """Return the writer itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Close the writer.
+
+        If an exception has been raised, errors of the workers are only logged
+        to not hide it.
 
-    return dict(image_ssd=ssd, label_binary_dice=dice, label_tre=tre)
+        :param exc_type: type of the raised exception, None if not raised.
+        :param exc_value: raised exception.
+        :param traceback: traceback of the raised exception.
+        """
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception as err:
+            logging.error(f"Failed to save arrays: {err}")
 
 
 def save_metric_dict(save_dir: str, metrics: list):
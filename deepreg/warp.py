@@ -7,12 +7,13 @@ Module to warp a image with given ddf. A CLI tool is provided.
 import argparse
 import logging
 import os
+from typing import Optional
 
 import nibabel as nib
 import numpy as np
 import tensorflow as tf
 
-from deepreg.dataset.loader.nifti_loader import load_nifti_file
+from deepreg.dataset.loader.nifti_loader import load_nifti_file, save_nifti_file
 from deepreg.model.layer import Warping
 
 
@@ -36,11 +37,22 @@ def shape_sanity_check(image: np.ndarray, ddf: np.ndarray):
         )
 
 
-def warp(image_path: str, ddf_path: str, out_path: str):
+def warp(
+    image_path: str,
+    ddf_path: str,
+    out_path: str,
+    interpolation: str = "linear",
+    compression_level: Optional[int] = None,
+):
     """
+    The warped image is defined on the ddf grid and is saved with the ddf's affine.
+
     :param image_path: file path of the image file
     :param ddf_path: file path of the ddf file
     :param out_path: file path of the output
+    :param interpolation: linear, nearest or cubic
+    :param compression_level: gzip level between 0 and 9 if out_path ends with .nii.gz,
+        nibabel's default level is used if None
     """
     if out_path == "":
         out_path = "warped.nii.gz"
@@ -67,12 +79,19 @@ def warp(image_path: str, ddf_path: str, out_path: str):
     ddf = tf.expand_dims(ddf, axis=0)
 
     # warp
-    warped_image = Warping(fixed_image_size=fixed_image_shape)([ddf, image])
+    warped_image = Warping(
+        fixed_image_size=fixed_image_shape, interpolation=interpolation
+    )([ddf, image])
     warped_image = warped_image.numpy()
     warped_image = warped_image[0, ...]  # removed added batch dimension
 
     # save output
-    nib.save(img=nib.Nifti1Image(warped_image, affine=np.eye(4)), filename=out_path)
+    save_nifti_file(
+        arr=warped_image,
+        file_path=out_path,
+        affine=nib.load(ddf_path).affine,
+        compression_level=compression_level,
+    )
 
 
 def main(args=None):
@@ -93,9 +112,31 @@ def main(args=None):
 
     parser.add_argument("--out", "-o", help="Output path for warped image", default="")
 
+    parser.add_argument(
+        "--interpolation",
+        help="Interpolation method, nearest is recommended for labels",
+        type=str,
+        choices=["linear", "nearest", "cubic"],
+        default="linear",
+    )
+
+    parser.add_argument(
+        "--compression_level",
+        help="Gzip compression level between 0 and 9 if the output is .nii.gz",
+        type=int,
+        choices=range(10),
+        default=None,
+    )
+
     # init arguments
     args = parser.parse_args(args)
-    warp(image_path=args.image, ddf_path=args.ddf, out_path=args.out)
+    warp(
+        image_path=args.image,
+        ddf_path=args.ddf,
+        out_path=args.out,
+        interpolation=args.interpolation,
+        compression_level=args.compression_level,
+    )
 
 
 if __name__ == "__main__":
@@ -46,6 +46,10 @@ setup(
             "deepreg_warp=deepreg.warp:main",
             "deepreg_vis=deepreg.vis:main",
             "deepreg_download=deepreg.download:main",
+            "deepreg_convert=deepreg.convert:main",
+            "deepreg_serve=deepreg.serve:main",
+            "deepreg_serve_load_test=deepreg.serve:load_test_main",
+            "deepreg_export=deepreg.export:main",
         ]
     },
     classifiers=[
@@ -107,6 +107,7 @@ class TestGlobalNet:
             decode_num_channels=[2, 4, 8],
             strides=2,
             padding="same",
+            recompute=False,
             name="Test",
         )
         network = GlobalNet(**config)
@@ -3,6 +3,7 @@
 """
 Tests for deepreg/model/backbone/u_net.py
 """
+from test.unit.util import is_equal_tf
 from typing import Tuple
 
 import pytest
@@ -127,8 +128,51 @@ class TestUNet:
             decode_num_channels=(2, 4, 8),
             strides=2,
             padding="same",
+            recompute=False,
             name="Test",
         )
         network = UNet(**config)
         got = network.get_config()
         assert got == config
+
+    @pytest.mark.parametrize("pooling", [True, False])
+    def test_recompute(self, pooling: bool):
+        """
+        Test the outputs and gradients are not changed by recomputation.
+
+        :param pooling: for down-sampling, use non-parameterized
+                        pooling if true, otherwise use conv3d
+        """
+        image_size = (8, 8, 8)
+        config = dict(
+            image_size=image_size,
+            out_channels=3,
+            num_channel_initial=2,
+            depth=2,
+            extract_levels=(0, 1),
+            out_kernel_initializer="he_normal",
+            out_activation=None,
+            pooling=pooling,
+        )
+        inputs = tf.random.normal(shape=(2, *image_size, 1))
+
+        results = []
+        weights = None
+        for recompute in [False, True]:
+            network = UNet(**config, recompute=recompute)
+            network(inputs)
+            if weights is None:
+                weights = network.get_weights()
+            else:
+                network.set_weights(weights)
+            with tf.GradientTape() as tape:
+                output = network(inputs, training=True)
+                loss = tf.reduce_sum(output ** 2)
+            grads = tape.gradient(loss, network.trainable_variables)
+            results.append((output, grads))
+
+        (expected_output, expected_grads), (got_output, got_grads) = results
+        assert is_equal_tf(got_output, expected_output)
+        assert len(got_grads) == len(expected_grads)
+        for got, expected in zip(got_grads, expected_grads):
+            assert is_equal_tf(got, expected, atol=1e-4)
@@ -1,26 +1,95 @@
+import os
 import shutil
+from test.unit.util import is_equal_np
+from typing import Optional
 
 import numpy as np
+import pytest
 import tensorflow as tf
 
-from deepreg.callback import build_checkpoint_callback
+from deepreg.callback import (
+    build_checkpoint_callback,
+    build_optimizer_variables,
+    restore_model,
+)
 
 
-def test_restore_checkpoint_manager_callback():
+class Net(tf.keras.Model):
+    """A simple linear model."""
+
+    def __init__(self):
+        super().__init__()
+        self.l1 = tf.keras.layers.Dense(5)
+
+    def __call__(self, x, training=False):
+        return self.l1(x)
+
+
+def build_net(
+    optimizer: Optional[tf.keras.optimizers.Optimizer] = None,
+) -> tf.keras.Model:
     """
-    testing restore CheckpointManagerCallback
+    Build a compiled toy model with weights.
+
+    :param optimizer: optimizer of the model, Adam by default
+    :return: the model
     """
+    if optimizer is None:
+        optimizer = tf.keras.optimizers.Adam(0.1)
+    model = Net()
+    model.compile(optimizer=optimizer, loss=tf.keras.losses.MSE)
+    model(tf.zeros((1, 1)))
+    return model
+
 
-    # toy model
-    class Net(tf.keras.Model):
-        """A simple linear model."""
+@pytest.mark.parametrize(
+    "optimizer",
+    [
+        tf.keras.optimizers.Adam,
+        # no build method, as all optimizers before tensorflow 2.11
+        getattr(tf.keras.optimizers, "legacy", tf.keras.optimizers).Adam,
+    ],
+)
+def test_build_optimizer_variables(optimizer):
+    """
+    The optimizer slots are created without changing the weights
+    nor taking a training step.
+    """
+    model = build_net(optimizer=optimizer(0.1))
+    weights = [var.numpy() for var in model.weights]
+    build_optimizer_variables(model=model)
+    # the iteration counter and two moments per variable
+    variables = model.optimizer.variables
+    if callable(variables):
+        # optimizers before tensorflow 2.11
+        variables = variables()
+    assert len(variables) == 1 + 2 * len(model.trainable_variables)
+    for expected, var in zip(weights, model.weights):
+        assert is_equal_np(var.numpy(), expected)
+    assert int(model.optimizer.iterations) == 0
 
-        def __init__(self):
-            super().__init__()
-            self.l1 = tf.keras.layers.Dense(5)
 
-        def __call__(self, x, training=False):
-            return self.l1(x)
+def test_restore_model(tmp_path):
+    """
+    The model weights are restored without optimizer variables.
+    """
+    model = build_net()
+    model.fit(x=tf.ones((4, 1)), y=tf.ones((4, 5)), epochs=1, batch_size=2, verbose=0)
+    ckpt_path = tf.train.Checkpoint(model=model, optimizer=model.optimizer).save(
+        os.path.join(tmp_path, "ckpt")
+    )
+    restored = Net()
+    restored(tf.zeros((1, 1)))
+    restore_model(model=restored, ckpt_path=ckpt_path)
+    assert len(model.weights) == len(restored.weights)
+    for expected, got in zip(model.weights, restored.weights):
+        assert is_equal_np(got.numpy(), expected.numpy())
+
+
+def test_restore_checkpoint_manager_callback():
+    """
+    testing restore CheckpointManagerCallback
+    """
 
     # toy dataset
     def toy_dataset():
@@ -38,9 +107,9 @@ def test_restore_checkpoint_manager_callback():
         old_model = Net()
         old_optimizer = tf.keras.optimizers.Adam(0.1)
     old_model.compile(optimizer=old_optimizer, loss=tf.keras.losses.MSE)
+    old_model(tf.zeros((1, 1)))  # build the weights
     old_callback, _ = build_checkpoint_callback(
         model=old_model,
-        dataset=toy_dataset(),
         log_dir="./test/unit/old",
         save_period=5,
         ckpt_path="",
@@ -54,9 +123,9 @@ def test_restore_checkpoint_manager_callback():
         new_model = Net()
         new_optimizer = tf.keras.optimizers.Adam(0.1)
     new_model.compile(optimizer=new_optimizer, loss=tf.keras.losses.MSE)
+    new_model(tf.zeros((1, 1)))  # build the weights
     new_callback, initial_epoch = build_checkpoint_callback(
         model=new_model,
-        dataset=toy_dataset(),
         log_dir="./test/unit/new",
         save_period=5,
         ckpt_path="./test/unit/old/save/ckpt-10",
@@ -0,0 +1,99 @@
+"""
+Tests for deepreg/convert.py
+"""
+import os
+from test.unit.util import is_equal_np
+
+import numpy as np
+import pytest
+import yaml
+
+from deepreg.convert import convert, main, validate_data
+from deepreg.dataset.load import get_data_loader
+from deepreg.dataset.loader.shard_loader import get_shard_file_paths
+
+
+@pytest.mark.parametrize("data_type", ["paired", "unpaired", "grouped"])
+def test_convert(tmp_path, data_type):
+    """
+    Check the data loader yields the same samples
+    from the shards as from the original files.
+    """
+    data_dir = f"./data/test/nifti/{data_type}/test"
+    out_dir = str(tmp_path)
+    main(
+        args=[
+            "--data_dir",
+            data_dir,
+            "--out_dir",
+            out_dir,
+            "--format",
+            "nifti",
+            "--type",
+            data_type,
+        ]
+    )
+
+    with open(f"config/test/{data_type}_nifti.yaml") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)["dataset"]
+    config["dir"]["valid"] = data_dir
+    expected_loader = get_data_loader(data_config=config, mode="valid")
+    config["dir"]["valid"] = out_dir
+    config["format"] = "shard"
+    loader = get_data_loader(data_config=config, mode="valid")
+    assert loader.validated
+    assert not expected_loader.validated
+
+    expected = list(expected_loader.get_dataset().as_numpy_iterator())
+    got = list(loader.get_dataset().as_numpy_iterator())
+    assert len(expected) == len(got)
+    for expected_sample, got_sample in zip(expected, got):
+        for key in expected_sample.keys():
+            assert is_equal_np(expected_sample[key], got_sample[key])
+    loader.close()
+    expected_loader.close()
+
+
+def test_convert_max_shard_size(tmp_path):
+    convert(
+        data_dir="./data/test/nifti/unpaired/test",
+        out_dir=str(tmp_path),
+        data_format="nifti",
+        data_type="unpaired",
+        max_shard_size=0,
+    )
+    # one image per shard
+    got = get_shard_file_paths(dir_path=str(tmp_path), name="images")
+    num_images = len(os.listdir("./data/test/nifti/unpaired/test/images"))
+    assert len(got) == num_images
+    assert os.path.basename(got[0]) == f"images-00000-of-{num_images:05d}.shard"
+
+
+def test_convert_err(tmp_path):
+    with pytest.raises(ValueError) as err_info:
+        convert(
+            data_dir="./data/test/nifti/unpaired/test",
+            out_dir=str(tmp_path),
+            data_format="nifti",
+            data_type="wrong",
+        )
+    assert "data type must be" in str(err_info.value)
+
+
+@pytest.mark.parametrize(
+    "shape,label,err_msg",
+    [
+        ((2, 3, 4, 1), False, "shape should be 3D"),
+        ((2, 3), True, "shape should be 3D or 4D"),
+    ],
+)
+def test_validate_data_err(shape, label, err_msg):
+    with pytest.raises(ValueError) as err_info:
+        validate_data(arr=np.zeros(shape), data_id=("a",), label=label)
+    assert err_msg in str(err_info.value)
+
+
+def test_validate_data_value_err():
+    with pytest.raises(ValueError) as err_info:
+        validate_data(arr=np.ones((2, 3, 4)) * 2, data_id=("a",), label=True)
+    assert "values are not between [0, 1]" in str(err_info.value)
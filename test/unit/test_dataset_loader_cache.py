@@ -0,0 +1,158 @@
+# coding=utf-8
+
+"""
+Tests for deepreg/dataset/loader/cache.py in pytest style
+"""
+
+import os
+from test.unit.util import is_equal_np
+
+import numpy as np
+import pytest
+
+from deepreg.dataset.loader.cache import VolumeCache
+from deepreg.dataset.loader.nifti_loader import NiftiFileLoader
+from deepreg.dataset.loader.paired_loader import PairedDataLoader
+from deepreg.dataset.loader.util import normalize_array
+
+
+class TestVolumeCache:
+    def test_init(self, tmp_path):
+        cache_dir = os.path.join(tmp_path, "cache")
+        cache = VolumeCache(cache_dir=cache_dir)
+        assert os.path.isdir(cache_dir)
+        assert cache.cache_dir == cache_dir
+
+    def test_save_load(self, tmp_path):
+        file_path = os.path.join(tmp_path, "data.npy")
+        np.save(file_path, np.zeros(3))
+        cache = VolumeCache(cache_dir=os.path.join(tmp_path, "cache"))
+        key = cache.get_key(
+            file_path=file_path, data_key="", shape=(2, 3, 4), normalize=True
+        )
+        assert cache.load(key=key) is None
+
+        arr = np.random.rand(2, 3, 4)
+        saved = cache.save(key=key, arr=arr)
+        got = cache.load(key=key)
+        assert isinstance(got, np.memmap)
+        assert got.dtype == np.float32
+        assert is_equal_np(got, arr)
+        assert is_equal_np(saved, arr)
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            dict(data_key="key"),
+            dict(shape=(2, 3, 5)),
+            dict(normalize=False),
+        ],
+    )
+    def test_get_key(self, tmp_path, kwargs):
+        file_path = os.path.join(tmp_path, "data.npy")
+        np.save(file_path, np.zeros(3))
+        args = dict(file_path=file_path, data_key="", shape=(2, 3, 4), normalize=True)
+        key = VolumeCache.get_key(**args)
+        assert key == VolumeCache.get_key(**args)
+        assert key != VolumeCache.get_key(**{**args, **kwargs})
+
+    def test_get_key_modified_file(self, tmp_path):
+        file_path = os.path.join(tmp_path, "data.npy")
+        np.save(file_path, np.zeros(3))
+        args = dict(file_path=file_path, data_key="", shape=(2, 3, 4), normalize=True)
+        key = VolumeCache.get_key(**args)
+        np.save(file_path, np.zeros(4))
+        os.utime(file_path, ns=(0, 0))
+        assert key != VolumeCache.get_key(**args)
+
+    def test_load_truncated(self, tmp_path):
+        cache = VolumeCache(cache_dir=str(tmp_path))
+        with open(cache.get_path(key="key"), "wb") as f:
+            f.write(b"\x93NUMPY")
+        assert cache.load(key="key") is None
+
+
+@pytest.mark.parametrize("labeled", [True, False])
+def test_data_loader_with_cache(tmp_path, labeled):
+    """
+    Check the data loaded with cache are resized and equal
+    to the data loaded without cache.
+    """
+    image_shape = (8, 9, 10)
+    config = dict(
+        file_loader=NiftiFileLoader,
+        data_dir_paths=["./data/test/nifti/paired/test"],
+        labeled=labeled,
+        sample_label="all",
+        seed=0,
+        moving_image_shape=image_shape,
+        fixed_image_shape=image_shape,
+    )
+    cache_dir = os.path.join(tmp_path, "cache")
+    loader = PairedDataLoader(**config, cache_dir=cache_dir)
+
+    moving_image = loader.load_data(
+        loader=loader.loader_moving_image,
+        index=0,
+        image_shape=image_shape,
+        normalize=True,
+    )
+    assert moving_image.shape == image_shape
+    assert len(os.listdir(cache_dir)) == 1
+    # second read comes from cache
+    assert is_equal_np(
+        moving_image,
+        loader.load_data(
+            loader=loader.loader_moving_image,
+            index=0,
+            image_shape=image_shape,
+            normalize=True,
+        ),
+    )
+    assert len(os.listdir(cache_dir)) == 1
+    assert 0 <= np.min(moving_image) and np.max(moving_image) <= 1
+
+    # the dataset provides static shapes
+    dataset = loader.get_dataset()
+    assert tuple(dataset.element_spec["moving_image"].shape) == image_shape
+
+    # same values as the pipeline without cache
+    loader_no_cache = PairedDataLoader(**config)
+    dataset_no_cache = loader_no_cache.get_dataset_and_preprocess(
+        training=False, batch_size=1, repeat=False, shuffle_buffer_num_batch=0
+    )
+    dataset_cache = loader.get_dataset_and_preprocess(
+        training=False, batch_size=1, repeat=False, shuffle_buffer_num_batch=0
+    )
+    for expected, got in zip(dataset_no_cache, dataset_cache):
+        for key in expected.keys():
+            assert is_equal_np(expected[key], got[key], atol=1e-5)
+    loader.close()
+    loader_no_cache.close()
+
+
+def test_normalize_before_resize(tmp_path):
+    """Cached images are normalized before being resized."""
+    loader = NiftiFileLoader(
+        dir_paths=["./data/test/nifti/paired/test"],
+        name="fixed_images",
+        grouped=False,
+    )
+    data_loader = PairedDataLoader(
+        file_loader=NiftiFileLoader,
+        data_dir_paths=["./data/test/nifti/paired/test"],
+        labeled=False,
+        sample_label="all",
+        seed=0,
+        moving_image_shape=(4, 4, 4),
+        fixed_image_shape=(4, 4, 4),
+        cache_dir=str(tmp_path),
+    )
+    image_shape = loader.get_data(index=0).shape
+    got = data_loader.load_data(
+        loader=loader, index=0, image_shape=image_shape, normalize=True
+    )
+    expected = normalize_array(loader.get_data(index=0))
+    assert is_equal_np(got, expected)
+    loader.close()
+    data_loader.close()
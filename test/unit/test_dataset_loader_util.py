@@ -10,6 +10,7 @@ import numpy as np
 import pytest
 
 import deepreg.dataset.loader.util as util
+from deepreg.model.layer import Resize3d
 
 
 class TestNormalizeArray:
@@ -48,6 +49,48 @@ class TestNormalizeArray:
         assert is_equal_np(got, expected)
 
 
+class TestResizeAffine:
+    def test_same_shape(self):
+        affine = np.random.rand(4, 4)
+        got = util.resize_affine(affine=affine, shape=(4, 5, 6), new_shape=(4, 5, 6))
+        assert is_equal_np(got, affine)
+
+    def test_voxel_centers(self):
+        shape, new_shape = (4, 6, 9), (8, 3, 9)
+        affine = np.diag([2.0, 3.0, 4.0, 1.0])
+        affine[:3, 3] = [1.0, -2.0, 3.0]
+        got = util.resize_affine(affine=affine, shape=shape, new_shape=new_shape)
+        # the first and last new voxels are centered inside the original volume
+        # at the same distance from the borders
+        for new_voxel in [np.zeros(3), np.asarray(new_shape) - 1]:
+            scale = np.asarray(shape) / np.asarray(new_shape)
+            voxel = (new_voxel + 0.5) * scale - 0.5
+            expected = affine @ np.append(voxel, 1)
+            assert is_equal_np(got @ np.append(new_voxel, 1), expected)
+
+
+@pytest.mark.parametrize(
+    "shape,new_shape",
+    [
+        [(4, 5, 6), (4, 5, 6)],
+        [(4, 5, 6), (8, 3, 6)],
+        [(9, 2, 7), (4, 5, 13)],
+        [(4, 5, 6, 2), (3, 7, 6)],
+    ],
+)
+def test_resize_array(shape: tuple, new_shape: tuple):
+    arr = np.random.rand(*shape).astype(np.float32)
+    got = util.resize_array(arr=arr, shape=new_shape)
+    # same as Resize3d, channels being resized together
+    resize_layer = Resize3d(shape=new_shape)
+    if len(shape) == 4:
+        expected = resize_layer(arr[None, ...])[0, ...]
+    else:
+        expected = resize_layer(arr)
+    assert got.dtype == np.float32
+    assert is_equal_np(got, expected, atol=1e-5)
+
+
 def test_remove_prefix_suffix():
     """
     Test remove_prefix_suffix by verifying outputs
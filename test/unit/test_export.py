@@ -0,0 +1,155 @@
+# coding=utf-8
+
+"""
+Tests for deepreg/export.py
+"""
+import json
+import os
+import subprocess
+import sys
+from test.unit.util import (
+    build_registration_model,
+    get_registration_config,
+    is_equal_np,
+)
+from typing import Dict
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from deepreg.export import (
+    FROZEN_GRAPH_FILENAME,
+    SIGNATURE_FILENAME,
+    build_inference_function,
+    export_saved_model,
+)
+from deepreg.model.network import build_model_from_config
+
+image_shape = (8, 8, 8)
+config = get_registration_config(image_shape=image_shape)
+batch_size = 2
+
+
+@pytest.fixture(scope="module")
+def model() -> tf.keras.Model:
+    return build_registration_model(image_shape=image_shape, batch_size=batch_size)
+
+
+@pytest.fixture(scope="module")
+def inputs() -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    return {
+        key: rng.random((batch_size,) + image_shape, dtype=np.float32)
+        for key in ["moving_image", "fixed_image", "moving_label", "fixed_label"]
+    }
+
+
+@pytest.mark.parametrize(
+    "with_warping,with_label,expected_inputs,expected_outputs",
+    [
+        (True, False, ["fixed_image", "moving_image"], ["ddf", "pred_fixed_image"]),
+        (False, False, ["fixed_image", "moving_image"], ["ddf"]),
+        (
+            True,
+            True,
+            ["fixed_image", "fixed_label", "moving_image", "moving_label"],
+            ["ddf", "pred_fixed_image", "pred_fixed_label"],
+        ),
+    ],
+)
+def test_build_inference_function(
+    model,
+    inputs,
+    with_warping: bool,
+    with_label: bool,
+    expected_inputs: list,
+    expected_outputs: list,
+):
+    function = build_inference_function(
+        model=model, with_warping=with_warping, with_label=with_label
+    )
+    specs = function.structured_input_signature[0]
+    assert sorted(spec.name for spec in specs) == expected_inputs
+    for spec in specs:
+        assert spec.shape == (batch_size,) + image_shape
+
+    got = function(**{key: tf.constant(inputs[key]) for key in expected_inputs})
+    assert sorted(got.keys()) == expected_outputs
+
+    # same as predicting with the model, with zero labels if not given
+    model_inputs = dict(inputs)
+    if not with_label:
+        model_inputs["moving_label"] = np.zeros_like(inputs["moving_image"])
+        model_inputs["fixed_label"] = np.zeros_like(inputs["fixed_image"])
+    model_inputs["indices"] = np.zeros((batch_size, 3), dtype=np.float32)
+    expected = model(model_inputs, training=False)
+    for key, value in got.items():
+        assert is_equal_np(value, expected[key], atol=1e-5)
+
+
+def test_build_inference_function_err():
+    conditional_config = dict(
+        dataset=config["dataset"], train=dict(config["train"], method="conditional")
+    )
+    conditional_config["train"]["backbone"] = dict(
+        name="unet", num_channel_initial=4, depth=2
+    )
+    conditional_config["train"]["loss"] = dict(label=dict(name="dice", weight=1.0))
+    model = build_model_from_config(config=conditional_config, batch_size=1)
+    with pytest.raises(ValueError) as err_info:
+        build_inference_function(model=model, with_label=False)
+    assert "Conditional models require the labels" in str(err_info.value)
+    got = build_inference_function(model=model, with_label=True)
+    assert list(got.structured_outputs.keys()) == ["pred_fixed_label"]
+
+
+class TestExportSavedModel:
+    @pytest.fixture(scope="class")
+    def out_dir(self, model, tmp_path_factory) -> str:
+        out_dir = str(tmp_path_factory.mktemp("export"))
+        export_saved_model(model=model, out_dir=out_dir, frozen_graph=True)
+        return out_dir
+
+    def test_signature(self, out_dir):
+        with open(os.path.join(out_dir, SIGNATURE_FILENAME)) as file:
+            got = json.load(file)
+        shape = [batch_size, *image_shape]
+        assert got["inputs"] == dict(moving_image=shape, fixed_image=shape)
+        assert got["outputs"] == dict(ddf=shape + [3], pred_fixed_image=shape)
+        assert sorted(got["frozen_graph"]["outputs"].keys()) == [
+            "ddf",
+            "pred_fixed_image",
+        ]
+        assert os.path.exists(os.path.join(out_dir, FROZEN_GRAPH_FILENAME))
+
+    def test_load(self, model, inputs, out_dir):
+        loaded = tf.saved_model.load(out_dir)
+        function = loaded.signatures["serving_default"]
+        got = function(
+            moving_image=tf.constant(inputs["moving_image"]),
+            fixed_image=tf.constant(inputs["fixed_image"]),
+        )
+        expected = build_inference_function(model=model)(
+            moving_image=tf.constant(inputs["moving_image"]),
+            fixed_image=tf.constant(inputs["fixed_image"]),
+        )
+        assert sorted(got.keys()) == ["ddf", "pred_fixed_image"]
+        for key, value in expected.items():
+            assert is_equal_np(got[key], value, atol=1e-5)
+        # the optimizer is not exported
+        assert all("optimizer" not in x.name for x in loaded.variables_to_save)
+
+    def test_load_without_deepreg(self, out_dir):
+        script = (
+            "import sys\n"
+            "import tensorflow as tf\n"
+            f"loaded = tf.saved_model.load({out_dir!r})\n"
+            "function = loaded.signatures['serving_default']\n"
+            f"image = tf.zeros({(batch_size,) + image_shape})\n"
+            "got = function(moving_image=image, fixed_image=image)\n"
+            "assert 'ddf' in got\n"
+            "assert not any(x.startswith('deepreg') for x in sys.modules)\n"
+        )
+        # run in a clean directory so that deepreg is not importable
+        subprocess.run([sys.executable, "-c", script], cwd=out_dir, check=True)
@@ -170,6 +170,27 @@ class TestH5FileLoader:
         assert is_equal_np(got[1], expected[1])
         loader.close()
 
+    @pytest.mark.parametrize(
+        "name,index,expected",
+        [
+            (
+                "paired",
+                0,
+                ("./data/test/h5/paired/test/fixed_images.h5", "case000025.nii.gz"),
+            ),
+            (
+                "grouped",
+                (0, 1),
+                ("./data/test/h5/grouped/test/images.h5", "group-1-2"),
+            ),
+        ],
+    )
+    def test_get_data_source(self, name, index, expected):
+        loader = get_loader(name)
+        got = loader.get_data_source(index)
+        assert got == expected
+        loader.close()
+
     @pytest.mark.parametrize(
         "name,expected",
         [
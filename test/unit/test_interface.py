@@ -3,11 +3,14 @@
 """
 Tests for deepreg/dataset/loader/interface.py
 """
+import time
 from test.unit.util import is_equal_np
 
 import numpy as np
 import pytest
+import yaml
 
+from deepreg.dataset.load import get_data_loader
 from deepreg.dataset.loader.interface import (
     AbstractPairedDataLoader,
     AbstractUnpairedDataLoader,
@@ -17,7 +20,7 @@ from deepreg.dataset.loader.interface import (
 )
 from deepreg.dataset.loader.nifti_loader import NiftiFileLoader
 from deepreg.dataset.loader.paired_loader import PairedDataLoader
-from deepreg.dataset.loader.util import normalize_array
+from deepreg.dataset.loader.util import normalize_array, resize_affine
 
 
 class TestDataLoader:
@@ -94,6 +97,23 @@ class TestDataLoader:
                     ],
                 },
             ),
+            (
+                True,
+                (9, 9, 9),
+                (15, 15, 15),
+                2,
+                {
+                    "data_augmentation": [
+                        {"name": "affine"},
+                        {
+                            "name": "ddf",
+                            "field_strength": 1,
+                            "low_res_size": (3, 3, 3),
+                        },
+                    ],
+                    "fuse_data_augmentation": True,
+                },
+            ),
         ],
     )
     def test_get_dataset_and_preprocess(
@@ -154,6 +174,44 @@ class TestDataLoader:
                 == (batch_size,) + data_loader.fixed_image_shape
             )
 
+    def test_get_dataset_and_preprocess_seeded_augmentation(self):
+        """
+        Check augmented data are reproducible given the seed
+        and different from one batch to another.
+        """
+        data_augmentation = [
+            {"name": "affine"},
+            {"name": "ddf", "field_strength": 1, "low_res_size": (3, 3, 3)},
+        ]
+
+        def get_outputs():
+            data_loader = PairedDataLoader(
+                data_dir_paths=["data/test/nifti/paired/test"],
+                fixed_image_shape=(9, 9, 9),
+                moving_image_shape=(9, 9, 9),
+                file_loader=NiftiFileLoader,
+                labeled=True,
+                sample_label="all",
+                seed=0,
+            )
+            dataset = data_loader.get_dataset_and_preprocess(
+                training=True,
+                batch_size=1,
+                repeat=True,
+                shuffle_buffer_num_batch=0,
+                data_augmentation=data_augmentation,
+            )
+            outputs = [x["moving_image"].numpy() for x in dataset.take(3)]
+            data_loader.close()
+            return outputs
+
+        got = get_outputs()
+        expected = get_outputs()
+        for x, y in zip(got, expected):
+            assert is_equal_np(x, y)
+        # the same image is repeated with different augmentations
+        assert not is_equal_np(got[0], got[-1])
+
 
 def test_abstract_paired_data_loader():
     """
@@ -187,6 +245,10 @@ def test_abstract_paired_data_loader():
     assert data_loader.moving_image_shape == moving_image_shape
     assert data_loader.fixed_image_shape == fixed_image_shape
     assert data_loader.num_samples is None
+    assert all(
+        is_equal_np(affine, np.eye(4))
+        for affine in data_loader.get_affines(image_indices=[0])
+    )
 
 
 def test_abstract_unpaired_data_loader():
@@ -459,6 +521,134 @@ def test_generator_data_loader(caplog):
         assert all(is_equal_np(got_iter[key], expected[key]) for key in expected.keys())
 
 
+@pytest.mark.parametrize("data_type", ["paired", "unpaired", "grouped"])
+@pytest.mark.parametrize("deterministic", [True, False])
+def test_generator_data_loader_num_workers(data_type, deterministic):
+    """
+    Check loading samples in parallel yields the same samples
+    as the sequential loading, in the same order if deterministic.
+    """
+    with open(f"config/test/{data_type}_nifti.yaml") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)["dataset"]
+
+    def get_samples(num_workers: int) -> list:
+        data_loader = get_data_loader(
+            data_config=dict(
+                **config, num_workers=num_workers, deterministic=deterministic
+            ),
+            mode="valid",
+        )
+        samples = list(data_loader.get_dataset().as_numpy_iterator())
+        data_loader.close()
+        return samples
+
+    expected = get_samples(num_workers=1)
+    got = get_samples(num_workers=3)
+    expected_indices = [tuple(sample["indices"]) for sample in expected]
+    got_indices = [tuple(sample["indices"]) for sample in got]
+    assert len(set(expected_indices)) == len(expected_indices)
+    if deterministic:
+        assert got_indices == expected_indices
+    else:
+        assert sorted(got_indices) == sorted(expected_indices)
+    got_samples = dict(zip(got_indices, got))
+    for indices, sample in zip(expected_indices, expected):
+        for key in sample.keys():
+            assert is_equal_np(sample[key], got_samples[indices][key])
+
+
+def test_generator_data_loader_num_workers_throughput():
+    """
+    Check the samples per second rise with num_workers,
+    the file reads being slowed down to simulate the storage latency.
+    """
+    with open("config/test/unpaired_nifti.yaml") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)["dataset"]
+    latency = 0.1
+
+    def get_throughput(num_workers: int) -> float:
+        data_loader = get_data_loader(
+            data_config=dict(**config, num_workers=num_workers), mode="train"
+        )
+        for loader in [
+            data_loader.loader_moving_image,
+            data_loader.loader_fixed_image,
+            data_loader.loader_moving_label,
+            data_loader.loader_fixed_label,
+        ]:
+
+            def get_data(index, get_data_fn=loader.get_data):
+                time.sleep(latency)
+                return get_data_fn(index)
+
+            loader.get_data = get_data
+        start = time.perf_counter()
+        num_samples = len(list(data_loader.get_dataset().as_numpy_iterator()))
+        throughput = num_samples / (time.perf_counter() - start)
+        data_loader.close()
+        return throughput
+
+    throughputs = [get_throughput(num_workers=n) for n in [1, 2, 4]]
+    assert throughputs[1] > throughputs[0]
+    assert throughputs[2] > 1.5 * throughputs[0]
+
+
+@pytest.mark.parametrize("data_type", ["paired", "unpaired", "grouped"])
+def test_generator_data_loader_get_affines(data_type):
+    """
+    Check the affines of the files are updated for the resize,
+    unless resize is False.
+    """
+    with open(f"config/test/{data_type}_nifti.yaml") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)["dataset"]
+    data_loader = get_data_loader(data_config=config, mode="valid")
+    for sample in data_loader.get_dataset().as_numpy_iterator():
+        image_indices = sample["indices"][:-1].astype(int).tolist()
+        if data_type == "paired":
+            moving_index = fixed_index = image_indices[0]
+        elif data_type == "unpaired":
+            moving_index, fixed_index = image_indices
+        else:
+            moving_index, fixed_index = tuple(image_indices[:2]), tuple(
+                image_indices[2:]
+            )
+        got = data_loader.get_affines(image_indices=image_indices)
+        got_original = data_loader.get_affines(
+            image_indices=image_indices, resize=False
+        )
+        for affine, original_affine, loader, index, image_shape in [
+            (
+                got[0],
+                got_original[0],
+                data_loader.loader_moving_image,
+                moving_index,
+                data_loader.moving_image_shape,
+            ),
+            (
+                got[1],
+                got_original[1],
+                data_loader.loader_fixed_image,
+                fixed_index,
+                data_loader.fixed_image_shape,
+            ),
+        ]:
+            file_affine, shape = loader.get_affine(index)
+            expected = resize_affine(
+                affine=file_affine, shape=shape, new_shape=image_shape
+            )
+            assert is_equal_np(affine, expected)
+            assert is_equal_np(original_affine, file_affine)
+    data_loader.close()
+
+
+def test_generator_data_loader_num_workers_err():
+    with pytest.raises(AssertionError) as err_info:
+        GeneratorDataLoader(
+            labeled=True, num_indices=1, sample_label="all", num_workers=0
+        )
+    assert "num_workers must be int >= 1" in str(err_info.value)
+
+
 def test_file_loader():
     """
     Test the functions in FileLoader
@@ -493,6 +683,7 @@ def test_file_loader():
         loader_grouped.get_num_images()
     with pytest.raises(NotImplementedError):
         loader_grouped.close()
+    assert loader_grouped.get_affine(1) is None
 
     # test grouped file loader functions
     assert loader_grouped.group_struct is None
@@ -4,6 +4,8 @@
 Tests for deepreg/model/layer
 """
 
+from test.unit.util import is_equal_tf
+
 import numpy as np
 import pytest
 import tensorflow as tf
@@ -64,11 +66,24 @@ class TestWarping:
         outputs = layer.Warping(fixed_image_size=fixed_image_size)([ddf, image])
         assert outputs.shape == (batch_size, *fixed_image_size)
 
+    @pytest.mark.parametrize("interpolation", ["linear", "nearest", "cubic"])
+    def test_interpolation(self, interpolation):
+        """Check the warped image with a zero ddf equals the image."""
+        image = tf.random.uniform(shape=(2, 3, 4, 5))
+        ddf = tf.zeros(shape=(2, 3, 4, 5, 3))
+        warping = layer.Warping(fixed_image_size=(3, 4, 5), interpolation=interpolation)
+        outputs = warping([ddf, image])
+        if interpolation == "linear":
+            # the linear resample is zero on the lower boundary
+            outputs, image = outputs[:, 1:, 1:, 1:], image[:, 1:, 1:, 1:]
+        assert is_equal_tf(outputs, image, atol=1e-5)
+
     def test_get_config(self):
         warping = layer.Warping(fixed_image_size=(2, 3, 4))
         config = warping.get_config()
         assert config == dict(
             fixed_image_size=(2, 3, 4),
+            interpolation="linear",
             name="warping",
             trainable=True,
             dtype="float32",
@@ -137,14 +152,101 @@ class TestIntDVF:
         assert config == dict(
             fixed_image_size=fixed_image_size,
             num_steps=7,
+            sampling_dtype="float32",
+            recompute=False,
             name="int_dvf",
             trainable=True,
             dtype="float32",
         )
 
+    def test_squaring(self):
+        """
+        Compare with the integration using the warping layer.
+        """
+        fixed_image_size = (8, 9, 10)
+        num_steps = 4
+        dvf = tf.random.normal(shape=(2, *fixed_image_size, 3))
+
+        warping = layer.Warping(fixed_image_size=fixed_image_size)
+        expected = dvf / (2**num_steps)
+        for _ in range(num_steps):
+            expected += warping(inputs=[expected, expected])
+
+        got = layer.IntDVF(fixed_image_size=fixed_image_size, num_steps=num_steps)(dvf)
+        assert is_equal_tf(got, expected, atol=1e-5)
+
+    @pytest.mark.parametrize("sampling_dtype", ["float16", "bfloat16"])
+    def test_sampling_dtype(self, sampling_dtype):
+        fixed_image_size = (8, 9, 10)
+        dvf = tf.random.normal(shape=(2, *fixed_image_size, 3))
+        expected = layer.IntDVF(fixed_image_size=fixed_image_size)(dvf)
+        got = layer.IntDVF(
+            fixed_image_size=fixed_image_size, sampling_dtype=sampling_dtype
+        )(dvf)
+        assert got.dtype == tf.float32
+        assert is_equal_tf(got, expected, atol=5e-2)
+
+    @pytest.mark.parametrize("sampling_dtype", ["float16", "bfloat16"])
+    def test_sampling_dtype_intermediates(self, sampling_dtype):
+        """
+        Check the corner values of all steps and their weighted sums
+        are calculated in sampling_dtype.
+        """
+        fixed_image_size = (4, 5, 6)
+        int_dvf = layer.IntDVF(
+            fixed_image_size=fixed_image_size,
+            num_steps=3,
+            sampling_dtype=sampling_dtype,
+        )
+        graph = (
+            tf.function(int_dvf)
+            .get_concrete_function(tf.TensorSpec(shape=(2, *fixed_image_size, 3)))
+            .graph
+        )
+        # tensors of the 8 corners, shape = (batch, *fixed_image_size, 8, 3)
+        corner_tensors = [
+            output
+            for op in graph.get_operations()
+            for output in op.outputs
+            if output.shape == (2, *fixed_image_size, 8, 3)
+        ]
+        assert len(corner_tensors) >= 3 * 2  # gathered and weighted per step
+        assert all(x.dtype == sampling_dtype for x in corner_tensors)
+        # the DDF is only cast to float32 for the positions and at the end
+        casts = [op for op in graph.get_operations() if op.type == "Cast"]
+        ddf_casts = [
+            op for op in casts if op.outputs[0].shape == (2, *fixed_image_size, 3)
+        ]
+        assert [op.outputs[0].dtype for op in ddf_casts].count(tf.float32) == 3 + 1
+
+    @pytest.mark.parametrize("num_steps", [1, 7, 10])
+    def test_recompute(self, num_steps: int):
+        """
+        Check the outputs and gradients are the same with recomputation,
+        for segments of equal or different numbers of steps.
+        """
+        fixed_image_size = (8, 9, 10)
+        dvf = tf.random.normal(shape=(2, *fixed_image_size, 3))
+
+        grads = []
+        for recompute in [False, True]:
+            int_layer = layer.IntDVF(
+                fixed_image_size=fixed_image_size,
+                num_steps=num_steps,
+                recompute=recompute,
+            )
+            with tf.GradientTape() as tape:
+                tape.watch(dvf)
+                loss = tf.reduce_sum(int_layer(dvf) ** 2)
+            grads.append(tape.gradient(loss, dvf))
+        assert is_equal_tf(grads[0], grads[1], atol=1e-5)
+
     def test_err(self):
         with pytest.raises(AssertionError):
             layer.IntDVF(fixed_image_size=(2, 3))
+        with pytest.raises(AssertionError) as err_info:
+            layer.IntDVF(fixed_image_size=(2, 3, 4), sampling_dtype="int32")
+        assert "sampling_dtype must be" in str(err_info.value)
 
 
 class TestResizeCPTransform:
@@ -215,9 +317,9 @@ class TestBSplines3DTransform:
 
         b = {
             0: lambda u: np.float64((1 - u) ** 3 / 6),
-            1: lambda u: np.float64((3 * (u ** 3) - 6 * (u ** 2) + 4) / 6),
-            2: lambda u: np.float64((-3 * (u ** 3) + 3 * (u ** 2) + 3 * u + 1) / 6),
-            3: lambda u: np.float64(u ** 3 / 6),
+            1: lambda u: np.float64((3 * (u**3) - 6 * (u**2) + 4) / 6),
+            2: lambda u: np.float64((-3 * (u**3) + 3 * (u**2) + 3 * u + 1) / 6),
+            3: lambda u: np.float64(u**3 / 6),
         }
 
         filters = np.zeros(
@@ -321,6 +423,11 @@ class TestResize3d:
         outputs = layer.Resize3d(shape=resize_shape)(inputs)
         assert outputs.shape == output_shape
 
+    def test_half_precision(self):
+        resize = layer.Resize3d(shape=(4, 5, 6))
+        outputs = resize.call(tf.ones(shape=(2, 2, 3, 4, 1), dtype=tf.float16))
+        assert outputs.dtype == tf.float16
+
     def test_get_config(self):
         resize = layer.Resize3d(shape=(2, 3, 4))
         config = resize.get_config()
@@ -2,12 +2,13 @@
 Tests for deepreg/model/layer_util.py in
 pytest style
 """
-from test.unit.util import is_equal_tf
+from test.unit.util import is_equal_np, is_equal_tf
 from typing import Tuple, Union
 
 import numpy as np
 import pytest
 import tensorflow as tf
+from scipy.ndimage import map_coordinates
 
 import deepreg.model.layer_util as layer_util
 
@@ -173,6 +174,51 @@ class TestLinearResample:
         got = layer_util.resample(vol=vol, loc=self.loc, zero_boundary=True)
         assert is_equal_tf(expected, got)
 
+    @pytest.mark.parametrize("channel", [0, 2])
+    def test_3d_extrapolation(self, channel):
+        """Compare with scipy, values outside the volume repeat the boundary."""
+        vol_shape = (4, 5, 6)
+        vol = np.random.rand(2, *vol_shape, max(channel, 1)).astype(np.float32)
+        # locations inside and outside of the volume
+        loc = np.random.uniform(-1, 7, size=(2, 3, 4, 5, 3)).astype(np.float32)
+        expected = np.stack(
+            [
+                np.stack(
+                    [
+                        map_coordinates(
+                            vol[b, ..., c],
+                            np.moveaxis(loc[b], -1, 0),
+                            order=1,
+                            mode="nearest",
+                        )
+                        for c in range(vol.shape[-1])
+                    ],
+                    axis=-1,
+                )
+                for b in range(vol.shape[0])
+            ]
+        )
+        if channel == 0:
+            vol, expected = vol[..., 0], expected[..., 0]
+
+        got = layer_util.resample(
+            vol=tf.constant(vol), loc=tf.constant(loc), zero_boundary=False
+        )
+        assert is_equal_tf(got, expected, atol=1e-5)
+
+    def test_unknown_batch_size(self):
+        """Check resample works in graph mode with unknown batch size."""
+        vol = tf.random.uniform((2, 4, 5, 6))
+        loc = tf.random.uniform((2, 3, 4, 5, 3)) * 4
+        fn = tf.function(
+            layer_util.resample,
+            input_signature=[
+                tf.TensorSpec(shape=(None, 4, 5, 6), dtype=tf.float32),
+                tf.TensorSpec(shape=(None, 3, 4, 5, 3), dtype=tf.float32),
+            ],
+        )
+        assert is_equal_tf(fn(vol, loc), layer_util.resample(vol=vol, loc=loc))
+
     def test_shape_error(self):
         vol = tf.constant(np.array([[0]], dtype=np.float32))  # shape = [1,1]
         loc = tf.constant(np.array([[0, 0], [0, 0]], dtype=np.float32))  # shape = [2,2]
@@ -181,12 +227,155 @@ class TestLinearResample:
         assert "vol shape inconsistent with loc" in str(err_info.value)
 
     def test_interpolation_error(self):
-        interpolation = "nearest"
+        interpolation = "quadratic"
         vol = tf.constant(np.array([[0]], dtype=np.float32))  # shape = [1,1]
         loc = tf.constant(np.array([[0, 0], [0, 0]], dtype=np.float32))  # shape = [2,2]
         with pytest.raises(ValueError) as err_info:
             layer_util.resample(vol=vol, loc=loc, interpolation=interpolation)
-        assert "resample supports only linear interpolation" in str(err_info.value)
+        assert "resample supports only linear, nearest or cubic interpolation" in str(
+            err_info.value
+        )
+
+
+class TestNearestCubicResample:
+    """Compare nearest and cubic resample with scipy."""
+
+    vol_shape = (4, 5, 6)
+
+    @staticmethod
+    def map_coordinates(vol: np.ndarray, loc: np.ndarray, **kwargs) -> np.ndarray:
+        """
+        Apply scipy map_coordinates on each sample and channel.
+
+        :param vol: shape = (batch, dim1, dim2, dim3, ch)
+        :param loc: shape = (batch, l_dim1, l_dim2, l_dim3, 3)
+        :param kwargs: arguments for map_coordinates
+        :return: shape = (batch, l_dim1, l_dim2, l_dim3, ch)
+        """
+        return np.stack(
+            [
+                np.stack(
+                    [
+                        map_coordinates(
+                            vol[b, ..., c], np.moveaxis(loc[b], -1, 0), **kwargs
+                        )
+                        for c in range(vol.shape[-1])
+                    ],
+                    axis=-1,
+                )
+                for b in range(vol.shape[0])
+            ]
+        )
+
+    @pytest.mark.parametrize("channel", [0, 2])
+    @pytest.mark.parametrize("zero_boundary", [True, False])
+    def test_nearest(self, channel: int, zero_boundary: bool):
+        vol = np.random.rand(2, *self.vol_shape, max(channel, 1)).astype(np.float32)
+        # avoid locations at the middle between two voxels
+        loc = np.random.randint(-2, 8, size=(2, 3, 4, 5, 3))
+        loc = (loc + np.random.uniform(-0.4, 0.4, size=loc.shape)).astype(np.float32)
+        expected = self.map_coordinates(vol, loc, order=0, mode="nearest")
+        if zero_boundary:
+            # zeros if the nearest voxel is outside of the volume
+            loc_round = np.round(loc)
+            inside = np.all(
+                (loc_round >= 0) & (loc_round <= np.array(self.vol_shape) - 1), axis=-1
+            )
+            expected = expected * inside[..., None]
+        if channel == 0:
+            vol, expected = vol[..., 0], expected[..., 0]
+
+        got = layer_util.resample(
+            vol=tf.constant(vol),
+            loc=tf.constant(loc),
+            interpolation="nearest",
+            zero_boundary=zero_boundary,
+        )
+        assert is_equal_tf(got, expected)
+
+    @pytest.mark.parametrize("channel", [0, 2])
+    def test_cubic(self, channel: int):
+        vol = np.random.rand(2, *self.vol_shape, max(channel, 1)).astype(np.float32)
+        # locations inside the volume
+        loc = np.random.uniform(0, 3, size=(2, 3, 4, 5, 3)).astype(np.float32)
+        expected = self.map_coordinates(vol, loc, order=3, mode="mirror")
+        if channel == 0:
+            vol, expected = vol[..., 0], expected[..., 0]
+
+        for zero_boundary in [True, False]:
+            got = layer_util.resample(
+                vol=tf.constant(vol),
+                loc=tf.constant(loc),
+                interpolation="cubic",
+                zero_boundary=zero_boundary,
+            )
+            assert is_equal_tf(got, expected, atol=1e-5)
+
+    def test_cubic_mirror(self):
+        vol = np.random.rand(2, *self.vol_shape, 1).astype(np.float32)
+        # locations inside and outside of the volume
+        loc = np.random.uniform(-7, 12, size=(2, 3, 4, 5, 3)).astype(np.float32)
+        expected = self.map_coordinates(vol, loc, order=3, mode="mirror")
+        got = layer_util.resample(
+            vol=tf.constant(vol),
+            loc=tf.constant(loc),
+            interpolation="cubic",
+            zero_boundary=False,
+        )
+        assert is_equal_tf(got, expected, atol=1e-5)
+
+    def test_cubic_boundary(self):
+        vol = np.random.rand(1, *self.vol_shape).astype(np.float32)
+        # the values on the grid are interpolated exactly
+        grid = layer_util.get_reference_grid(self.vol_shape)[None, ...]
+        got = layer_util.resample(
+            vol=tf.constant(vol), loc=grid, interpolation="cubic", zero_boundary=False
+        )
+        assert is_equal_tf(got, vol, atol=1e-5)
+
+        # values outside of the volume are zeros or mirrored
+        loc = tf.constant([[[-1.0, 0.0, 0.0], [4.0, 0.0, 0.0]]])
+        got = layer_util.resample(
+            vol=tf.constant(vol), loc=loc, interpolation="cubic", zero_boundary=True
+        )
+        assert is_equal_tf(got, tf.zeros((1, 2)))
+        got = layer_util.resample(
+            vol=tf.constant(vol), loc=loc, interpolation="cubic", zero_boundary=False
+        )
+        assert is_equal_tf(got, vol[:, [1, 2], 0, 0], atol=1e-5)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 17])
+@pytest.mark.parametrize("axis", [0, 1])
+def test_get_bspline_coefficients(size: int, axis: int):
+    """Check the B-spline of the coefficients interpolates the samples."""
+    samples = np.random.rand(size, 3) if axis == 0 else np.random.rand(3, size)
+    coeff = layer_util.get_bspline_coefficients(tf.constant(samples), axis=axis)
+    assert coeff.shape == samples.shape
+    coeff = np.moveaxis(coeff.numpy(), axis, 0)
+    if size == 1:
+        got = coeff
+    else:
+        padded = np.pad(coeff, ((1, 1), (0, 0)), mode="reflect")  # mirror boundary
+        got = (padded[:-2] + 4 * padded[1:-1] + padded[2:]) / 6
+    assert is_equal_np(got, np.moveaxis(samples, axis, 0))
+
+
+@pytest.mark.parametrize("interpolation", ["linear", "nearest", "cubic"])
+def test_resample_half_precision(interpolation: str):
+    """
+    Check a float16 volume is sampled with float32 weights.
+
+    :param interpolation: linear, nearest or cubic
+    """
+    vol = tf.random.uniform((2, 4, 5, 6, 2))
+    loc = tf.random.uniform((2, 3, 4, 5, 3)) * 4
+    expected = layer_util.resample(vol=vol, loc=loc, interpolation=interpolation)
+    got = layer_util.resample(
+        vol=tf.cast(vol, tf.float16), loc=loc, interpolation=interpolation
+    )
+    assert got.dtype == tf.float16
+    assert is_equal_tf(tf.cast(got, tf.float32), expected, atol=1e-2)
 
 
 class TestWarpGrid:
@@ -5,6 +5,7 @@ Tests for deepreg/model/loss/deform.py in pytest style
 """
 from test.unit.util import is_equal_tf
 
+import numpy as np
 import pytest
 import tensorflow as tf
 
@@ -64,6 +65,26 @@ class TestGradientNorm:
         expected = 0
         assert is_equal_tf(got, expected)
 
+    @pytest.mark.parametrize("l1", [True, False])
+    def test_finite_difference(self, l1):
+        """Compare with the gradients calculated by slicing."""
+        tensor = tf.random.uniform([2, 10, 11, 12, 3])
+        with tf.GradientTape(persistent=True) as tape:
+            tape.watch(tensor)
+            got = deform.GradientNorm(l1=l1)(tensor)
+            dfdx = deform.gradient_dxyz(tensor, deform.gradient_dx)
+            dfdy = deform.gradient_dxyz(tensor, deform.gradient_dy)
+            dfdz = deform.gradient_dxyz(tensor, deform.gradient_dz)
+            if l1:
+                norms = tf.abs(dfdx) + tf.abs(dfdy) + tf.abs(dfdz)
+            else:
+                norms = dfdx ** 2 + dfdy ** 2 + dfdz ** 2
+            expected = tf.reduce_mean(norms)
+        assert is_equal_tf(got, expected, atol=1e-6)
+        assert is_equal_tf(
+            tape.gradient(got, tensor), tape.gradient(expected, tensor), atol=1e-6
+        )
+
     def test_get_config(self):
         got = deform.GradientNorm().get_config()
         expected = {
@@ -81,3 +102,132 @@ def test_bending_energy():
     got = deform.BendingEnergy()(tensor)
     expected = 0
     assert is_equal_tf(got, expected)
+
+
+def test_bending_energy_finite_difference():
+    """Compare with the second order gradients calculated by slicing."""
+    tensor = tf.random.uniform([2, 10, 11, 12, 3])
+    with tf.GradientTape(persistent=True) as tape:
+        tape.watch(tensor)
+        got = deform.BendingEnergy()(tensor)
+        dfdx = deform.gradient_dxyz(tensor, deform.gradient_dx)
+        dfdy = deform.gradient_dxyz(tensor, deform.gradient_dy)
+        dfdz = deform.gradient_dxyz(tensor, deform.gradient_dz)
+        dfdxx = deform.gradient_dxyz(dfdx, deform.gradient_dx)
+        dfdyy = deform.gradient_dxyz(dfdy, deform.gradient_dy)
+        dfdzz = deform.gradient_dxyz(dfdz, deform.gradient_dz)
+        dfdxy = deform.gradient_dxyz(dfdx, deform.gradient_dy)
+        dfdyz = deform.gradient_dxyz(dfdy, deform.gradient_dz)
+        dfdxz = deform.gradient_dxyz(dfdx, deform.gradient_dz)
+        energy = dfdxx ** 2 + dfdyy ** 2 + dfdzz ** 2
+        energy += 2 * dfdxy ** 2 + 2 * dfdxz ** 2 + 2 * dfdyz ** 2
+        expected = tf.reduce_mean(energy)
+    assert is_equal_tf(got, expected, atol=1e-6)
+    assert is_equal_tf(
+        tape.gradient(got, tensor), tape.gradient(expected, tensor), atol=1e-6
+    )
+
+
+@pytest.mark.parametrize("order,shape", [(1, (3, 3, 3, 1, 3)), (2, (5, 5, 5, 1, 6))])
+def test_central_difference_kernel(order, shape):
+    got = deform.central_difference_kernel(order=order)
+    assert got.shape == shape
+
+
+def test_central_difference_kernel_err():
+    with pytest.raises(ValueError) as err_info:
+        deform.central_difference_kernel(order=3)
+    assert "order must be 1 or 2 for central differences, got 3" in str(err_info.value)
+
+
+def test_central_difference_small_volume():
+    """There is no valid position if the volume is smaller than the stencils."""
+    tensor = tf.ones([2, 4, 6, 6, 3])
+    got = deform.central_difference(
+        tensor, kernel=deform.central_difference_kernel(order=2)
+    )
+    assert got.shape == (6, 0, 2, 2, 6)
+
+
+@pytest.mark.parametrize(
+    "derivative,expected",
+    [
+        # integrals of the products of B-splines shifted by 0, 1, 2, 3 over all cells
+        (0, [2416 / 5040, 1191 / 5040, 120 / 5040, 1 / 5040]),
+        (1, [2 / 3, -1 / 8, -1 / 5, -1 / 120]),
+        (2, [8 / 3, -3 / 2, 0, 1 / 6]),
+    ],
+)
+def test_bspline_gram_filters(derivative, expected):
+    filters = deform.bspline_gram_filters(derivative=derivative)
+    assert filters.shape == (4, 4 - derivative)
+    # cell gram matrix, sum the diagonals to integrate over all cells
+    gram = filters @ filters.T
+    got = [np.trace(gram, offset=shift) for shift in range(4)]
+    assert is_equal_tf(got, expected, atol=1e-6)
+
+
+class TestBendingEnergyOnControlPoints:
+    @pytest.mark.parametrize("cp_spacing", [(1, 1, 1), (2, 3, 4)])
+    def test_polynomial(self, cp_spacing):
+        """Affine fields have no bending energy, quadratic fields a constant one."""
+        loss = deform.BendingEnergy(on_control_points=True)
+        index = np.arange(8, dtype=np.float32)
+        control_points = np.zeros((2, 8, 8, 8, 3), dtype=np.float32)
+
+        # affine field
+        control_points[..., 0] = 2 * index[:, None, None] - index[None, None, :]
+        control_points[..., 2] = 3 * index[None, :, None] + 1
+        got = loss(None, control_points=control_points, cp_spacing=cp_spacing)
+        assert is_equal_tf(got, 0, atol=1e-6)
+
+        # f = x ** 2 in control points coordinate, f_xx = 2 / cp_spacing[0] ** 2
+        control_points[..., 0] = index[:, None, None] ** 2
+        control_points[..., 2] = 0
+        got = loss(None, control_points=control_points, cp_spacing=cp_spacing)
+        expected = (2 / cp_spacing[0] ** 2) ** 2 / 3
+        assert is_equal_tf(got, expected, atol=1e-6)
+
+    @pytest.mark.parametrize("cp_spacing", [(1, 1, 1), (2, 3, 4)])
+    def test_cubic(self, cp_spacing):
+        """The closed form is exact for cubic fields with mixed derivatives."""
+        loss = deform.BendingEnergy(on_control_points=True)
+        shape = (6, 7, 8)
+        x, y, z = np.meshgrid(*[np.arange(v) for v in shape], indexing="ij")
+        # cubic B-splines reproduce f = x * y * z, x ** 3 and x * y ** 2
+        # from the control points f - f'' / 6 in control points coordinate
+        control_points = np.stack([x * y * z, x ** 3 - x, x * (y ** 2 - 1 / 3)], axis=3)
+        control_points = np.stack([control_points] * 2).astype(np.float32)
+        got = loss(None, control_points=control_points, cp_spacing=cp_spacing)
+
+        # cell k spans [k + 1, k + 2], the integral of u ** 2 is (k + 1) ** 2 + k + 4 / 3
+        mx, my, mz = [
+            np.mean([(k + 1) ** 2 + k + 4 / 3 for k in range(v - 3)]) for v in shape
+        ]
+        hx, hy, hz = cp_spacing
+        # f = x * y * z, f_xy = z, f_yz = x, f_xz = y
+        energy_xyz = 2 * (
+            mz / (hx * hy) ** 2 + mx / (hy * hz) ** 2 + my / (hx * hz) ** 2
+        )
+        # f = x ** 3, f_xx = 6 * x
+        energy_x3 = 36 * mx / hx ** 4
+        # f = x * y ** 2, f_yy = 2 * x, f_xy = 2 * y
+        energy_xy2 = 4 * mx / hy ** 4 + 2 * 4 * my / (hx * hy) ** 2
+        expected = (energy_xyz + energy_x3 + energy_xy2) / 3
+        assert is_equal_tf(got, expected, atol=1e-5 * expected)
+
+    def test_error(self):
+        tensor = tf.ones([2, 8, 8, 8, 3])
+        with pytest.raises(ValueError) as err_info:
+            deform.BendingEnergy(on_control_points=True)(tensor)
+        assert "on_control_points requires the control points" in str(err_info.value)
+
+    def test_get_config(self):
+        got = deform.BendingEnergy(on_control_points=True).get_config()
+        expected = {
+            "name": "BendingEnergy",
+            "on_control_points": True,
+            "dtype": "float32",
+            "trainable": True,
+        }
+        assert got == expected
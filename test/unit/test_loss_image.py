@@ -11,6 +11,7 @@ import pytest
 import tensorflow as tf
 
 import deepreg.loss.image as image
+from deepreg.loss.util import EPS, separable_filter
 
 
 class TestSumSquaredDistance:
@@ -55,11 +56,133 @@ class TestGlobalMutualInformation:
         )
         assert is_equal_tf(got, expected)
 
+    def test_half_precision(self):
+        """The histograms are computed in float32 for float16 inputs."""
+        y_true = tf.random.uniform(shape=(2, 4, 4, 4))
+        y_pred = tf.random.uniform(shape=(2, 4, 4, 4))
+        expected = image.GlobalMutualInformation().call(y_true, y_pred)
+        got = image.GlobalMutualInformation().call(
+            tf.cast(y_true, tf.float16), tf.cast(y_pred, tf.float16)
+        )
+        assert got.dtype == tf.float32
+        assert is_equal_tf(got, expected, atol=1e-3)
+
+    @staticmethod
+    def reference_gmi(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+        """
+        Reference implementation materialising all Parzen window weights.
+
+        :param y_true: shape = (batch, dim1, dim2, dim3)
+        :param y_pred: shape = (batch, dim1, dim2, dim3)
+        :return: shape = (batch,)
+        """
+        bin_centers = np.linspace(0, 1, 23)
+        preterm = 1 / (2 * (0.5 / 22) ** 2)
+        batch = y_true.shape[0]
+        y_true = np.clip(y_true, 0, 1).reshape((batch, -1, 1))
+        y_pred = np.clip(y_pred, 0, 1).reshape((batch, -1, 1))
+        ia = np.exp(-preterm * (y_true - bin_centers) ** 2)
+        ia /= ia.sum(axis=-1, keepdims=True)
+        ib = np.exp(-preterm * (y_pred - bin_centers) ** 2)
+        ib /= ib.sum(axis=-1, keepdims=True)
+        pa = ia.mean(axis=1)[:, :, None]
+        pb = ib.mean(axis=1)[:, None, :]
+        pab = np.einsum("bva,bvc->bac", ia, ib) / y_true.shape[1]
+        div = (pab + EPS) / (pa * pb + EPS)
+        return np.sum(pab * np.log(div + EPS), axis=(1, 2))
+
+    @pytest.mark.parametrize("chunk_size", [0, 100, 512, 4096])
+    def test_chunk_size(self, chunk_size):
+        """
+        Compare the values and gradients with the reference implementation.
+
+        :param chunk_size: number of voxels per chunk, 0 for no chunking
+        """
+        y_true = tf.random.uniform(shape=(2, 8, 9, 10))
+        y_pred = tf.random.uniform(shape=(2, 8, 9, 10))
+        expected = self.reference_gmi(y_true.numpy(), y_pred.numpy())
+        loss = image.GlobalMutualInformation(chunk_size=chunk_size)
+
+        with tf.GradientTape() as tape:
+            tape.watch(y_pred)
+            got = loss.call(y_true, y_pred)
+        got_grad = tape.gradient(got, y_pred)
+        assert is_equal_tf(got, expected, atol=1e-5)
+
+        with tf.GradientTape() as tape:
+            tape.watch(y_pred)
+            got_no_chunk = image.GlobalMutualInformation().call(y_true, y_pred)
+        expected_grad = tape.gradient(got_no_chunk, y_pred)
+        assert is_equal_tf(got_grad, expected_grad, atol=1e-5)
+
+        # same results in graph mode
+        got_graph = tf.function(loss.call)(y_true, y_pred)
+        assert is_equal_tf(got_graph, expected, atol=1e-5)
+
+    @pytest.mark.parametrize("chunk_size", [0, 512])
+    def test_sample_fraction(self, chunk_size):
+        """
+        Check the estimation from a subsample is close to the exact value.
+
+        :param chunk_size: number of voxels per chunk, 0 for no chunking
+        """
+        y_true = tf.random.uniform(shape=(2, 16, 16, 16))
+        y_pred = tf.clip_by_value(
+            y_true + 0.1 * tf.random.normal(shape=y_true.shape), 0, 1
+        )
+        expected = image.GlobalMutualInformation().call(y_true, y_pred)
+        got = image.GlobalMutualInformation(
+            sample_fraction=0.25, chunk_size=chunk_size
+        ).call(y_true, y_pred)
+        assert np.all(np.abs(got - expected) < 0.1 * expected)
+
+    @pytest.mark.parametrize("nb_voxels,sample_fraction", [(10, 0.3), (7, 0.5)])
+    def test_sample_voxels(self, nb_voxels: int, sample_fraction: float):
+        """
+        Check one voxel is sampled per stratum, all voxels can be sampled,
+        and the same inputs give the same samples.
+
+        :param nb_voxels: number of voxels
+        :param sample_fraction: fraction of voxels used to estimate the histograms
+        """
+        loss = image.GlobalMutualInformation(sample_fraction=sample_fraction)
+        num_samples = int(nb_voxels * sample_fraction)
+        bounds = np.linspace(0, nb_voxels, num_samples + 1).astype(int)
+        # the sampled values of y_true are the indices of the voxels
+        y_true = tf.range(nb_voxels, dtype=tf.float32)[None, :, None]
+        sampled = set()
+        for _ in range(50):
+            y_pred = tf.random.uniform(shape=(1, nb_voxels, 1))
+            got_true, got_pred = loss.sample_voxels(y_true=y_true, y_pred=y_pred)
+            index = got_true.numpy()[0, :, 0].astype(int)
+            assert np.all(bounds[:-1] <= index)
+            assert np.all(index < bounds[1:])
+            assert is_equal_tf(got_pred, tf.gather(y_pred, index, axis=1))
+            got_graph, _ = tf.function(loss.sample_voxels)(y_true, y_pred)
+            assert is_equal_tf(got_graph, got_true)
+            sampled.update(index.tolist())
+        assert sampled == set(range(nb_voxels))
+
+    @pytest.mark.parametrize(
+        "kwargs,msg",
+        [
+            (dict(chunk_size=-1), "chunk_size must be non-negative"),
+            (dict(sample_fraction=0.0), "sample_fraction must be in (0, 1]"),
+            (dict(sample_fraction=1.5), "sample_fraction must be in (0, 1]"),
+        ],
+    )
+    def test_error(self, kwargs, msg):
+        with pytest.raises(ValueError) as err_info:
+            image.GlobalMutualInformation(**kwargs)
+        assert msg in str(err_info.value)
+
     def test_get_config(self):
         got = image.GlobalMutualInformation().get_config()
         expected = dict(
             num_bins=23,
             sigma_ratio=0.5,
+            chunk_size=0,
+            sample_fraction=1.0,
             reduction=tf.keras.losses.Reduction.SUM,
             name="GlobalMutualInformation",
         )
@@ -95,6 +218,41 @@ class TestLocalNormalizedCrossCorrelation:
         )
         assert is_equal_tf(got, expected)
 
+    @pytest.mark.parametrize("kernel_size", [3, 9, 15])
+    def test_rectangular(self, kernel_size):
+        """The cumulative sum path equals the separable filter path."""
+        y_true = tf.random.uniform(shape=(2, 16, 16, 16, 1))
+        y_pred = tf.random.uniform(shape=(2, 16, 16, 16, 1))
+        loss = image.LocalNormalizedCrossCorrelation(kernel_size=kernel_size)
+        got = loss.call(y_true, y_pred)
+
+        # reference using separable filters
+        kernel = loss.kernel
+        t_sum = separable_filter(y_true, kernel=kernel)
+        p_sum = separable_filter(y_pred, kernel=kernel)
+        t2_sum = separable_filter(y_true * y_true, kernel=kernel)
+        p2_sum = separable_filter(y_pred * y_pred, kernel=kernel)
+        tp_sum = separable_filter(y_true * y_pred, kernel=kernel)
+        t_avg = t_sum / loss.kernel_vol
+        p_avg = p_sum / loss.kernel_vol
+        cross = tp_sum - p_avg * t_sum
+        t_var = t2_sum - t_avg * t_sum
+        p_var = p2_sum - p_avg * p_sum
+        ncc = (cross * cross + EPS) / (t_var * p_var + EPS)
+        expected = tf.reduce_mean(ncc, axis=[1, 2, 3, 4])
+        assert is_equal_tf(got, expected, atol=1e-4)
+
+    def test_half_precision(self):
+        """The variances are computed in float32 for float16 inputs."""
+        y_true = tf.random.uniform(shape=(2, 12, 12, 12))
+        y_pred = tf.random.uniform(shape=(2, 12, 12, 12))
+        expected = image.LocalNormalizedCrossCorrelation().call(y_true, y_pred)
+        got = image.LocalNormalizedCrossCorrelation().call(
+            tf.cast(y_true, tf.float16), tf.cast(y_pred, tf.float16)
+        )
+        assert got.dtype == tf.float32
+        assert is_equal_tf(got, expected, atol=1e-3)
+
     def test_error(self):
         y = np.ones(shape=(3, 3, 3, 3))
         with pytest.raises(ValueError) as err_info:
@@ -0,0 +1,125 @@
+# coding=utf-8
+
+"""
+Tests for deepreg/loss/metric.py
+"""
+from test.unit.util import is_equal_np
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import deepreg.loss.image as image_loss
+import deepreg.loss.label as label_loss
+from deepreg.loss.metric import BatchMetrics, jacobian_determinant
+from deepreg.model.layer_util import get_reference_grid
+
+
+class TestBatchMetrics:
+    batch_size = 3
+    shape = (5, 6, 7)
+
+    @pytest.fixture
+    def tensors(self) -> dict:
+        tf.random.set_seed(0)
+        return dict(
+            fixed_image=tf.random.uniform(shape=(self.batch_size,) + self.shape),
+            pred_fixed_image=tf.random.uniform(shape=(self.batch_size,) + self.shape),
+            fixed_label=tf.random.uniform(shape=(self.batch_size,) + self.shape),
+            pred_fixed_label=tf.random.uniform(shape=(self.batch_size,) + self.shape),
+            fixed_grid_ref=tf.random.uniform(shape=(1,) + self.shape + (3,)),
+        )
+
+    def test_default(self, tensors: dict):
+        got = BatchMetrics()(**tensors)
+        assert list(got.keys()) == ["image_ssd", "label_binary_dice", "label_tre"]
+        # same as calculating the metrics of each sample with the losses
+        for i in range(self.batch_size):
+            fixed_image = tensors["fixed_image"][i : i + 1, ..., None]
+            pred_fixed_image = tensors["pred_fixed_image"][i : i + 1, ..., None]
+            fixed_label = tensors["fixed_label"][i : i + 1]
+            pred_fixed_label = tensors["pred_fixed_label"][i : i + 1]
+            expected = dict(
+                image_ssd=image_loss.SumSquaredDifference()(
+                    y_true=fixed_image, y_pred=pred_fixed_image
+                ),
+                label_binary_dice=label_loss.DiceScore(binary=True)(
+                    y_true=fixed_label, y_pred=pred_fixed_label
+                ),
+                label_tre=label_loss.compute_centroid_distance(
+                    y_true=fixed_label,
+                    y_pred=pred_fixed_label,
+                    grid=tensors["fixed_grid_ref"][0],
+                )[0],
+            )
+            for key, value in expected.items():
+                assert is_equal_np(got[key][i], value, atol=1e-5)
+
+    def test_missing_inputs(self, tensors: dict):
+        tensors["fixed_label"] = None
+        tensors.pop("pred_fixed_label")
+        got = BatchMetrics()(**tensors)
+        assert got["image_ssd"].shape == (self.batch_size,)
+        assert got["label_binary_dice"] is None
+        assert got["label_tre"] is None
+
+    @pytest.mark.parametrize(
+        "metrics",
+        [
+            ["ddf_negative_jacobian", "image_ssd"],
+            [dict(name="ddf_negative_jacobian"), dict(name="image_ssd")],
+        ],
+    )
+    def test_custom(self, tensors: dict, metrics: list):
+        tensors["ddf"] = tf.zeros(shape=(self.batch_size,) + self.shape + (3,))
+        got = BatchMetrics(metrics=metrics)(**tensors)
+        assert list(got.keys()) == ["ddf_negative_jacobian", "image_ssd"]
+        assert is_equal_np(got["ddf_negative_jacobian"], np.zeros(self.batch_size))
+
+    def test_unknown(self):
+        with pytest.raises(ValueError) as err_info:
+            BatchMetrics(metrics=["unknown"])
+        assert "has not been registered" in str(err_info.value)
+
+
+class TestJacobian:
+    shape = (5, 6, 7)
+
+    def affine_ddf(self, matrix: np.ndarray) -> tf.Tensor:
+        """
+        Build the ddf u(x) = A x.
+
+        :param matrix: shape = (3, 3)
+        :return: shape = (1, dim1, dim2, dim3, 3)
+        """
+        grid = get_reference_grid(grid_size=self.shape)
+        ddf = tf.einsum("ij,xyzj->xyzi", tf.constant(matrix, dtype=tf.float32), grid)
+        return ddf[None, ...]
+
+    def test_jacobian_determinant(self):
+        matrix = np.array([[0.1, 0.2, 0.0], [-0.3, 0.5, 0.1], [0.0, 0.4, -0.2]])
+        got = jacobian_determinant(self.affine_ddf(matrix))
+        expected = np.linalg.det(np.eye(3) + matrix)
+        assert got.shape == (1, 3, 4, 5)
+        assert is_equal_np(got, np.full(got.shape, expected), atol=1e-5)
+
+    @pytest.mark.parametrize(
+        "scale,negative,log_std",
+        [(0.0, 0.0, 0.0), (-2.0, 1.0, 0.0), (0.5, 0.0, 0.0)],
+    )
+    def test_metrics(self, scale: float, negative: float, log_std: float):
+        ddf = self.affine_ddf(np.diag([scale, 0.0, 0.0]))
+        got = BatchMetrics(metrics=["ddf_negative_jacobian", "ddf_log_jacobian_std"])(
+            ddf=ddf
+        )
+        assert is_equal_np(got["ddf_negative_jacobian"], [negative])
+        assert is_equal_np(got["ddf_log_jacobian_std"], [log_std], atol=1e-5)
+
+    def test_log_jacobian_std(self):
+        # half of the volume is stretched along the first axis
+        ddf = np.zeros((1,) + self.shape + (3,), dtype=np.float32)
+        ddf[0, :, :, :, 0] = np.maximum(np.arange(self.shape[0]) - 2, 0)[:, None, None]
+        got = BatchMetrics(metrics=["ddf_log_jacobian_std"])(ddf=ddf)
+        # det is 1, 1.5, 2 along the first axis
+        expected = np.std(np.log([1, 1.5, 2]))
+        assert is_equal_np(got["ddf_log_jacobian_std"], [expected], atol=1e-5)
@@ -13,6 +13,8 @@ import tensorflow as tf
 
 from deepreg.loss.util import (
     NegativeLossMixin,
+    box_filter,
+    cast_to_full_precision,
     cauchy_kernel1d,
     gaussian_kernel1d_sigma,
     gaussian_kernel1d_size,
@@ -96,6 +98,20 @@ def test_triangular_kernel1d(kernel_size):
     assert is_equal_tf(got, expected)
 
 
+@pytest.mark.parametrize(
+    "dtype,expected",
+    [
+        (tf.float16, tf.float32),
+        (tf.bfloat16, tf.float32),
+        (tf.float32, tf.float32),
+        (tf.float64, tf.float64),
+    ],
+)
+def test_cast_to_full_precision(dtype, expected):
+    got = cast_to_full_precision(tf.ones(shape=(2, 3), dtype=dtype))
+    assert got.dtype == expected
+
+
 def test_separable_filter():
     """
     Testing separable filter case where non
@@ -116,6 +132,45 @@ def test_separable_filter():
     assert is_equal_tf(get, expect)
 
 
+def test_separable_filter_channels():
+    """Channels are filtered independently, with shared or separate kernels."""
+    tensor = tf.random.uniform(shape=(2, 6, 7, 8, 3))
+    kernels = [
+        gaussian_kernel1d_sigma(1),
+        cauchy_kernel1d(1),
+        gaussian_kernel1d_sigma(1),
+    ]
+    # pad the gaussian kernels to the size of the cauchy kernel
+    kernels[0] = tf.pad(kernels[0], [[2, 2]])
+    kernels[2] = tf.pad(kernels[2], [[2, 2]])
+
+    got_shared = separable_filter(tensor, kernels[1])
+    got_separate = separable_filter(tensor, tf.stack(kernels, axis=1))
+    for ch in range(3):
+        expected_shared = separable_filter(tensor[..., ch : ch + 1], kernels[1])
+        expected_separate = separable_filter(tensor[..., ch : ch + 1], kernels[ch])
+        assert is_equal_tf(got_shared[..., ch : ch + 1], expected_shared, atol=1e-6)
+        assert is_equal_tf(got_separate[..., ch : ch + 1], expected_separate, atol=1e-6)
+
+
+@pytest.mark.parametrize("kernel_size", [1, 3, 4, 9, 15])
+def test_box_filter(kernel_size):
+    """Box filter equals the separable filter with a rectangular kernel."""
+    tensor = tf.random.uniform(shape=(2, 10, 11, 12, 1))
+    expected = separable_filter(tensor, rectangular_kernel1d(kernel_size))
+    got = box_filter(tensor, kernel_size=kernel_size)
+    assert is_equal_tf(got, expected, atol=1e-4)
+
+
+def test_box_filter_channels():
+    """Channels are filtered independently."""
+    tensor = tf.random.uniform(shape=(2, 6, 7, 8, 3))
+    got = box_filter(tensor, kernel_size=3)
+    for ch in range(3):
+        expected = box_filter(tensor[..., ch : ch + 1], kernel_size=3)
+        assert is_equal_tf(got[..., ch : ch + 1], expected, atol=1e-5)
+
+
 class MinusClass(tf.keras.losses.Loss):
     def __init__(self):
         super().__init__()
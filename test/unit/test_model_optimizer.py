@@ -21,3 +21,10 @@ class TestBuildOptimizer:
         opt_config = {"name": "SGD"}
         opt_get = optimizer.build_optimizer(opt_config)
         assert isinstance(opt_get, tf.keras.optimizers.SGD)
+
+    def test_build_optimizer_loss_scale(self):
+        """Build an Adam optimizer wrapped with dynamic loss scaling"""
+        opt_config = {"name": "Adam", "learning_rate": 1.0e-5}
+        opt_get = optimizer.build_optimizer(opt_config, loss_scale=True)
+        assert isinstance(opt_get, tf.keras.mixed_precision.LossScaleOptimizer)
+        assert isinstance(opt_get.inner_optimizer, tf.keras.optimizers.Adam)
@@ -5,11 +5,17 @@ Tests for deepreg/_model/network/ddf_dvf.py
 """
 import itertools
 from copy import deepcopy
+from test.unit.util import get_registration_config
 from unittest.mock import MagicMock, patch
 
 import pytest
+import tensorflow as tf
 
-from deepreg.model.network import RegistrationModel
+from deepreg.model.network import (
+    RegistrationModel,
+    build_model_from_config,
+    load_config,
+)
 from deepreg.registry import REGISTRY
 
 moving_image_size = (1, 3, 5)
@@ -21,6 +27,7 @@ backbone_args = {
     "global": {"extract_levels": [1, 2]},
     "unet": {"depth": 2},
 }
+backbone_names = {"local": "LocalNet", "global": "GlobalNet", "unet": "Unet"}
 config = {
     "backbone": {"num_channel_initial": 4, "control_points": 2},
     "loss": {
@@ -98,7 +105,9 @@ def pytest_generate_tests(metafunc):
     :param metafunc:
     :return:
     """
-    #
+    if not hasattr(metafunc.cls, "params"):
+        # test functions outside classes use pytest.mark.parametrize
+        return
     funcarglist = metafunc.cls.params
     argnames = sorted(funcarglist[0])
     metafunc.parametrize(
@@ -249,6 +258,16 @@ class TestDDFModel:
         expected = 3 if labeled else 2
         assert len(model._model.losses) == expected
 
+    def test_get_inference_model(self, model, labeled, backbone):
+        got = model.get_inference_model()
+        assert len(got.losses) == 0
+        assert len(got.metrics) == 0
+        assert sorted(got.output.keys()) == sorted(model._outputs.keys())
+        # the weights are shared
+        assert len(got.trainable_weights) == len(model._model.trainable_weights)
+        for x, y in zip(got.trainable_weights, model._model.trainable_weights):
+            assert x is y
+
     def test_postprocess(self, model, labeled, backbone):
         indices, processed = model.postprocess(
             inputs=model._inputs, outputs=model._outputs
@@ -318,3 +337,183 @@ class TestConditionalModel:
         )
         assert indices.shape == (batch_size, index_size)
         assert len(processed) == 5
+
+
+class TestMixedPrecision:
+    params = [
+        dict(method=method, backbone=backbone, mixed_precision=mixed_precision)
+        for (method, backbone), mixed_precision in itertools.product(
+            [("ddf", "local"), ("ddf", "global"), ("dvf", "unet")],
+            ["float16", "bfloat16"],
+        )
+    ]
+
+    def build_model(
+        self, method: str, backbone: str, mixed_precision: str
+    ) -> RegistrationModel:
+        """
+        Build a labeled registration model with mixed precision.
+
+        :param method: name of method
+        :param backbone: name of backbone
+        :param mixed_precision: float16 or bfloat16
+        :return: the built object
+        """
+        copied = deepcopy(config)
+        copied["method"] = method
+        copied["mixed_precision"] = mixed_precision
+        copied["backbone"]["name"] = backbone  # type: ignore
+        copied["backbone"].update(backbone_args[backbone])  # type: ignore
+        return REGISTRY.build_model(  # type: ignore
+            config=dict(
+                name=method,
+                moving_image_size=moving_image_size,
+                fixed_image_size=fixed_image_size,
+                index_size=index_size,
+                labeled=True,
+                batch_size=batch_size,
+                config=copied,
+            )
+        )
+
+    def test_build_model(self, method, backbone, mixed_precision):
+        model = self.build_model(
+            method=method, backbone=backbone, mixed_precision=mixed_precision
+        )
+        # only the backbone computes in lower precision
+        policies = {
+            layer.name: layer.dtype_policy.name for layer in model._model.layers
+        }
+        assert policies[backbone_names[backbone]] == f"mixed_{mixed_precision}"
+        assert policies["warping"] == "float32"
+        for value in model._outputs.values():
+            assert value.dtype == tf.float32
+        assert len(model._model.losses) == 3
+        assert tf.keras.mixed_precision.global_policy().name == "float32"
+
+    def test_err(self, method, backbone, mixed_precision):
+        with pytest.raises(ValueError) as err_info:
+            self.build_model(
+                method=method, backbone=backbone, mixed_precision="float64"
+            )
+        assert "mixed_precision must be float16 or bfloat16" in str(err_info.value)
+
+
+class TestControlPointsRegularization:
+    params = [
+        dict(method=method, control_points=control_points)
+        for method, control_points in itertools.product(["ddf", "dvf"], [2, [2, 3, 4]])
+    ]
+
+    def build_model(self, method: str, control_points) -> RegistrationModel:
+        """
+        Build a labeled registration model with bending energy on control points.
+
+        :param method: name of method
+        :param control_points: control point spacing, None to not use control points
+        :return: the built object
+        """
+        copied = deepcopy(config)
+        copied["method"] = method
+        copied["backbone"]["name"] = "local"  # type: ignore
+        copied["backbone"].update(backbone_args["local"])  # type: ignore
+        copied["backbone"]["control_points"] = control_points  # type: ignore
+        copied["loss"]["regularization"]["on_control_points"] = True  # type: ignore
+        return REGISTRY.build_model(  # type: ignore
+            config=dict(
+                name=method,
+                moving_image_size=moving_image_size,
+                fixed_image_size=fixed_image_size,
+                index_size=index_size,
+                labeled=True,
+                batch_size=batch_size,
+                config=copied,
+            )
+        )
+
+    def test_build_loss(self, method, control_points):
+        model = self.build_model(method=method, control_points=control_points)
+        assert len(model._model.losses) == 3
+        if isinstance(control_points, int):
+            control_points = [control_points] * 3
+        assert model._cp_spacing == tuple(control_points)
+        assert model._control_points.shape == (
+            batch_size,
+            *[-(-v // c) + 3 for v, c in zip(fixed_image_size, control_points)],
+            3,
+        )
+
+    def test_err(self, method, control_points):
+        with pytest.raises(ValueError) as err_info:
+            self.build_model(method=method, control_points=None)
+        assert "on_control_points requires the control points" in str(err_info.value)
+
+
+class TestWarpingInterpolation:
+    params = [
+        dict(method=method, label_interpolation=label_interpolation)
+        for method, label_interpolation in itertools.product(
+            ["ddf", "dvf"], ["linear", "nearest"]
+        )
+    ]
+
+    def test_build_warping(self, method, label_interpolation):
+        copied = deepcopy(config)
+        copied["method"] = method
+        copied["backbone"]["name"] = "local"  # type: ignore
+        copied["backbone"].update(backbone_args["local"])  # type: ignore
+        copied["label_interpolation"] = label_interpolation
+        model = REGISTRY.build_model(
+            config=dict(
+                name=method,
+                moving_image_size=moving_image_size,
+                fixed_image_size=fixed_image_size,
+                index_size=index_size,
+                labeled=True,
+                batch_size=batch_size,
+                config=copied,
+            )
+        )
+        image_warping, label_warping = model.build_warping()
+        assert image_warping._interpolation == "linear"
+        assert label_warping._interpolation == label_interpolation
+        # the label is warped once, by a separate layer if nearest
+        layer_names = [x.name for x in model._model.layers]
+        assert ("label_warping" in layer_names) == (label_interpolation == "nearest")
+
+
+def test_load_config():
+    ckpt_path = "config/test/ddf/save/ckpt-1"
+    with pytest.raises(FileNotFoundError):
+        # no config.yaml saved next to the checkpoint
+        load_config(config_path="", ckpt_path=ckpt_path)
+    got = load_config(config_path="config/unpaired_labeled_ddf.yaml", ckpt_path="")
+    assert got["train"]["method"] == "ddf"
+
+
+@pytest.mark.parametrize(
+    "dataset_config,expected",
+    [
+        (
+            dict(
+                type="paired", moving_image_shape=[8, 8, 8], fixed_image_shape=[4, 4, 4]
+            ),
+            2,
+        ),
+        (dict(type="unpaired", image_shape=[4, 4, 4]), 3),
+        (dict(type="grouped", image_shape=[4, 4, 4]), 5),
+    ],
+)
+def test_build_model_from_config(dataset_config: dict, expected: int):
+    got = build_model_from_config(
+        config=dict(
+            dataset=dict(labeled=False, **dataset_config),
+            train=get_registration_config(image_shape=(4, 4, 4))["train"],
+        ),
+        batch_size=3,
+    )
+    assert got.index_size == expected
+    assert got.batch_size == 3
+    assert got.fixed_image_size == tuple(
+        dataset_config.get("fixed_image_shape", dataset_config.get("image_shape"))
+    )
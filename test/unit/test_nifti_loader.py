@@ -2,12 +2,18 @@
 Tests functionality of the NiftiFileLoader
 """
 import os
+import shutil
 from test.unit.util import is_equal_np
 
+import nibabel as nib
 import numpy as np
 import pytest
 
-from deepreg.dataset.loader.nifti_loader import NiftiFileLoader, load_nifti_file
+from deepreg.dataset.loader.nifti_loader import (
+    NiftiFileLoader,
+    load_nifti_file,
+    save_nifti_file,
+)
 
 
 def get_loader(loader_name):
@@ -51,6 +57,50 @@ def test_load_nifti_file_err():
     assert "Nifti file path must end with .nii or .nii.gz" in str(err_info.value)
 
 
+class TestSaveNiftiFile:
+    save_dir = "logs/test_nifti_loader_save_nifti_file"
+
+    def teardown_method(self, method):
+        if os.path.exists(self.save_dir):
+            shutil.rmtree(self.save_dir)
+
+    @pytest.mark.parametrize(
+        "suffix,compression_level",
+        [("nii", None), ("nii.gz", None), ("nii.gz", 0), ("nii.gz", 9)],
+    )
+    def test_save(self, suffix: str, compression_level: int):
+        os.makedirs(self.save_dir, exist_ok=True)
+        file_path = os.path.join(self.save_dir, "arr." + suffix)
+        arr = np.random.rand(2, 3, 4, 3).astype(np.float32)
+        affine = np.diag([2.0, 3.0, 4.0, 1.0])
+        affine[:3, 3] = [-1.0, 5.0, 2.0]
+        save_nifti_file(
+            arr=arr,
+            file_path=file_path,
+            affine=affine,
+            compression_level=compression_level,
+        )
+        assert is_equal_np(load_nifti_file(file_path=file_path), arr)
+        assert is_equal_np(nib.load(file_path).affine, affine)
+
+    def test_compression_level(self):
+        os.makedirs(self.save_dir, exist_ok=True)
+        arr = np.zeros((8, 8, 8), dtype=np.float32)
+        sizes = []
+        for compression_level in [0, 9]:
+            file_path = os.path.join(self.save_dir, f"arr{compression_level}.nii.gz")
+            save_nifti_file(
+                arr=arr, file_path=file_path, compression_level=compression_level
+            )
+            sizes.append(os.path.getsize(file_path))
+        assert sizes[0] > sizes[1]
+
+    def test_err(self):
+        with pytest.raises(ValueError) as err_info:
+            save_nifti_file(arr=np.zeros((2, 3, 4)), file_path="arr.h5")
+        assert "Nifti file path must end with .nii or .nii.gz" in str(err_info.value)
+
+
 class TestNiftiFileLoader:
     @pytest.mark.parametrize(
         "name,expected",
@@ -236,6 +286,27 @@ class TestNiftiFileLoader:
         assert is_equal_np(got[1], expected[1])
         loader.close()
 
+    @pytest.mark.parametrize(
+        "name,index,expected",
+        [
+            (
+                "paired",
+                0,
+                "./data/test/nifti/paired/test/fixed_images/case000025.nii.gz",
+            ),
+            (
+                "grouped",
+                (0, 1),
+                "./data/test/nifti/grouped/test/images/group1/case000026.nii.gz",
+            ),
+        ],
+    )
+    def test_get_data_source(self, name, index, expected):
+        loader = get_loader(name)
+        got = loader.get_data_source(index)
+        assert got == (expected, "")
+        loader.close()
+
     @pytest.mark.parametrize(
         "name,expected",
         [
@@ -316,6 +387,15 @@ class TestNiftiFileLoader:
         assert got == expected
         loader.close()
 
+    @pytest.mark.parametrize("name,index", [("paired", 0), ("grouped", (0, 1))])
+    def test_get_affine(self, name, index):
+        loader = get_loader(name)
+        file_path, _ = loader.get_data_source(index)
+        affine, shape = loader.get_affine(index)
+        assert is_equal_np(affine, nib.load(file_path).affine)
+        assert shape == loader.get_data(index).shape[:3]
+        loader.close()
+
     @pytest.mark.parametrize(
         "name",
         [
@@ -7,8 +7,25 @@ pytest style
 
 import os
 import shutil
+from test.unit.util import is_equal_np
+from typing import Dict
 
-from deepreg.predict import build_config, build_pair_output_path
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from deepreg.model.layer import Warping
+from deepreg.model.layer_util import get_reference_grid
+from deepreg.predict import (
+    build_config,
+    build_pair_output_path,
+    get_blending_window,
+    get_patch_starts,
+    predict_native_resolution,
+    predict_on_dataset,
+    predict_sliding_window,
+)
+from deepreg.registry import REGISTRY
 
 
 def test_build_pair_output_path():
@@ -62,3 +79,292 @@ def test_build_config():
 def test_predict_on_dataset():
     # predict_on_dataset is tested in test_train/test_train_and_predict
     pass
+
+
+@pytest.mark.parametrize(
+    "size,patch_size,overlap,expected",
+    [
+        (8, 8, 0.25, [0]),
+        (3, 8, 0.25, [0]),
+        (16, 8, 0.0, [0, 8]),
+        (16, 8, 0.5, [0, 4, 8]),
+        (13, 4, 0.25, [0, 3, 6, 9]),
+        (10, 4, 0.25, [0, 3, 6]),
+        (5, 2, 0.9, [0, 1, 2, 3]),
+    ],
+)
+def test_get_patch_starts(size: int, patch_size: int, overlap: float, expected):
+    got = get_patch_starts(size=size, patch_size=patch_size, overlap=overlap)
+    assert got == expected
+
+
+class TestGetBlendingWindow:
+    @pytest.mark.parametrize("window", ["gaussian", "cosine"])
+    @pytest.mark.parametrize("patch_size", [(4, 5, 6), (1, 8, 8)])
+    def test_window(self, window: str, patch_size: tuple):
+        got = get_blending_window(patch_size=patch_size, window=window)
+        assert got.shape == patch_size
+        assert np.all(got > 0)
+        assert np.max(got) <= 1
+        # symmetric and maximal at the center
+        assert is_equal_np(got, got[::-1, ::-1, ::-1])
+        center = tuple(x // 2 for x in patch_size)
+        assert np.isclose(got[center], np.max(got))
+
+    def test_err(self):
+        with pytest.raises(ValueError) as err_info:
+            get_blending_window(patch_size=(4, 4, 4), window="linear")
+        assert "Unknown blending window linear" in str(err_info.value)
+
+
+class FakeModel:
+    """
+    A model predicting ddf = scale * fixed_image, which is independent of the patch.
+    """
+
+    def __init__(self, patch_size: tuple, batch_size: int, scale: float):
+        self.moving_image_size = patch_size
+        self.fixed_image_size = patch_size
+        self.batch_size = batch_size
+        self.scale = scale
+
+    def __call__(self, inputs: Dict[str, tf.Tensor], training: bool):
+        assert inputs["fixed_image"].shape == (self.batch_size,) + self.fixed_image_size
+        assert inputs["indices"].shape[0] == self.batch_size
+        ddf = tf.stack([inputs["fixed_image"] * self.scale] * 3, axis=4)
+        return dict(ddf=ddf, dvf=ddf * 2)
+
+
+class FakeConditionalModel(FakeModel):
+    """
+    A model predicting the fixed label without ddf.
+    """
+
+    def __call__(self, inputs: Dict[str, tf.Tensor], training: bool):
+        return dict(pred_fixed_label=inputs["fixed_image"])
+
+
+class TestPredictSlidingWindow:
+    @staticmethod
+    def build_inputs(shape: tuple, labeled: bool) -> Dict[str, tf.Tensor]:
+        """
+        Build a batch of one sample.
+
+        :param shape: shape of the volumes
+        :param labeled: whether the sample has labels
+        :return: dict of tensors
+        """
+        tf.random.set_seed(0)
+        inputs = dict(
+            moving_image=tf.random.uniform(shape=(1,) + shape),
+            fixed_image=tf.random.uniform(shape=(1,) + shape),
+            indices=tf.constant([[1, 2, 0]], dtype=tf.float32),
+        )
+        if labeled:
+            inputs["moving_label"] = tf.random.uniform(shape=(1,) + shape)
+            inputs["fixed_label"] = tf.random.uniform(shape=(1,) + shape)
+        return inputs
+
+    @pytest.mark.parametrize("blending", ["gaussian", "cosine"])
+    @pytest.mark.parametrize("shape", [(10, 12, 9), (3, 4, 9), (4, 4, 4)])
+    def test_blend(self, shape: tuple, blending: str):
+        inputs = self.build_inputs(shape=shape, labeled=False)
+        model = FakeModel(patch_size=(4, 4, 4), batch_size=3, scale=0.5)
+        got = predict_sliding_window(
+            model=model,
+            inputs=inputs,
+            fixed_grid_ref=get_reference_grid(grid_size=shape)[None, ...],
+            blending=blending,
+        )
+        assert sorted(got.keys()) == ["ddf", "dvf", "pred_fixed_image"]
+        expected = np.stack([inputs["fixed_image"].numpy() * 0.5] * 3, axis=4)
+        assert is_equal_np(got["ddf"], expected, atol=1e-5)
+        assert is_equal_np(got["dvf"], expected * 2, atol=1e-5)
+        assert got["pred_fixed_image"].shape == (1,) + shape
+
+    @pytest.mark.parametrize("labeled", [True, False])
+    def test_warp(self, labeled: bool):
+        shape = (6, 7, 8)
+        inputs = self.build_inputs(shape=shape, labeled=labeled)
+        model = FakeModel(patch_size=(4, 4, 4), batch_size=2, scale=0.0)
+        got = predict_sliding_window(
+            model=model,
+            inputs=inputs,
+            fixed_grid_ref=get_reference_grid(grid_size=shape)[None, ...],
+        )
+        # zero ddf, same as warping the full volumes
+        warping = Warping(fixed_image_size=shape)
+        ddf = tf.zeros((1,) + shape + (3,))
+        expected = warping(inputs=[ddf, inputs["moving_image"]])
+        assert is_equal_np(got["pred_fixed_image"], expected)
+        assert ("pred_fixed_label" in got) == labeled
+        if labeled:
+            expected = warping(inputs=[ddf, inputs["moving_label"]])
+            assert is_equal_np(got["pred_fixed_label"], expected)
+
+    def test_same_as_model(self):
+        """
+        Volume of the patch size is predicted by one call of the model.
+        """
+        shape = (8, 8, 8)
+        model = REGISTRY.build_model(
+            config=dict(
+                name="ddf",
+                moving_image_size=shape,
+                fixed_image_size=shape,
+                index_size=3,
+                labeled=True,
+                batch_size=2,
+                config={
+                    "method": "ddf",
+                    "backbone": {
+                        "name": "local",
+                        "num_channel_initial": 4,
+                        "extract_levels": [1, 2],
+                        "out_kernel_initializer": "glorot_uniform",
+                    },
+                    "loss": {"image": {"name": "lncc", "weight": 1.0}},
+                },
+            )
+        )
+        inputs = self.build_inputs(shape=shape, labeled=True)
+        got = predict_sliding_window(
+            model=model,
+            inputs=inputs,
+            fixed_grid_ref=get_reference_grid(grid_size=shape)[None, ...],
+        )
+        expected = model(
+            {k: tf.concat([v, v], axis=0) for k, v in inputs.items()}, training=False
+        )
+        for key in ["ddf", "pred_fixed_image", "pred_fixed_label"]:
+            assert is_equal_np(got[key], expected[key][:1], atol=1e-5)
+
+    @pytest.mark.parametrize(
+        "patch_size,shapes,batch,overlap,err_msg",
+        [
+            [(4, 4, 4), ((5, 5, 5), (5, 5, 5)), 1, 1.0, "patch_overlap must be in"],
+            [(4, 4, 4), ((5, 5, 5), (5, 5, 6)), 1, 0.5, "volumes of the same shape"],
+            [(4, 4, 4), ((5, 5, 5), (5, 5, 5)), 2, 0.5, "a batch of one sample"],
+        ],
+    )
+    def test_err(self, patch_size, shapes, batch, overlap, err_msg):
+        inputs = dict(
+            moving_image=tf.zeros((batch,) + shapes[0]),
+            fixed_image=tf.zeros((batch,) + shapes[1]),
+            indices=tf.zeros((batch, 3)),
+        )
+        model = FakeModel(patch_size=patch_size, batch_size=2, scale=0.0)
+        with pytest.raises(ValueError) as err_info:
+            predict_sliding_window(
+                model=model,
+                inputs=inputs,
+                fixed_grid_ref=get_reference_grid(grid_size=shapes[1])[None, ...],
+                patch_overlap=overlap,
+            )
+        assert err_msg in str(err_info.value)
+
+    def test_err_image_size(self):
+        model = FakeModel(patch_size=(4, 4, 4), batch_size=2, scale=0.0)
+        model.moving_image_size = (4, 4, 5)
+        with pytest.raises(ValueError) as err_info:
+            predict_sliding_window(
+                model=model,
+                inputs=self.build_inputs(shape=(4, 4, 4), labeled=False),
+                fixed_grid_ref=get_reference_grid(grid_size=(4, 4, 4))[None, ...],
+            )
+        assert "equal moving and fixed image sizes" in str(err_info.value)
+
+    def test_err_no_ddf(self):
+        model = FakeConditionalModel(patch_size=(4, 4, 4), batch_size=2, scale=0.0)
+        with pytest.raises(ValueError) as err_info:
+            predict_sliding_window(
+                model=model,
+                inputs=self.build_inputs(shape=(4, 4, 4), labeled=False),
+                fixed_grid_ref=get_reference_grid(grid_size=(4, 4, 4))[None, ...],
+            )
+        assert "requires a model predicting ddf" in str(err_info.value)
+
+
+class TestPredictNativeResolution:
+    @staticmethod
+    def build_inputs(moving_shape: tuple, fixed_shape: tuple) -> Dict[str, tf.Tensor]:
+        """
+        Build a labeled batch of one sample with constant fixed image.
+
+        :param moving_shape: shape of the moving volumes
+        :param fixed_shape: shape of the fixed volumes
+        :return: dict of tensors
+        """
+        tf.random.set_seed(0)
+        return dict(
+            moving_image=tf.random.uniform(shape=(1,) + moving_shape),
+            fixed_image=tf.ones(shape=(1,) + fixed_shape),
+            moving_label=tf.random.uniform(shape=(1,) + moving_shape),
+            fixed_label=tf.random.uniform(shape=(1,) + fixed_shape),
+            indices=tf.constant([[1, 2, 0]], dtype=tf.float32),
+        )
+
+    @pytest.mark.parametrize("shape", [(4, 4, 4), (8, 6, 4), (3, 5, 7)])
+    def test_scale(self, shape: tuple):
+        inputs = self.build_inputs(moving_shape=shape, fixed_shape=shape)
+        # constant ddf of 0.5 voxel in the model space
+        model = FakeModel(patch_size=(4, 4, 4), batch_size=1, scale=0.5)
+        grid_ref = get_reference_grid(grid_size=shape)[None, ...]
+        got = predict_native_resolution(
+            model=model, inputs=inputs, fixed_grid_ref=grid_ref
+        )
+        assert sorted(got.keys()) == [
+            "ddf",
+            "dvf",
+            "pred_fixed_image",
+            "pred_fixed_label",
+        ]
+        scale = np.asarray(shape) / 4
+        expected = np.ones((1,) + shape + (3,)) * 0.5 * scale
+        assert is_equal_np(got["ddf"], expected, atol=1e-5)
+        assert is_equal_np(got["dvf"], expected * 2, atol=1e-5)
+        warping = Warping(fixed_image_size=shape)
+        for name in ["image", "label"]:
+            assert is_equal_np(
+                got[f"pred_fixed_{name}"],
+                warping(inputs=[got["ddf"], inputs[f"moving_{name}"]]),
+            )
+
+    def test_different_shapes(self):
+        """
+        The fixed voxels are mapped to the centers of the moving voxel blocks.
+        """
+        inputs = self.build_inputs(moving_shape=(8, 8, 4), fixed_shape=(4, 4, 4))
+        model = FakeModel(patch_size=(4, 4, 4), batch_size=1, scale=0.0)
+        grid_ref = get_reference_grid(grid_size=(4, 4, 4))[None, ...]
+        got = predict_native_resolution(
+            model=model, inputs=inputs, fixed_grid_ref=grid_ref
+        )
+        expected = (grid_ref.numpy() + 0.5) * np.asarray([1, 1, 0])
+        assert is_equal_np(got["ddf"], expected, atol=1e-5)
+
+    def test_err(self):
+        model = FakeConditionalModel(patch_size=(4, 4, 4), batch_size=1, scale=0.0)
+        with pytest.raises(ValueError) as err_info:
+            predict_native_resolution(
+                model=model,
+                inputs=self.build_inputs(moving_shape=(6, 6, 6), fixed_shape=(6, 6, 6)),
+                fixed_grid_ref=get_reference_grid(grid_size=(6, 6, 6))[None, ...],
+            )
+        assert "requires a model predicting ddf" in str(err_info.value)
+
+
+def test_predict_on_dataset_err():
+    with pytest.raises(ValueError) as err_info:
+        predict_on_dataset(
+            dataset=None,
+            fixed_grid_ref=None,
+            model=None,
+            model_method="ddf",
+            save_dir="logs/test_predict_on_dataset_err",
+            save_nifti=False,
+            save_png=False,
+            sliding_window=True,
+            native_resolution=True,
+        )
+    assert "can not be used together" in str(err_info.value)
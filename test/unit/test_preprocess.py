@@ -203,6 +203,126 @@ class TestRandomTransformation:
         for k in inputs:
             assert outputs[k].shape == inputs[k].shape
 
+        # seeded transformation is reproducible
+        seed = tf.constant([1, 2])
+        outputs = layer(inputs, seed=seed)
+        expected = layer(inputs, seed=seed)
+        for k in inputs:
+            assert is_equal_tf(outputs[k], expected[k])
+
+
+class TestRandomCompositeTransform3D:
+    """Test the composition of random transformations."""
+
+    moving_image_size = (4, 5, 6)
+    fixed_image_size = (5, 6, 7)
+    batch_size = 2
+    common_config = dict(
+        moving_image_size=moving_image_size,
+        fixed_image_size=fixed_image_size,
+        batch_size=batch_size,
+    )
+
+    def build_layer(self, field_strength: float = 1):
+        """
+        Build a composite of affine and ddf transformations.
+
+        :param field_strength: field strength of the ddf transformation
+        :return: composite layer
+        """
+        affine = preprocess.RandomAffineTransform3D(**self.common_config, scale=0.2)
+        ddf = preprocess.RandomDDFTransform3D(
+            **self.common_config,
+            field_strength=field_strength,
+            low_res_size=(2, 2, 2),
+        )
+        return preprocess.RandomCompositeTransform3D(transforms=[affine, ddf])
+
+    def test_init_err(self):
+        affine = preprocess.RandomAffineTransform3D(**self.common_config)
+        ddf = preprocess.RandomDDFTransform3D(
+            moving_image_size=self.moving_image_size,
+            fixed_image_size=self.fixed_image_size,
+            batch_size=self.batch_size + 1,
+        )
+        with pytest.raises(AssertionError):
+            preprocess.RandomCompositeTransform3D(transforms=[affine, ddf])
+        with pytest.raises(AssertionError) as err_info:
+            preprocess.RandomCompositeTransform3D(transforms=[])
+        assert "transforms must not be empty" in str(err_info.value)
+
+    def test_get_config(self):
+        layer = self.build_layer()
+        got = layer.get_config()
+        assert got["moving_image_size"] == self.moving_image_size
+        assert got["fixed_image_size"] == self.fixed_image_size
+        assert got["batch_size"] == self.batch_size
+        assert [x["name"] for x in got["transforms"]] == [
+            "RandomAffineTransform3D",
+            "RandomDDFTransform3D",
+        ]
+
+    def test_transform_grid(self):
+        """The grid is transformed by the last transformation first."""
+        layer = self.build_layer()
+        moving_params, _ = layer.gen_transform_params(seed=tf.constant([1, 2]))
+        theta, ddf = moving_params
+        grid = tf.tile(layer.moving_grid_ref[None, ...], [self.batch_size, 1, 1, 1, 1])
+        got = layer.transform_grid(grid=grid, params=moving_params)
+        expected = tf.einsum(
+            "bijkq,bqp->bijkp",
+            tf.concat([grid + ddf, tf.ones_like(grid[..., :1])], axis=4),
+            theta,
+        )
+        assert is_equal_tf(got, expected, atol=1e-4)
+        # the reference grid is transformed without interpolation
+        got = layer.transform_grid(grid=layer.moving_grid_ref, params=moving_params)
+        assert is_equal_tf(got, expected, atol=1e-4)
+
+    def test_transform_zero_ddf(self):
+        """Composing with a zero DDF is the same as the affine transformation."""
+        layer = self.build_layer(field_strength=0)
+        moving_params, _ = layer.gen_transform_params()
+        image = tf.random.uniform(shape=(self.batch_size, *self.moving_image_size))
+        got = layer.transform(
+            image=image, grid_ref=layer.moving_grid_ref, params=moving_params
+        )
+        expected = preprocess.RandomAffineTransform3D.transform(
+            image=image, grid_ref=layer.moving_grid_ref, params=moving_params[0]
+        )
+        assert is_equal_tf(got, expected, atol=1e-5)
+
+    @pytest.mark.parametrize("labeled", [True, False])
+    def test_call(self, labeled: bool):
+        layer = self.build_layer()
+        moving_shape = (self.batch_size, *self.moving_image_size)
+        fixed_shape = (self.batch_size, *self.fixed_image_size)
+        inputs = dict(
+            moving_image=tf.random.uniform(moving_shape),
+            fixed_image=tf.random.uniform(fixed_shape),
+            indices=tf.ones((self.batch_size, 3)),
+        )
+        if labeled:
+            inputs["moving_label"] = tf.random.uniform(moving_shape)
+            inputs["fixed_label"] = tf.random.uniform(fixed_shape)
+
+        seed = tf.constant([1, 2])
+        outputs = layer(inputs, seed=seed)
+        assert sorted(outputs.keys()) == sorted(inputs.keys())
+        for k in inputs:
+            assert outputs[k].shape == inputs[k].shape
+
+        # moving image and label are sampled with the same grid
+        moving_params, fixed_params = layer.gen_transform_params(seed=seed)
+        for k, grid_ref, params in [
+            ("moving_image", layer.moving_grid_ref, moving_params),
+            ("fixed_image", layer.fixed_grid_ref, fixed_params),
+        ]:
+            expected = layer.transform(
+                image=inputs[k], grid_ref=grid_ref, params=params
+            )
+            assert is_equal_tf(outputs[k], expected)
+
 
 def test_random_transform_generator():
     """
@@ -214,24 +334,70 @@ def test_random_transform_generator():
     transforms = deepreg.dataset.preprocess.gen_rand_affine_transform(batch_size, 0)
     assert transforms.shape == (batch_size, 4, 3)
 
-    # Check numerical outputs are correct for a given seed - Pass
-    batch_size = 1
+    # Check the corners are transformed as expected
+    batch_size = 5
     scale = 0.1
     seed = 0
-    expected = tf.constant(
-        np.array(
-            [
-                [
-                    [9.4661278e-01, -3.8267835e-03, 3.6934228e-03],
-                    [5.5613145e-03, 9.8034811e-01, -1.8044969e-02],
-                    [1.9651605e-04, 1.4576728e-02, 9.6243286e-01],
-                    [-2.5107686e-03, 1.9579126e-02, -1.2195010e-02],
-                ]
-            ],
-            dtype=np.float32,
-        )
-    )  # shape = (1, 4, 3)
     got = deepreg.dataset.preprocess.gen_rand_affine_transform(
         batch_size=batch_size, scale=scale, seed=seed
+    )  # shape = (batch, 4, 3)
+    corners = preprocess.AFFINE_CORNERS  # shape = (4, 4)
+    new = np.einsum("ij,bjk->bik", corners, got.numpy())  # shape = (batch, 4, 3)
+    ratio = new / corners[None, :, :3]
+    assert np.all(ratio >= 1 - scale - 1e-5)
+    assert np.all(ratio <= 1 + 1e-5)
+
+    # Check seeded outputs are reproducible
+    assert is_equal_tf(
+        got,
+        deepreg.dataset.preprocess.gen_rand_affine_transform(
+            batch_size=batch_size, scale=scale, seed=seed
+        ),
+    )
+    assert is_equal_tf(
+        got,
+        deepreg.dataset.preprocess.gen_rand_affine_transform(
+            batch_size=batch_size, scale=scale, seed=tf.constant([seed, 0])
+        ),
+    )
+    assert not is_equal_tf(
+        got,
+        deepreg.dataset.preprocess.gen_rand_affine_transform(
+            batch_size=batch_size, scale=scale, seed=1
+        ),
+    )
+
+
+def test_random_transform_generator_graph():
+    """Check the stateless generation is compatible with graph mode."""
+    fn = tf.function(
+        lambda seed: preprocess.gen_rand_affine_transform(
+            batch_size=3, scale=0.1, seed=seed
+        )
+    )
+    seed = tf.constant([1, 2], dtype=tf.int64)
+    expected = preprocess.gen_rand_affine_transform(batch_size=3, scale=0.1, seed=seed)
+    assert is_equal_tf(fn(seed), expected)
+
+
+def test_gen_rand_ddf():
+    """Check output shape and seeded outputs are reproducible."""
+    args = dict(
+        batch_size=2,
+        image_size=(4, 5, 6),
+        field_strength=(1, 2, 3),
+        low_res_size=(2, 2, 3),
     )
-    assert is_equal_tf(got, expected)
+    got = preprocess.gen_rand_ddf(**args, seed=0)
+    assert got.shape == (2, 4, 5, 6, 3)
+    assert is_equal_tf(got, preprocess.gen_rand_ddf(**args, seed=0))
+    assert not is_equal_tf(got, preprocess.gen_rand_ddf(**args, seed=1))
+    assert preprocess.gen_rand_ddf(**args).shape == (2, 4, 5, 6, 3)
+
+
+def test_split_seed():
+    """Check derived seeds are different and reproducible."""
+    got = preprocess.split_seed(seed=0, num=3)
+    assert got.shape == (3, 2)
+    assert len(set(tuple(x) for x in got.numpy())) == 3
+    assert is_equal_tf(got, preprocess.split_seed(seed=tf.constant([0, 0]), num=3))
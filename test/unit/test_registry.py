@@ -105,6 +105,7 @@ class TestRegistry:
             "Data Augmentation": "da_class",
             "Data Loader": "data_loader_class",
             "File Loader": "file_loader_class",
+            "Metric": "metric_class",
         }
         for category in KNOWN_CATEGORIES:
             assert category in name_to_category.values()
@@ -0,0 +1,243 @@
+# coding=utf-8
+
+"""
+Tests for deepreg/serve.py
+"""
+import os
+import threading
+import time
+from test.unit.util import (
+    build_registration_model,
+    get_registration_config,
+    is_equal_np,
+)
+from typing import Dict, List
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from deepreg.dataset.loader.util import normalize_array
+from deepreg.serve import (
+    DynamicBatcher,
+    RegistrationClient,
+    RegistrationPredictor,
+    build_server,
+    decode_arrays,
+    encode_arrays,
+    load_test,
+)
+
+image_shape = (8, 8, 8)
+config = get_registration_config(image_shape=image_shape)
+
+
+def test_encode_decode():
+    arrays = dict(a=np.random.rand(2, 3).astype(np.float32), b=np.arange(4))
+    got = decode_arrays(encode_arrays(arrays))
+    assert sorted(got.keys()) == ["a", "b"]
+    for key, value in arrays.items():
+        assert got[key].dtype == value.dtype
+        assert is_equal_np(got[key], value)
+
+
+class TestRegistrationPredictor:
+    @pytest.fixture(scope="class")
+    def model(self) -> tf.keras.Model:
+        return build_registration_model(image_shape=image_shape, batch_size=2)
+
+    @pytest.fixture(scope="class")
+    def samples(self) -> List[Dict[str, np.ndarray]]:
+        rng = np.random.default_rng(0)
+        return [
+            dict(
+                moving_image=rng.random(image_shape, dtype=np.float32),
+                fixed_image=rng.random(image_shape, dtype=np.float32),
+                moving_label=rng.random(image_shape, dtype=np.float32),
+                fixed_label=rng.random(image_shape, dtype=np.float32),
+            ),
+            dict(
+                moving_image=rng.random(image_shape, dtype=np.float32),
+                fixed_image=rng.random(image_shape, dtype=np.float32),
+            ),
+        ]
+
+    @pytest.mark.parametrize("num_samples", [1, 2])
+    def test_call(self, model, samples, num_samples: int):
+        predictor = RegistrationPredictor(model=model)
+        got = predictor(samples[:num_samples])
+        assert len(got) == num_samples
+        assert sorted(got[0].keys()) == ["ddf", "pred_fixed_image", "pred_fixed_label"]
+        # the label outputs are not returned without labels
+        if num_samples == 2:
+            assert sorted(got[1].keys()) == ["ddf", "pred_fixed_image"]
+
+        # same as predicting with the model,
+        # the images being normalized as in the data loaders
+        inputs = {
+            key: tf.stack([normalize_array(samples[0][key])] * 2)
+            for key in ["moving_image", "fixed_image"]
+        }
+        inputs.update(
+            {
+                key: tf.stack([samples[0][key]] * 2)
+                for key in ["moving_label", "fixed_label"]
+            }
+        )
+        inputs["indices"] = tf.zeros((2, 3))
+        expected = model(inputs, training=False)
+        for key, value in got[0].items():
+            assert is_equal_np(value, expected[key][0], atol=1e-5)
+
+    def test_call_normalize(self, model, samples):
+        predictor = RegistrationPredictor(model=model)
+        expected = predictor(samples[:1])[0]
+        # the images are normalized, so the intensity range does not matter
+        sample = dict(samples[0])
+        sample["moving_image"] = sample["moving_image"] * 1000 - 200
+        sample["fixed_image"] = sample["fixed_image"] * 50 + 10
+        got = predictor([sample])[0]
+        for key, value in expected.items():
+            assert is_equal_np(got[key], value, atol=1e-5)
+
+    @pytest.mark.parametrize(
+        "sample,err_msg",
+        [
+            (dict(moving_image=np.zeros(image_shape)), "fixed_image is missing"),
+            (
+                dict(
+                    moving_image=np.zeros(image_shape),
+                    fixed_image=np.zeros(image_shape),
+                    moving_label=np.zeros(image_shape),
+                ),
+                "must be given together",
+            ),
+            (
+                dict(
+                    moving_image=np.zeros((8, 8, 4)), fixed_image=np.zeros(image_shape)
+                ),
+                "moving_image must be of shape (8, 8, 8), got (8, 8, 4)",
+            ),
+        ],
+    )
+    def test_check_sample(self, model, sample: dict, err_msg: str):
+        predictor = RegistrationPredictor(model=model)
+        with pytest.raises(ValueError) as err_info:
+            predictor.check_sample(sample)
+        assert err_msg in str(err_info.value)
+
+
+class TestDynamicBatcher:
+    @staticmethod
+    def predict_fn(samples: List[Dict]) -> List[Dict]:
+        return [dict(value=x["value"] * 2, batch=len(samples)) for x in samples]
+
+    def test_batch(self):
+        with DynamicBatcher(
+            predict_fn=self.predict_fn, batch_size=3, max_latency=1.0
+        ) as batcher:
+            futures = [batcher.submit(dict(value=i)) for i in range(7)]
+            got = [future.result(timeout=10) for future in futures]
+        assert [x["value"] for x in got] == [0, 2, 4, 6, 8, 10, 12]
+        # the queue is filled before the first batch is collected
+        assert [x["batch"] for x in got] == [3, 3, 3, 3, 3, 3, 1]
+        assert batcher.num_batches == 3
+        assert batcher.num_samples == 7
+
+    def test_max_latency(self):
+        with DynamicBatcher(
+            predict_fn=self.predict_fn, batch_size=4, max_latency=0.01
+        ) as batcher:
+            start = time.monotonic()
+            got = batcher.submit(dict(value=1)).result(timeout=10)
+            assert time.monotonic() - start < 1
+        assert got == dict(value=2, batch=1)
+
+    def test_concurrent(self):
+        results = {}
+
+        with DynamicBatcher(
+            predict_fn=self.predict_fn, batch_size=4, max_latency=0.05
+        ) as batcher:
+
+            def run(i: int):
+                results[i] = batcher.submit(dict(value=i)).result(timeout=10)
+
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert {k: v["value"] for k, v in results.items()} == {
+            i: i * 2 for i in range(8)
+        }
+        assert batcher.num_batches < 8
+
+    def test_err(self):
+        def predict_fn(samples: List[Dict]) -> List[Dict]:
+            raise RuntimeError("failed")
+
+        with DynamicBatcher(
+            predict_fn=predict_fn, batch_size=2, max_latency=0.01
+        ) as batcher:
+            future = batcher.submit(dict(value=1))
+            with pytest.raises(RuntimeError) as err_info:
+                future.result(timeout=10)
+        assert "failed" in str(err_info.value)
+
+
+class TestServer:
+    @pytest.fixture(scope="class")
+    def predictor(self) -> RegistrationPredictor:
+        predictor = RegistrationPredictor(
+            model=build_registration_model(image_shape=image_shape, batch_size=2)
+        )
+        predictor.warm_up()
+        return predictor
+
+    @pytest.mark.parametrize("use_socket", [False, True])
+    def test_serve(self, predictor, tmp_path, use_socket: bool):
+        socket_path = os.path.join(tmp_path, "serve.sock") if use_socket else None
+        with DynamicBatcher(
+            predict_fn=predictor, batch_size=2, max_latency=0.01
+        ) as batcher:
+            server = build_server(
+                predictor=predictor, batcher=batcher, port=0, socket_path=socket_path
+            )
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            address = (
+                dict(socket_path=socket_path)
+                if use_socket
+                else dict(port=server.server_address[1])
+            )
+            try:
+                client = RegistrationClient(**address)  # type: ignore
+                status = client.health()
+                assert status["moving_image_shape"] == list(image_shape)
+                assert status["labeled"]
+                assert status["batch_size"] == 2
+
+                sample = dict(
+                    moving_image=np.random.rand(*image_shape).astype(np.float32),
+                    fixed_image=np.random.rand(*image_shape).astype(np.float32),
+                )
+                got = client.predict(sample)
+                expected = predictor([sample])[0]
+                assert sorted(got.keys()) == ["ddf", "pred_fixed_image"]
+                for key, value in expected.items():
+                    assert is_equal_np(got[key], value, atol=1e-5)
+
+                # wrong shapes
+                with pytest.raises(ValueError) as err_info:
+                    client.predict(dict(moving_image=np.zeros((2, 2, 2))))
+                assert "status 400" in str(err_info.value)
+                client.close()
+
+                stats = load_test(num_requests=6, concurrency=3, **address)
+                assert stats["num_requests"] == 6
+                assert 0 < stats["p50_ms"] <= stats["p99_ms"]
+                assert stats["throughput"] > 0
+            finally:
+                server.shutdown()
+                server.server_close()
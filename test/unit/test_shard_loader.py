@@ -0,0 +1,132 @@
+"""
+Tests functionality of the ShardFileLoader
+"""
+import os
+from test.unit.util import is_equal_np
+
+import numpy as np
+import pytest
+
+from deepreg.convert import convert
+from deepreg.dataset.loader.nifti_loader import NiftiFileLoader
+from deepreg.dataset.loader.shard_loader import (
+    ShardFileLoader,
+    get_shard_file_paths,
+    read_shard_header,
+    write_shard,
+)
+
+
+@pytest.fixture(scope="module")
+def shard_dir(tmp_path_factory) -> str:
+    """Convert the grouped and unpaired nifti test data into shards."""
+    out_dir = str(tmp_path_factory.mktemp("shard"))
+    for data_type in ["grouped", "unpaired"]:
+        convert(
+            data_dir=f"./data/test/nifti/{data_type}/test",
+            out_dir=os.path.join(out_dir, data_type),
+            data_format="nifti",
+            data_type=data_type,
+        )
+    return out_dir
+
+
+def test_write_read_shard(tmp_path):
+    file_path = os.path.join(tmp_path, "images-00000-of-00001.shard")
+    data = [
+        (("a",), np.random.rand(2, 3, 4).astype(np.float32)),
+        (("b",), np.ones((5, 6, 7, 2), dtype=np.uint8)),
+    ]
+    write_shard(
+        file_path=file_path, data=data, grouped=False, label=True, validated=True
+    )
+    header = read_shard_header(file_path=file_path)
+    assert header["grouped"] is False
+    assert header["validated"] is True
+    assert [x["id"] for x in header["data"]] == [["a"], ["b"]]
+    assert [x["shape"] for x in header["data"]] == [[2, 3, 4], [5, 6, 7, 2]]
+    assert [x["num_labels"] for x in header["data"]] == [1, 2]
+    assert all(x["offset"] % 64 == 0 for x in header["data"])
+
+    loader = ShardFileLoader(dir_paths=[str(tmp_path)], name="images", grouped=False)
+    assert loader.get_num_images() == 2
+    assert loader.validated
+    for index, (_, expected) in enumerate(data):
+        got = loader.get_data(index=index)
+        assert got.dtype == np.float32
+        assert is_equal_np(got, expected)
+    assert loader.get_data_source(index=1) == (file_path, "b")
+    loader.close()
+
+
+def test_read_shard_header_err(tmp_path):
+    file_path = os.path.join(tmp_path, "images-00000-of-00001.shard")
+    with open(file_path, "wb") as f:
+        f.write(b"not a shard")
+    with pytest.raises(ValueError) as err_info:
+        read_shard_header(file_path=file_path)
+    assert "is not a DeepReg shard file" in str(err_info.value)
+
+
+class TestShardFileLoader:
+    @pytest.mark.parametrize(
+        "data_type,name", [("unpaired", "images"), ("grouped", "labels")]
+    )
+    def test_get_data(self, shard_dir, data_type, name):
+        grouped = data_type == "grouped"
+        expected_loader = NiftiFileLoader(
+            dir_paths=[f"./data/test/nifti/{data_type}/test"],
+            name=name,
+            grouped=grouped,
+        )
+        loader = ShardFileLoader(
+            dir_paths=[os.path.join(shard_dir, data_type)], name=name, grouped=grouped
+        )
+        # ids are the same besides the directory
+        assert [x[1:] for x in loader.get_data_ids()] == [
+            x[1:] for x in expected_loader.get_data_ids()
+        ]
+        assert loader.get_num_images() == expected_loader.get_num_images()
+        if grouped:
+            assert loader.group_struct == expected_loader.group_struct
+            indices = [
+                (group_index, in_group_index)
+                for group_index, group in enumerate(loader.group_struct)
+                for in_group_index in range(len(group))
+            ]
+        else:
+            indices = list(range(loader.get_num_images()))
+        for index in indices:
+            assert is_equal_np(loader.get_data(index), expected_loader.get_data(index))
+        loader.close()
+        expected_loader.close()
+
+    def test_init_err(self, shard_dir):
+        with pytest.raises(AssertionError) as err_info:
+            ShardFileLoader(dir_paths=[shard_dir], name="images", grouped=False)
+        assert "do not exist" in str(err_info.value)
+        with pytest.raises(ValueError) as err_info:
+            ShardFileLoader(
+                dir_paths=[os.path.join(shard_dir, "unpaired")],
+                name="images",
+                grouped=True,
+            )
+        assert "but the loader has grouped=True" in str(err_info.value)
+
+    def test_get_data_err(self, shard_dir):
+        loader = ShardFileLoader(
+            dir_paths=[os.path.join(shard_dir, "unpaired")],
+            name="images",
+            grouped=False,
+        )
+        with pytest.raises(ValueError) as err_info:
+            loader.get_data(index="wrong")
+        assert "must be int, or tuple" in str(err_info.value)
+        loader.close()
+
+
+def test_get_shard_file_paths(shard_dir):
+    got = get_shard_file_paths(
+        dir_path=os.path.join(shard_dir, "unpaired"), name="labels"
+    )
+    assert [os.path.basename(x) for x in got] == ["labels-00000-of-00001.shard"]
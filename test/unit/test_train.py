@@ -91,6 +91,8 @@ def test_train_and_predict_main(config_paths):
             "test_predict",
             "--save_nifti",
             "--save_png",
+            "--label_interpolation",
+            "nearest",
         ]
     )
 
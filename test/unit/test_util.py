@@ -4,18 +4,23 @@ import shutil
 from test.unit.util import is_equal_np
 from typing import Tuple
 
+import h5py
+import matplotlib.pyplot as plt
 import nibabel as nib
 import numpy as np
 import pytest
 import tensorflow as tf
+from PIL import Image
 
 from deepreg.dataset.loader.interface import DataLoader
 from deepreg.dataset.loader.nifti_loader import load_nifti_file
 from deepreg.train import build_config
 from deepreg.util import (
+    ArrayWriter,
     build_dataset,
     build_log_dir,
-    calculate_metrics,
+    colorize_slices,
+    compact_rgba,
     save_array,
     save_metric_dict,
 )
@@ -180,77 +185,255 @@ class TestSaveArray:
         arr_read = load_nifti_file(file_path=nifti_file_path)
         assert is_equal_np(arr2 if overwrite else arr1, arr_read)
 
-
-def test_calculate_metrics():
-    """
-    Test calculate_metrics by checking output keys.
-    Assuming the metrics functions are correct.
-    """
-
-    batch_size = 2
-    fixed_image_shape = (4, 4, 4)  # (f_dim1, f_dim2, f_dim3)
-
-    fixed_image = tf.random.uniform(shape=(batch_size,) + fixed_image_shape)
-    fixed_label = tf.random.uniform(shape=(batch_size,) + fixed_image_shape)
-    pred_fixed_image = tf.random.uniform(shape=(batch_size,) + fixed_image_shape)
-    pred_fixed_label = tf.random.uniform(shape=(batch_size,) + fixed_image_shape)
-    fixed_grid_ref = tf.random.uniform(shape=(1,) + fixed_image_shape + (3,))
-    sample_index = 0
-
-    # labeled and have pred_fixed_image
-    got = calculate_metrics(
-        fixed_image=fixed_image,
-        fixed_label=fixed_label,
-        pred_fixed_image=pred_fixed_image,
-        pred_fixed_label=pred_fixed_label,
-        fixed_grid_ref=fixed_grid_ref,
-        sample_index=sample_index,
+    @pytest.mark.parametrize(
+        "arr",
+        [
+            np.random.rand(2, 3, 4),
+            np.random.rand(2, 3, 4).astype(np.float32),
+            np.random.rand(2, 3, 4, 3),
+        ],
     )
-    assert got["image_ssd"] is not None
-    assert got["label_binary_dice"] is not None
-    assert got["label_tre"] is not None
-    assert sorted(list(got.keys())) == sorted(
-        ["image_ssd", "label_binary_dice", "label_tre"]
+    def test_same_as_imsave(self, arr: np.ndarray):
+        save_array(
+            save_dir=self.save_dir,
+            arr=arr,
+            name=self.arr_name,
+            normalize=False,
+            save_nifti=False,
+        )
+        is_4d = len(arr.shape) == 4
+        for depth_index in range(arr.shape[2]):
+            expected_path = os.path.join(self.save_dir, "expected.png")
+            plt.imsave(
+                fname=expected_path,
+                arr=arr[:, :, depth_index],
+                vmin=0,
+                vmax=1,
+                cmap="PiYG" if is_4d else "gray",
+            )
+            got_path = os.path.join(
+                self.png_dir, f"depth{depth_index}_{self.arr_name}.png"
+            )
+            expected = np.asarray(Image.open(expected_path).convert("RGBA"))
+            got = np.asarray(Image.open(got_path).convert("RGBA"))
+            assert np.array_equal(got, expected)
+
+    @pytest.mark.parametrize(
+        "arr", [np.random.rand(2, 3, 5), np.random.rand(2, 3, 5, 3)]
     )
+    def test_montage(self, arr: np.ndarray):
+        save_array(
+            save_dir=self.save_dir,
+            arr=arr,
+            name=self.arr_name,
+            normalize=False,
+            save_nifti=False,
+            png_layout="montage",
+        )
+        assert not os.path.exists(self.png_dir)
+        got = np.asarray(
+            Image.open(os.path.join(self.save_dir, self.arr_name + ".png"))
+        )
+        expected = compact_rgba(colorize_slices(arr, cmap="gray"))
+        # 5 slices are tiled in 2 rows and 3 columns
+        assert got.shape[:2] == (4, 9)
+        assert np.array_equal(got[:2, 3:6], expected[1])
+        assert np.array_equal(got[2:, 3:6], expected[4])
+        assert np.all(got[2:, 6:] == 0)
+
+    def test_stack(self):
+        arr = np.random.rand(2, 3, 4)
+        save_array(
+            save_dir=self.save_dir,
+            arr=arr,
+            name=self.arr_name,
+            normalize=False,
+            save_nifti=False,
+            png_layout="stack",
+        )
+        image = Image.open(os.path.join(self.save_dir, self.arr_name + ".tiff"))
+        expected = compact_rgba(colorize_slices(arr, cmap="gray"))
+        assert image.n_frames == 4
+        for depth_index in range(4):
+            image.seek(depth_index)
+            assert np.array_equal(np.asarray(image), expected[depth_index])
+
+    @pytest.mark.parametrize("volume_format", ["nii.gz", "nii", "h5"])
+    @pytest.mark.parametrize("compression_level", [None, 0, 6])
+    def test_volume_format(self, volume_format: str, compression_level: int):
+        arr = np.random.rand(2, 3, 4, 3).astype(np.float32)
+        affine = np.diag([2.0, 3.0, 4.0, 1.0])
+        save_array(
+            save_dir=self.save_dir,
+            arr=arr,
+            name=self.arr_name,
+            normalize=True,
+            save_png=False,
+            volume_format=volume_format,
+            compression_level=compression_level,
+            affine=affine,
+        )
+        file_path = os.path.join(self.save_dir, f"{self.arr_name}.{volume_format}")
+        assert os.listdir(self.save_dir) == [os.path.basename(file_path)]
+        if volume_format == "h5":
+            with h5py.File(file_path, "r") as h5_file:
+                got = h5_file["data"][()]
+                got_affine = h5_file["data"].attrs["affine"]
+                assert h5_file["data"].chunks == (2, 3, 1, 3)
+        else:
+            got = load_nifti_file(file_path=file_path)
+            got_affine = nib.load(file_path).affine
+        assert is_equal_np(got, arr)
+        assert is_equal_np(got_affine, affine)
+
+    def test_wrong_volume_format(self):
+        with pytest.raises(ValueError) as err_info:
+            save_array(
+                save_dir=self.save_dir,
+                arr=np.random.rand(2, 3, 4),
+                name=self.arr_name,
+                normalize=True,
+                volume_format="mha",
+            )
+        assert "volume_format must be nii.gz, nii or h5" in str(err_info.value)
 
-    # labeled and do not have pred_fixed_image
-    got = calculate_metrics(
-        fixed_image=fixed_image,
-        fixed_label=fixed_label,
-        pred_fixed_image=None,
-        pred_fixed_label=pred_fixed_label,
-        fixed_grid_ref=fixed_grid_ref,
-        sample_index=sample_index,
+    def test_wrong_layout(self):
+        with pytest.raises(ValueError) as err_info:
+            save_array(
+                save_dir=self.save_dir,
+                arr=np.random.rand(2, 3, 4),
+                name=self.arr_name,
+                normalize=True,
+                png_layout="gif",
+            )
+        assert "png_layout must be slices, montage or stack" in str(err_info.value)
+
+
+class TestColorizeSlices:
+    def test_out_of_range(self):
+        arr = np.array([np.nan, -1.0, -1e-3, 0.0, 0.5, 1.0, 1.5])[None, None, :]
+        got = colorize_slices(arr=arr, cmap="PiYG")
+        expected = plt.get_cmap("PiYG")(arr[0, 0, :], bytes=True)
+        assert np.array_equal(got[:, 0, 0, :], expected)
+
+    def test_rgb_out_of_range(self):
+        with pytest.raises(ValueError) as err_info:
+            colorize_slices(arr=np.full((2, 3, 4, 3), 2.0), cmap="gray")
+        assert "RGB values must be between [0, 1]" in str(err_info.value)
+
+    @pytest.mark.parametrize(
+        "rgba,expected_shape",
+        [
+            ([[0, 0, 0, 255], [9, 9, 9, 255]], (2,)),
+            ([[0, 1, 0, 255], [9, 9, 9, 255]], (2, 3)),
+            ([[0, 0, 0, 0], [9, 9, 9, 255]], (2, 4)),
+        ],
     )
-    assert got["image_ssd"] is None
-    assert got["label_binary_dice"] is not None
-    assert got["label_tre"] is not None
-
-    # unlabeled and have pred_fixed_image
-    got = calculate_metrics(
-        fixed_image=fixed_image,
-        fixed_label=None,
-        pred_fixed_image=pred_fixed_image,
-        pred_fixed_label=None,
-        fixed_grid_ref=fixed_grid_ref,
-        sample_index=sample_index,
+    def test_compact_rgba(self, rgba: list, expected_shape: tuple):
+        rgba = np.array(rgba, dtype=np.uint8)
+        got = compact_rgba(rgba)
+        assert got.shape == expected_shape
+        assert np.array_equal(
+            np.asarray(Image.fromarray(got[None, ...]).convert("RGBA"))[0], rgba
+        )
+
+
+class TestArrayWriter:
+    save_dir = "logs/test_util_array_writer"
+    num_arrays = 5
+
+    def setup_method(self, method):
+        if os.path.exists(self.save_dir):
+            shutil.rmtree(self.save_dir)
+
+    def teardown_method(self, method):
+        if os.path.exists(self.save_dir):
+            shutil.rmtree(self.save_dir)
+
+    @pytest.mark.parametrize(
+        "num_workers,max_pending,use_processes",
+        [(0, None, False), (2, None, False), (3, 1, False), (2, 2, True)],
     )
-    assert got["image_ssd"] is not None
-    assert got["label_binary_dice"] is None
-    assert got["label_tre"] is None
-
-    # unlabeled and do not have pred_fixed_image
-    got = calculate_metrics(
-        fixed_image=fixed_image,
-        fixed_label=None,
-        pred_fixed_image=None,
-        pred_fixed_label=None,
-        fixed_grid_ref=fixed_grid_ref,
-        sample_index=sample_index,
+    def test_save(self, num_workers: int, max_pending: int, use_processes: bool):
+        arrs = [np.random.rand(2, 3, 4) for _ in range(self.num_arrays)]
+        with ArrayWriter(
+            num_workers=num_workers,
+            max_pending=max_pending,
+            use_processes=use_processes,
+        ) as writer:
+            for i, arr in enumerate(arrs):
+                writer.save(
+                    save_dir=self.save_dir, arr=arr, name=f"arr{i}", normalize=True
+                )
+                if writer.max_pending > 0:
+                    assert len(writer._pending) <= writer.max_pending
+        for i, arr in enumerate(arrs):
+            arr_read = load_nifti_file(
+                file_path=os.path.join(self.save_dir, f"arr{i}.nii.gz")
+            )
+            assert is_equal_np(arr, arr_read)
+            png_dir = os.path.join(self.save_dir, f"arr{i}")
+            assert len([x for x in os.listdir(png_dir) if x.endswith(".png")]) == 4
+
+    def test_not_overwrite(self):
+        arr1 = np.random.rand(2, 3, 4)
+        arr2 = arr1 + 1
+        with ArrayWriter(num_workers=2) as writer:
+            for arr in [arr1, arr2]:
+                writer.save(
+                    save_dir=self.save_dir,
+                    arr=arr,
+                    name="arr",
+                    normalize=True,
+                    overwrite=False,
+                )
+            assert len(writer._pending) == 1
+        arr_read = load_nifti_file(file_path=os.path.join(self.save_dir, "arr.nii.gz"))
+        assert is_equal_np(arr1, arr_read)
+
+    def test_error(self):
+        writer = ArrayWriter(num_workers=2)
+        writer.save(
+            save_dir=self.save_dir,
+            arr=np.random.rand(2, 3, 4),
+            name="arr0",
+            normalize=True,
+        )
+        writer.save(
+            save_dir=self.save_dir,
+            arr=np.random.rand(2, 3),
+            name="arr1",
+            normalize=True,
+        )
+        with pytest.raises(ValueError) as err_info:
+            writer.close()
+        assert "arr must be 3d or 4d numpy array or tf tensor" in str(err_info.value)
+        # other arrays are still saved
+        assert os.path.exists(os.path.join(self.save_dir, "arr0.nii.gz"))
+
+    def test_error_in_context(self):
+        # the original exception is not hidden by the errors of workers
+        with pytest.raises(KeyError):
+            with ArrayWriter(num_workers=1) as writer:
+                writer.save(
+                    save_dir=self.save_dir,
+                    arr=np.random.rand(2, 3),
+                    name="arr",
+                    normalize=True,
+                )
+                raise KeyError
+
+    @pytest.mark.parametrize(
+        "num_workers,max_pending,err_msg",
+        [
+            (-1, None, "num_workers must be non-negative"),
+            (2, 0, "max_pending must be positive"),
+        ],
     )
-    assert got["image_ssd"] is None
-    assert got["label_binary_dice"] is None
-    assert got["label_tre"] is None
+    def test_wrong_args(self, num_workers: int, max_pending: int, err_msg: str):
+        with pytest.raises(ValueError) as err_info:
+            ArrayWriter(num_workers=num_workers, max_pending=max_pending)
+        assert err_msg in str(err_info.value)
 
 
 def test_save_metric_dict():
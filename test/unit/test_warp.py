@@ -1,5 +1,6 @@
 import os
 
+import nibabel as nib
 import numpy as np
 import pytest
 
@@ -24,6 +25,44 @@ def test_main(out_path: str, expected_path: str):
     os.remove(expected_path)
 
 
+@pytest.mark.parametrize("interpolation", ["nearest", "cubic"])
+def test_main_interpolation(interpolation: str):
+    out_path = "logs/test_warp/out.nii.gz"
+    main(
+        args=[
+            "--image",
+            image_path,
+            "--ddf",
+            ddf_path,
+            "--out",
+            out_path,
+            "--interpolation",
+            interpolation,
+        ]
+    )
+    assert os.path.isfile(out_path)
+    os.remove(out_path)
+
+
+def test_main_compression_level():
+    out_path = "logs/test_warp/out.nii.gz"
+    main(
+        args=[
+            "--image",
+            image_path,
+            "--ddf",
+            ddf_path,
+            "--out",
+            out_path,
+            "--compression_level",
+            "9",
+        ]
+    )
+    # the warped image is on the ddf grid
+    assert np.array_equal(nib.load(out_path).affine, nib.load(ddf_path).affine)
+    os.remove(out_path)
+
+
 class TestShapeSanityCheck:
     @pytest.mark.parametrize(
         ("image_shape", "ddf_shape"),
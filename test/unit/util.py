@@ -1,8 +1,10 @@
-from typing import List, Union
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 import tensorflow as tf
 
+from deepreg.model.network import build_model_from_config
+
 
 def is_equal_np(
     x: Union[np.ndarray, List], y: Union[np.ndarray, List], atol: float = 1.0e-7
@@ -36,3 +38,41 @@ def is_equal_tf(
     x = tf.cast(x, dtype=tf.float32).numpy()
     y = tf.cast(y, dtype=tf.float32).numpy()
     return x.shape == y.shape and np.all(np.isclose(x, y, atol=atol))
+
+
+def get_registration_config(image_shape: Tuple[int, ...]) -> Dict:
+    """
+    Get the configuration of a small unpaired labeled DDF model.
+
+    :param image_shape: shape of the moving and fixed images
+    :return: configuration with sections dataset and train
+    """
+    return dict(
+        dataset=dict(type="unpaired", labeled=True, image_shape=list(image_shape)),
+        train=dict(
+            method="ddf",
+            backbone=dict(
+                name="local",
+                num_channel_initial=4,
+                extract_levels=[1, 2],
+                out_kernel_initializer="glorot_uniform",
+            ),
+            loss=dict(image=dict(name="lncc", weight=1.0)),
+        ),
+    )
+
+
+def build_registration_model(
+    image_shape: Tuple[int, ...], batch_size: int
+) -> tf.keras.Model:
+    """
+    Build a small model with random weights, without loading any data.
+
+    :param image_shape: shape of the moving and fixed images
+    :param batch_size: batch size of the model
+    :return: the built model
+    """
+    return build_model_from_config(
+        config=get_registration_config(image_shape=image_shape),
+        batch_size=batch_size,
+    )